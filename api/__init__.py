@@ -4,6 +4,8 @@ from .messages import messages_bp
 from .status import status_bp
 from .simple_cache import simple_cache_bp
 from .message_queue import message_queue_bp
+from .metrics import metrics_bp
+from .traces import traces_bp
 
 # Crear el blueprint principal de la API
 api_bp = Blueprint('api', __name__)
@@ -15,5 +17,7 @@ def register_blueprints(app):
     app.register_blueprint(status_bp, url_prefix='/api')
     app.register_blueprint(simple_cache_bp, url_prefix='/api')
     app.register_blueprint(message_queue_bp, url_prefix='/api')
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(traces_bp, url_prefix='/api')
 
 __all__ = ['api_bp', 'register_blueprints']
@@ -2,13 +2,23 @@ from flask import Blueprint, jsonify, request
 import logging
 import time
 from services.message_queue_service import MessageQueueService
+from services.ingestion_service import IngestionService
+from services.dedup_service import get_duplicate_filter
+from services.status_coalescer import get_status_coalescer
+from services.event_router import get_event_router
 
 logger = logging.getLogger(__name__)
 
 message_queue_bp = Blueprint('message_queue', __name__)
 
+
+def _is_count(value) -> bool:
+    """Entero no negativo (bool no cuenta aunque sea subclase de int)"""
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
 # Inicializar servicio
 message_queue_service = MessageQueueService()
+ingestion_service = IngestionService()
 
 @message_queue_bp.route('/queue/status', methods=['GET'])
 def get_queue_status():
@@ -20,7 +30,11 @@ def get_queue_status():
         return jsonify({
             "success": True,
             "status": status,
-            "queue_lengths": lengths
+            "queue_lengths": lengths,
+            "ingestion": ingestion_service.get_status(),
+            "dedup": get_duplicate_filter().get_stats(),
+            "status_coalescing": get_status_coalescer().get_stats(),
+            "routing": get_event_router().get_stats()
         }), 200
         
     except Exception as e:
@@ -52,8 +66,12 @@ def get_queue_lengths():
 def retry_failed_messages():
     """Reintenta mensajes fallidos"""
     try:
-        limit = request.json.get('limit', 10) if request.json else 10
-        
+        data = request.get_json(silent=True) or {}
+        limit = data.get('limit', 10)
+
+        if not _is_count(limit):
+            return jsonify({"success": False, "error": "'limit' debe ser un entero no negativo"}), 400
+
         result = message_queue_service.retry_failed_messages(limit)
         
         return jsonify({
@@ -68,6 +86,67 @@ def retry_failed_messages():
             "error": str(e)
         }), 500
 
+@message_queue_bp.route('/queue/dead_letters', methods=['GET'])
+def list_dead_letters():
+    """Lista los eventos que agotaron sus intentos de reenvío"""
+    try:
+        limit = request.args.get('limit', 50, type=int)
+        offset = request.args.get('offset', 0, type=int)
+        sink = request.args.get('sink')
+
+        result = message_queue_service.list_dead_letters(limit, offset, sink)
+        return jsonify(result), 200 if result.get("success") else 500
+
+    except Exception as e:
+        logger.error(f"Error listando dead-letter queue: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@message_queue_bp.route('/queue/dead_letters/replay', methods=['POST'])
+def replay_dead_letters():
+    """Vuelve a encolar eventos de la dead-letter queue (ids concretos o los más antiguos)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        ids = data.get('ids')
+        limit = data.get('limit', 10)
+
+        if ids is not None and (not isinstance(ids, list) or not ids):
+            return jsonify({"success": False, "error": "'ids' debe ser una lista no vacía"}), 400
+        if not _is_count(limit):
+            return jsonify({"success": False, "error": "'limit' debe ser un entero no negativo"}), 400
+
+        result = message_queue_service.replay_dead_letters(ids, limit)
+        return jsonify(result), 200 if result.get("success") else 500
+
+    except Exception as e:
+        logger.error(f"Error en replay de dead-letter queue: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@message_queue_bp.route('/queue/dead_letters', methods=['DELETE'])
+def purge_dead_letters():
+    """Elimina eventos de la dead-letter queue (todos si no se envían ids)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        ids = data.get('ids')
+
+        if ids is not None and (not isinstance(ids, list) or not ids):
+            return jsonify({"success": False, "error": "'ids' debe ser una lista no vacía"}), 400
+
+        result = message_queue_service.purge_dead_letters(ids)
+        return jsonify(result), 200 if result.get("success") else 500
+
+    except Exception as e:
+        logger.error(f"Error purgando dead-letter queue: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
 @message_queue_bp.route('/queue/clear', methods=['DELETE'])
 def clear_all_queues():
     """Limpia todas las colas (usar con precaución)"""
@@ -0,0 +1,16 @@
+from flask import Blueprint, Response
+import logging
+from services.metrics import get_metrics_registry
+
+logger = logging.getLogger(__name__)
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas del pipeline en formato de texto de Prometheus (todos los procesos)"""
+    try:
+        return Response(get_metrics_registry().render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+    except Exception as e:
+        logger.error(f"Error generando métricas: {str(e)}")
+        return Response(f"# error: {str(e)}\n", status=500, mimetype='text/plain')
@@ -1,4 +1,5 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+import json
 import logging
 from services.simple_cache import get_number_cache
 
@@ -8,9 +9,40 @@ simple_cache_bp = Blueprint('simple_cache', __name__)
 
 @simple_cache_bp.route('/numbers', methods=['GET'])
 def get_numbers():
-    """Obtiene todos los números"""
+    """Obtiene los números: todos, por páginas (?limit=&cursor=) o en streaming NDJSON (?format=ndjson)"""
     try:
         cache = get_number_cache()
+
+        if request.args.get('format') == 'ndjson':
+            def generate():
+                try:
+                    for number in cache.iter_numbers():
+                        yield json.dumps(number, ensure_ascii=False) + '\n'
+                except Exception as e:
+                    logger.error(f"Error streaming numbers: {str(e)}")
+                    raise
+
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+        if 'limit' in request.args or 'cursor' in request.args:
+            try:
+                limit = int(request.args.get('limit', 100))
+            except ValueError:
+                limit = 0
+            if limit < 1 or limit > cache.PAGE_MAX_LIMIT:
+                return jsonify({"error": f"limit must be between 1 and {cache.PAGE_MAX_LIMIT}"}), 400
+            try:
+                page = cache.list_numbers(limit, request.args.get('cursor'))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+            return jsonify({
+                "success": True,
+                "numbers": page["numbers"],
+                "count": len(page["numbers"]),
+                "next_cursor": page["next_cursor"]
+            }), 200
+
         numbers = cache.get_all_numbers()
         return jsonify({
             "success": True,
@@ -159,6 +191,49 @@ def add_number():
         logger.error(f"Error adding number: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@simple_cache_bp.route('/numbers/bulk', methods=['POST'])
+def bulk_add_numbers():
+    """Crea o actualiza muchos números en una sola transacción"""
+    try:
+        import os
+
+        request_data = request.json
+        if not request_data:
+            return jsonify({"error": "No data provided"}), 400
+
+        numbers = request_data.get('numbers')
+        if not numbers or not isinstance(numbers, list):
+            return jsonify({"error": "numbers list is required"}), 400
+
+        max_rows = int(os.getenv('CACHE_BULK_MAX_ROWS', 100000))
+        if len(numbers) > max_rows:
+            return jsonify({"error": f"Too many numbers: {len(numbers)} (max {max_rows})"}), 413
+
+        cache = get_number_cache()
+        result = cache.bulk_upsert(numbers)
+
+        if not result["success"]:
+            return jsonify({
+                "success": False,
+                "error": result["error"],
+                "invalid": result["invalid"],
+                "errors": result["errors"]
+            }), 500
+
+        return jsonify({
+            "success": True,
+            "message": f"Bulk import completed: {result['created']} created, {result['updated']} updated, {result['invalid']} invalid",
+            "total": len(numbers),
+            "created": result["created"],
+            "updated": result["updated"],
+            "invalid": result["invalid"],
+            "errors": result["errors"]
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Error in bulk import: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @simple_cache_bp.route('/numbers/<phone>', methods=['DELETE'])
 def delete_number(phone: str):
     """Elimina un número"""
@@ -182,77 +257,40 @@ def delete_number(phone: str):
 
 @simple_cache_bp.route('/numbers/bulk-update', methods=['PATCH'])
 def bulk_update_numbers():
-    """Actualiza los datos de múltiples números en el cache de manera simultánea"""
+    """Actualiza los datos de múltiples números en el cache en una sola transacción"""
     try:
-        from concurrent.futures import ThreadPoolExecutor, as_completed
-        import os
-        
         cache = get_number_cache()
         request_data = request.json
         
         if not request_data:
             return jsonify({"error": "No data provided"}), 400
+        if not isinstance(request_data, dict):
+            return jsonify({"error": "Request body must be a JSON object"}), 400
         
         phones = request_data.get('phones')
         if not phones or not isinstance(phones, list):
             return jsonify({"error": "phones list is required"}), 400
+        if not all(isinstance(phone, str) for phone in phones):
+            return jsonify({"error": "phones must be a list of strings"}), 400
         
         data = request_data.get('data')
         if not data:
             return jsonify({"error": "Data object is required"}), 400
+        if not isinstance(data, dict):
+            return jsonify({"error": "data must be a JSON object"}), 400
         
-        # Función para actualizar un solo número
-        def update_single_number(phone):
-            try:
-                success = cache.update_number_data(phone, data)
-                return {
-                    "phone": phone,
-                    "success": success,
-                    "error": None if success else "Number not found"
-                }
-            except Exception as e:
-                return {
-                    "phone": phone,
-                    "success": False,
-                    "error": str(e)
-                }
+        # Un solo UPDATE por bloque de teléfonos: el parche se aplica dentro de SQLite
+        details = cache.bulk_update_number_data(phones, data)
+        successful = sum(1 for detail in details if detail["success"])
         
         # Resultados de la operación bulk
         results = {
             "total": len(phones),
-            "successful": 0,
-            "failed": 0,
-            "details": []
+            "successful": successful,
+            "failed": len(details) - successful,
+            "details": details
         }
         
-        # Obtener número máximo de workers desde variable de entorno
-        max_workers = int(os.getenv('BULK_MAX_WORKERS', 10))
-        
-        # Procesar actualizaciones simultáneamente usando ThreadPoolExecutor
-        with ThreadPoolExecutor(max_workers=min(len(phones), max_workers)) as executor:
-            # Enviar todas las tareas al pool de threads
-            future_to_phone = {executor.submit(update_single_number, phone): phone for phone in phones}
-            
-            # Procesar resultados conforme se completan
-            for future in as_completed(future_to_phone):
-                try:
-                    result = future.result()
-                    results["details"].append(result)
-                    
-                    if result["success"]:
-                        results["successful"] += 1
-                    else:
-                        results["failed"] += 1
-                        
-                except Exception as exc:
-                    phone = future_to_phone[future]
-                    results["details"].append({
-                        "phone": phone,
-                        "success": False,
-                        "error": f"Exception: {str(exc)}"
-                    })
-                    results["failed"] += 1
-        
         return jsonify({
             "success": True,
             "message": f"Bulk update completed: {results['successful']} successful, {results['failed']} failed",
@@ -278,3 +316,16 @@ def clear_numbers():
     except Exception as e:
         logger.error(f"Error clearing numbers: {str(e)}")
         return jsonify({"error": str(e)}), 500
+
+@simple_cache_bp.route('/numbers/stats', methods=['GET'])
+def get_cache_stats():
+    """Estadísticas del LRU en memoria y de las conexiones SQLite del cache"""
+    try:
+        cache = get_number_cache()
+        return jsonify({
+            "success": True,
+            "stats": cache.get_stats()
+        }), 200
+    except Exception as e:
+        logger.error(f"Error getting cache stats: {str(e)}")
+        return jsonify({"error": str(e)}), 500
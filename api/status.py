@@ -1,8 +1,6 @@
 from flask import Blueprint, jsonify
 import logging
-from services.whatsapp_service import WhatsAppService
-from services.queue_service import QueueService
-from services.websocket_service import WebSocketService
+from services.health_prober import get_health_prober
 
 logger = logging.getLogger(__name__)
 
@@ -10,41 +8,30 @@ status_bp = Blueprint('status', __name__)
 
 @status_bp.route('/status', methods=['GET'])
 def status():
-    """Endpoint para verificar el estado del servicio"""
+    """Endpoint para verificar el estado del servicio (resultados cacheados del HealthProber)"""
     try:
+        health_prober = get_health_prober()
+        checks = health_prober.get_results()
+
+        def check_ok(name: str) -> bool:
+            return checks.get(name, {}).get("ok", False)
+
         service_status = {
             "webhook": True,
-            "whatsapp_service": False,
-            "queue_service": False,
-            "websocket_service": False
+            "whatsapp_service": check_ok("whatsapp_config"),
+            "queue_service": check_ok("redis"),
+            "websocket_service": check_ok("websocket"),
+            "sqlite_cache": check_ok("sqlite"),
+            "graph_api": check_ok("graph_api")
         }
         
-        # Verificar WhatsApp service
-        try:
-            whatsapp_service = WhatsAppService()
-            service_status["whatsapp_service"] = True
-        except Exception as e:
-            logger.error(f"Error verificando WhatsApp service: {str(e)}")
-        
-        # Verificar Queue service
-        try:
-            queue_service = QueueService()
-            service_status["queue_service"] = True
-        except Exception as e:
-            logger.error(f"Error verificando Queue service: {str(e)}")
-        
-        # Verificar WebSocket service
-        try:
-            websocket_service = WebSocketService()
-            service_status["websocket_service"] = websocket_service.health_check()
-        except Exception as e:
-            logger.error(f"Error verificando WebSocket service: {str(e)}")
-        
         all_ok = all(service_status.values())
         
         return jsonify({
             "status": "healthy" if all_ok else "degraded",
-            "services": service_status
+            "services": service_status,
+            "checks": checks,
+            "prober": health_prober.get_stats()
         }), 200 if all_ok else 503
         
     except Exception as e:
@@ -0,0 +1,64 @@
+from flask import Blueprint, jsonify, request
+import logging
+from services.event_tracer import get_event_tracer
+
+logger = logging.getLogger(__name__)
+
+traces_bp = Blueprint('traces', __name__)
+
+@traces_bp.route('/traces/slow', methods=['GET'])
+def get_slow_traces():
+    """Trazas más lentas del ring buffer (total o de una etapa)"""
+    try:
+        min_ms = request.args.get('min_ms', 0, type=float)
+        limit = request.args.get('limit', 20, type=int)
+        stage = request.args.get('stage')
+        sender = request.args.get('sender')
+
+        tracer = get_event_tracer()
+        return jsonify({
+            "success": True,
+            "traces": tracer.slow_traces(min_ms, limit, stage, sender),
+            "tracing": tracer.get_stats()
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Error obteniendo trazas lentas: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@traces_bp.route('/traces/stages', methods=['GET'])
+def get_trace_stages():
+    """Percentiles por etapa de las trazas del ring buffer"""
+    try:
+        tracer = get_event_tracer()
+        return jsonify({
+            "success": True,
+            **tracer.stage_stats(),
+            "tracing": tracer.get_stats()
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Error obteniendo etapas de trazas: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@traces_bp.route('/traces/<trace_id>', methods=['GET'])
+def get_trace(trace_id):
+    """Detalle de una traza del ring buffer"""
+    try:
+        trace = get_event_tracer().get_trace(trace_id)
+        if trace is None:
+            return jsonify({"success": False, "error": "Traza no encontrada"}), 404
+        return jsonify({"success": True, "trace": trace}), 200
+
+    except Exception as e:
+        logger.error(f"Error obteniendo traza {trace_id}: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
@@ -1,15 +1,21 @@
 from flask import Blueprint, request, jsonify, current_app
 import logging
+import time
 from services.whatsapp_service import WhatsAppService
 from services.message_processor import MessageProcessor
+from services.ingestion_service import IngestionService
+from services.latency_tracker import webhook_ack_latency
+from services.log_config import Truncated, get_category_logger
 
 logger = logging.getLogger(__name__)
+webhook_log = get_category_logger(__name__, 'webhook')
 
 webhook_bp = Blueprint('webhook', __name__)
 
 # Inicializar servicios
 whatsapp_service = None
 message_processor = None
+ingestion_service = IngestionService()
 
 def init_services():
     global whatsapp_service, message_processor
@@ -19,6 +25,7 @@ def init_services():
         load_dotenv()
         whatsapp_service = WhatsAppService()
         message_processor = MessageProcessor(whatsapp_service)
+        ingestion_service.set_handler(message_processor.process_webhook_body)
     except Exception as e:
         logger.error(f"Error inicializando servicios webhook: {str(e)}")
 
@@ -47,19 +54,42 @@ def webhook():
 
     elif request.method == 'POST':
         # Procesar eventos del webhook
+        received_at = time.time()
+        started = time.perf_counter()
         try:
-            data = request.json
-            logger.info(f"Webhook recibido: {data}")
-            
+            raw_body = request.get_data(cache=False)
+
+            # Validación mínima: el cuerpo debe ser un objeto JSON
+            if not raw_body or raw_body.lstrip()[:1] != b'{':
+                logger.warning("Webhook con cuerpo vacío o no JSON")
+                return jsonify({"error": "Se requiere un objeto JSON"}), 400
+
             if not message_processor:
                 logger.error("Procesador de mensajes no disponible")
                 return jsonify({"error": "Servicio no disponible"}), 500
-            
+
+            if ingestion_service.deferred:
+                # Responder a Meta de inmediato; parseo, cache y reenvío ocurren en background
+                if not ingestion_service.submit(raw_body, received_at):
+                    return jsonify({"error": "Cola de ingesta llena"}), 503
+                return jsonify({"message": "Webhook recibido"}), 200
+
+            # Cuerpo recortado a LOG_PAYLOAD_MAX_CHARS y decodificado solo si el registro se emite
+            webhook_log.info("Webhook recibido", bytes=len(raw_body), payload=Truncated(raw_body))
+
             # Enviar el JSON completo de WhatsApp al WebSocket
-            message_processor.send_to_websocket(data)
-            
+            result = message_processor.process_webhook_body(raw_body, received_at)
+            if not result.get("success"):
+                # Sin encolar (p. ej. el journal no pudo escribir): Meta reintentará la entrega
+                return jsonify({"error": result.get("error")}), 500
+
             return jsonify({"message": "Webhook enviado al WebSocket"}), 200
-            
+
+        except ValueError as e:
+            logger.error(f"Webhook con JSON inválido: {str(e)}")
+            return jsonify({"error": "JSON inválido"}), 400
         except Exception as e:
             logger.error(f"Error procesando webhook: {str(e)}")
             return jsonify({"error": str(e)}), 500
+        finally:
+            webhook_ack_latency.record(time.perf_counter() - started)
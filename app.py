@@ -1,17 +1,17 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 import os
 import logging
+import time
 from dotenv import load_dotenv
 from api import register_blueprints
+from services.log_config import configure_logging
+from services.metrics import http_request_duration_seconds, http_requests_total
 
 # Cargar variables de entorno
 load_dotenv()
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configurar logging: escritura a stderr desde un hilo aparte, con muestreo por categoría
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
@@ -28,6 +28,20 @@ app.config['DEBUG'] = DEBUG
 # Registrar blueprints
 register_blueprints(app)
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # endpoint = nombre de la ruta de Flask (cardinalidad acotada, no la URL con parámetros)
+    endpoint = request.endpoint or 'not_found'
+    started = g.get('request_started')
+    if started is not None:
+        http_request_duration_seconds.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+    http_requests_total.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    return response
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({"error": "Endpoint no encontrado"}), 404
@@ -37,4 +51,7 @@ def internal_error(error):
     return jsonify({"error": "Error interno del servidor"}), 500
 
 if __name__ == '__main__':
+    # Sin gunicorn no hay post_fork: este proceso es el que procesa la cola
+    from services.message_queue_service import MessageQueueService
+    MessageQueueService.start_in_worker()
     app.run(host='0.0.0.0', port=WEBHOOK_PORT, debug=DEBUG)
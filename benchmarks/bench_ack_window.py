@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Benchmark: entrega confirmada con ventana de 1 evento (parar y esperar) vs. una
+ventana de N eventos en vuelo, contra un consumidor local que confirma cada
+evento con un retardo fijo (simula la latencia de red).
+
+Uso: python benchmarks/bench_ack_window.py [mensajes] [ventana] [retardo_ms]
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.ws_stand_in import WebSocketStandIn
+
+
+def acking_consumer(delay: float) -> WebSocketStandIn:
+    def on_message(server, conn, data):
+        seq = json.loads(data)['delivery_seq']
+        ack = json.dumps({"ack": seq}).encode()
+        threading.Timer(delay, lambda: WebSocketStandIn.send_frame(conn, ack)).start()
+
+    return WebSocketStandIn(capabilities=['ack'], on_message=on_message).start()
+
+
+def run_window(messages: int, window: int, delay: float) -> float:
+    from services.message_queue_service import MessageQueueService
+
+    server = acking_consumer(delay)
+    os.environ['WEBSOCKET_URL'] = server.url
+    os.environ['WEBSOCKET_ACK_WINDOW'] = str(window)
+    service = MessageQueueService(f"bench_window_{window}")
+    payload = {"entry": [{"changes": [{"field": "messages", "value": {"messages": [
+        {"from": "573000000000", "id": "wamid.1", "type": "text", "text": {"body": "Hola"}}
+    ]}}]}]}
+
+    start = time.perf_counter()
+    for _ in range(messages):
+        service.add_message_to_queue(payload)
+    for lane in service.lanes:
+        lane.message_queue.join()
+    elapsed = time.perf_counter() - start
+
+    service.stop_processor()
+    for lane in service.lanes:
+        lane.websocket_service.close()
+    server.stop()
+    return elapsed
+
+
+def run(messages: int, window: int, delay_ms: float):
+    logging.disable(logging.CRITICAL)
+    os.environ['WEBSOCKET_ACK_ENABLED'] = 'true'
+    delay = delay_ms / 1000
+
+    stop_and_wait = run_window(messages, 1, delay)
+    windowed = run_window(messages, window, delay)
+
+    print(f"Ventana 1 (parar y esperar): {messages / stop_and_wait:10.0f} eventos/s")
+    print(f"Ventana {window:<3}                : {messages / windowed:10.0f} eventos/s "
+          f"({stop_and_wait / windowed:.1f}x)")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 32,
+        float(sys.argv[3]) if len(sys.argv) > 3 else 2)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: extracción del sobre del webhook en una sola pasada vs. los
+cuatro recorridos entry -> changes -> value -> messages[0] que hacía el pipeline.
+
+Uso: python benchmarks/bench_envelope.py [iteraciones]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.webhook_event import WebhookEnvelope
+
+
+def build_webhook(messages: int = 1) -> dict:
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": "ENTRY_ID",
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "metadata": {"display_phone_number": "15550559999", "phone_number_id": "PHONE_NUMBER_ID"},
+                    "contacts": [{"profile": {"name": f"Contacto {i}"}, "wa_id": f"57300000{i:04d}"} for i in range(messages)],
+                    "messages": [{
+                        "from": f"57300000{i:04d}",
+                        "id": f"wamid.{i}",
+                        "timestamp": "1705491000",
+                        "text": {"body": "Hola, necesito ayuda con mi pedido " * 3},
+                        "type": "text"
+                    } for i in range(messages)]
+                }
+            }]
+        }]
+    }
+
+
+def legacy_walk(message_data: dict):
+    """Recorrido que se repetía en processor, encolado, loop FIFO y log del WebSocket"""
+    from_number = "unknown"
+    message_text = "N/A"
+    if 'entry' in message_data:
+        for entry in message_data['entry']:
+            if 'changes' in entry:
+                for change in entry['changes']:
+                    if change.get('field') == 'messages':
+                        value = change.get('value', {})
+                        if 'messages' in value and value['messages']:
+                            msg = value['messages'][0]
+                            from_number = msg.get('from', 'unknown')
+                            if msg.get('type') == 'text':
+                                message_text = msg.get('text', {}).get('body', 'N/A')[:30]
+                            else:
+                                message_text = f"[{msg.get('type', 'unknown')}]"
+                            break
+                if from_number != "unknown":
+                    break
+            if from_number != "unknown":
+                break
+    return from_number, message_text
+
+
+def run(iterations: int):
+    for messages in (1, 10):
+        webhook = build_webhook(messages)
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for _stage in range(4):
+                legacy_walk(webhook)
+        legacy = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            envelope = WebhookEnvelope.from_payload(webhook)
+            for _stage in range(4):
+                envelope.sender, envelope.text_preview
+        single = time.perf_counter() - start
+
+        print(f"{messages:>3} mensaje(s): 4 recorridos {legacy / iterations * 1e6:7.2f} µs/evento | "
+              f"sobre único {single / iterations * 1e6:7.2f} µs/evento | "
+              f"ahorro {(legacy - single) / iterations * 1e6:7.2f} µs/evento")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
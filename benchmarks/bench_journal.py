@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark: throughput de escritura del journal de eventos.
+Compara un commit por evento (sin agrupar) con el commit agrupado de EventJournal,
+para varios productores concurrentes (hilos de gunicorn) y modos de synchronous.
+
+Uso: python benchmarks/bench_journal.py [eventos_por_productor]
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.event_journal import EventJournal
+from services.webhook_event import WebhookEvent
+
+PAYLOAD = {"entry": [{"changes": [{"field": "messages", "value": {"messages": [
+    {"from": "573000000000", "id": "wamid.1", "type": "text", "text": {"body": "Hola " * 20}}
+]}}]}]}
+RAW_BODY = json.dumps(PAYLOAD).encode('utf-8')
+
+
+def run_producers(producers: int, per_producer: int, write_one) -> float:
+    threads = [threading.Thread(target=lambda: [write_one() for _ in range(per_producer)]) for _ in range(producers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return (producers * per_producer) / (time.perf_counter() - start)
+
+
+def ungrouped(path: str, synchronous: str, producers: int, per_producer: int) -> float:
+    lock = threading.Lock()
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA synchronous={synchronous}')
+    conn.execute('CREATE TABLE IF NOT EXISTS journal_events (id INTEGER PRIMARY KEY AUTOINCREMENT, sink TEXT, body BLOB)')
+
+    def write_one():
+        with lock, conn:
+            conn.execute('INSERT INTO journal_events (sink, body) VALUES (?, ?)', ('default', RAW_BODY))
+
+    rate = run_producers(producers, per_producer, write_one)
+    conn.close()
+    return rate
+
+
+def grouped(path: str, synchronous: str, producers: int, per_producer: int) -> float:
+    os.environ['WEBHOOK_JOURNAL_ENABLED'] = 'true'
+    os.environ['WEBHOOK_JOURNAL_PATH'] = path
+    os.environ['WEBHOOK_JOURNAL_SYNCHRONOUS'] = synchronous
+    journal = EventJournal()
+    return run_producers(producers, per_producer,
+                         lambda: journal.append('default', WebhookEvent(PAYLOAD, raw_body=RAW_BODY)))
+
+
+def run(per_producer: int):
+    logging.disable(logging.CRITICAL)
+    print(f"{'synchronous':<12} {'productores':>11} {'commit por evento':>18} {'commit agrupado':>16}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for synchronous in ('FULL', 'NORMAL'):
+            for producers in (1, 4, 16):
+                base = ungrouped(os.path.join(tmp, f"u_{synchronous}_{producers}.db"), synchronous, producers, per_producer)
+                group = grouped(os.path.join(tmp, f"g_{synchronous}_{producers}.db"), synchronous, producers, per_producer)
+                print(f"{synchronous:<12} {producers:>11} {base:>12.0f} ev/s {group:>10.0f} ev/s")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Benchmark: NumberCache con carga mixta de lecturas y escrituras.
+Compara el esquema anterior (una conexión nueva por operación, todo bajo un lock
+global, journal en modo DELETE) con las conexiones persistentes por hilo en WAL.
+
+Lecturas: get_numbers de 3 remitentes (el camino del webhook).
+Escrituras: update_number_data de un número (PATCH /numbers/update).
+
+Al final mide el acierto del LRU con lecturas concentradas en pocos remitentes y
+escrituras desde varios hilos: las escrituras propias solo invalidan su número,
+así que el LRU no debe vaciarse por completo (external_invalidations = 0).
+
+Uso: python benchmarks/bench_number_cache.py [operaciones_por_hilo]
+"""
+
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.simple_cache import NumberCache
+
+PHONES = [f"57300{i:07d}" for i in range(2000)]
+
+
+class LegacyNumberCache:
+    """Las dos operaciones del benchmark tal como estaban antes del gestor de conexiones"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+
+    def get_numbers(self, phones):
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            placeholders = ','.join('?' * len(phones))
+            rows = conn.execute(f'SELECT * FROM numbers WHERE phone IN ({placeholders})', phones).fetchall()
+            conn.close()
+        return {row['phone']: dict(row, data=json.loads(row['data']) if row['data'] else None) for row in rows}
+
+    def update_number_data(self, phone, data_content):
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            row = conn.execute('SELECT data FROM numbers WHERE phone = ?', (phone,)).fetchone()
+            if not row:
+                conn.close()
+                return False
+            updated = {**(json.loads(row[0]) if row[0] else {}), **data_content}
+            cursor = conn.execute('UPDATE numbers SET data = ?, updated_at = ? WHERE phone = ?',
+                                  (json.dumps(updated), datetime.now().isoformat(), phone))
+            conn.commit()
+            conn.close()
+            return cursor.rowcount > 0
+
+
+def seed(db_path: str):
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS numbers (
+            phone TEXT PRIMARY KEY, name TEXT, data TEXT, created_at TEXT NOT NULL, updated_at TEXT NOT NULL
+        )
+    ''')
+    now = datetime.now().isoformat()
+    conn.executemany('INSERT INTO numbers VALUES (?, ?, ?, ?, ?)',
+                     [(phone, f"Cliente {phone}", json.dumps({"plan": "basic", "visits": 0}), now, now) for phone in PHONES])
+    conn.commit()
+    conn.close()
+
+
+def run_mixed(cache, threads: int, per_thread: int, write_ratio: float) -> float:
+    def worker(seed_value: int):
+        rng = random.Random(seed_value)
+        for _ in range(per_thread):
+            if rng.random() < write_ratio:
+                cache.update_number_data(rng.choice(PHONES), {"visits": rng.randint(0, 100)})
+            else:
+                cache.get_numbers(rng.sample(PHONES, 3))
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return (threads * per_thread) / (time.perf_counter() - start)
+
+
+def run_hit_rate(cache: NumberCache, threads: int, per_thread: int, write_ratio: float):
+    """Carga mixta con el 90% de las lecturas sobre 200 remitentes frecuentes"""
+    hot = PHONES[:200]
+
+    def worker(seed_value: int):
+        rng = random.Random(seed_value)
+        for _ in range(per_thread):
+            if rng.random() < write_ratio:
+                cache.update_number_data(rng.choice(PHONES), {"visits": rng.randint(0, 100)})
+            else:
+                cache.get_numbers(rng.sample(hot if rng.random() < 0.9 else PHONES, 3))
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return cache.get_stats()["lru"]
+
+
+def run(per_thread: int):
+    logging.disable(logging.CRITICAL)
+    print(f"{'escrituras':>10} {'hilos':>6} {'conexión por op + lock':>23} {'por hilo + WAL':>15}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for write_ratio in (0.05, 0.2, 0.5):
+            for threads in (1, 4, 16):
+                legacy_path = os.path.join(tmp, f"legacy_{write_ratio}_{threads}.db")
+                seed(legacy_path)
+                legacy = run_mixed(LegacyNumberCache(legacy_path), threads, per_thread, write_ratio)
+
+                wal_path = os.path.join(tmp, f"wal_{write_ratio}_{threads}.db")
+                seed(wal_path)
+                wal = run_mixed(NumberCache(wal_path), threads, per_thread, write_ratio)
+                print(f"{write_ratio:>9.0%} {threads:>6} {legacy:>17.0f} op/s {wal:>9.0f} op/s")
+
+        print()
+        print(f"{'escrituras':>10} {'hilos':>6} {'acierto LRU':>12} {'invalidaciones':>15} {'vaciados externos':>18}")
+        for write_ratio in (0.05, 0.2):
+            for threads in (4, 16):
+                path = os.path.join(tmp, f"lru_{write_ratio}_{threads}.db")
+                seed(path)
+                lru = run_hit_rate(NumberCache(path), threads, per_thread, write_ratio)
+                print(f"{write_ratio:>9.0%} {threads:>6} {lru['hit_ratio']:>12.1%} {lru['invalidations']:>15} "
+                      f"{lru['external_invalidations']:>18}")
+                # Las escrituras de otros hilos del proceso no deben vaciar el LRU compartido
+                assert lru["external_invalidations"] == 0, "el LRU se vació por escrituras propias"
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
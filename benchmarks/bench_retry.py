@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Benchmark: costo de devolver un mensaje fallido al frente de la cola.
+Compara el reencolado anterior (vaciar a una cola temporal y restaurar, O(n))
+con el slot de reintento del carril (O(1)) para distintos tamaños de backlog.
+
+Después verifica QueueLane real con varios productores concurrentes y un
+consumidor que falla al azar (envíos fallidos y caídas de conexión): cada
+remitente debe recibir sus eventos en orden, sin pérdidas ni duplicados.
+
+Uso: python benchmarks/bench_retry.py [eventos_por_productor]
+"""
+
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Backoff corto y sin dead-letter queue: todo evento debe terminar entregado
+os.environ.setdefault('WEBHOOK_RETRY_BASE_DELAY', '0.0005')
+os.environ.setdefault('WEBHOOK_RETRY_MAX_DELAY', '0.002')
+os.environ.setdefault('WEBHOOK_MAX_ATTEMPTS', '0')
+
+from services.message_queue_service import QueueLane
+from services.webhook_event import WebhookEvent
+from services.websocket_service import WebSocketService
+
+
+def requeue_rebuild(message_queue: queue.Queue, failed):
+    temp_queue = queue.Queue()
+    temp_queue.put(failed)
+    while not message_queue.empty():
+        try:
+            temp_queue.put(message_queue.get_nowait())
+        except queue.Empty:
+            break
+    while not temp_queue.empty():
+        try:
+            message_queue.put(temp_queue.get_nowait())
+        except queue.Empty:
+            break
+
+
+class FlakyWebSocket(WebSocketService):
+    """Consumidor simulado: acepta lotes, falla al azar (envío o conexión) y registra lo entregado"""
+
+    def __init__(self, failure_rate: float, outage_rate: float, seed: int):
+        super().__init__('ws://bench.invalid')
+        self.batch_enabled = True
+        self.batch_max_events = 20
+        self.batch_linger = 0
+        self.failure_rate = failure_rate
+        self.outage_rate = outage_rate
+        self.rng = random.Random(seed)
+        self.delivered = []
+        self.failures = 0
+        self.outages = 0
+
+    def batching_active(self) -> bool:
+        return True
+
+    def wait_for_ack_window(self):
+        pass
+
+    def redeliver_stale(self):
+        pass
+
+    def _deliver(self, events) -> bool:
+        roll = self.rng.random()
+        if roll < self.outage_rate:
+            self.outages += 1
+            self.reconnect_failures = 1
+            raise ConnectionRefusedError("consumidor caído (simulado)")
+        self.reconnect_failures = 0
+        if roll < self.outage_rate + self.failure_rate:
+            self.failures += 1
+            raise ConnectionResetError("envío fallido (simulado)")
+        self.delivered.extend(events)
+        return False
+
+    def send_batch(self, events) -> bool:
+        return self._deliver(events)
+
+    def send_message(self, message_data) -> bool:
+        return self._deliver([message_data])
+
+
+def check_lane_ordering(producers: int, per_producer: int, lane_count: int = 4,
+                        failure_rate: float = 0.1, outage_rate: float = 0.05):
+    """Varios productores encolan en QueueLane reales mientras el consumidor falla al azar"""
+    lanes = []
+    for index in range(lane_count):
+        lane = QueueLane('default', index, lane_count)
+        lane.websocket_service = FlakyWebSocket(failure_rate, outage_rate, seed=index)
+        lanes.append(lane)
+        lane.start()
+
+    def produce(producer: int):
+        rng = random.Random(producer)
+        senders = [f"57300{producer:02d}{k:05d}" for k in range(20)]
+        next_seq = dict.fromkeys(senders, 0)
+        for _ in range(per_producer):
+            sender = rng.choice(senders)
+            event = WebhookEvent({"sender": sender, "seq": next_seq[sender]}, received_at=time.time())
+            next_seq[sender] += 1
+            event.queued_at = time.time()
+            # Mismo reparto que MessageQueueService.lane_for: hash estable del remitente
+            lanes[zlib.crc32(sender.encode('utf-8')) % lane_count].message_queue.put(event)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=produce, args=(producer,)) for producer in range(producers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for lane in lanes:
+        lane.message_queue.join()
+    elapsed = time.perf_counter() - start
+    for lane in lanes:
+        lane.stop()
+
+    delivered = [event.payload for lane in lanes for event in lane.websocket_service.delivered]
+    by_sender = {}
+    for payload in delivered:
+        by_sender.setdefault(payload["sender"], []).append(payload["seq"])
+
+    total = producers * per_producer
+    assert len(delivered) == total, f"entregados {len(delivered)} de {total}"
+    for sender, seqs in by_sender.items():
+        assert seqs == list(range(len(seqs))), f"orden roto, duplicado o pérdida para {sender}"
+    failures = sum(lane.websocket_service.failures for lane in lanes)
+    outages = sum(lane.websocket_service.outages for lane in lanes)
+    print(f"{producers:>10} {total:>8} {failures:>8} {outages:>8} {elapsed:>8.2f} s   OK")
+
+
+def run(per_producer: int):
+    print(f"{'backlog':>10} {'reconstruir cola':>18} {'slot de reintento':>18}")
+    for backlog in (100, 1000, 10000, 100000):
+        message_queue = queue.Queue()
+        for item in range(backlog):
+            message_queue.put(item)
+
+        start = time.perf_counter()
+        requeue_rebuild(message_queue, 'fallido')
+        rebuild = time.perf_counter() - start
+
+        start = time.perf_counter()
+        retry_batch = ['fallido']
+        slot = time.perf_counter() - start
+        assert retry_batch
+
+        print(f"{backlog:>10} {rebuild * 1000:>15.3f} ms {slot * 1000:>15.4f} ms")
+
+    logging.disable(logging.CRITICAL)
+    print()
+    print(f"{'productores':>10} {'eventos':>8} {'fallos':>8} {'caídas':>8} {'tiempo':>10}")
+    for producers in (1, 4, 16):
+        check_lane_ordering(producers, per_producer)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark: envío al WebSocket con una conexión por mensaje (comportamiento anterior)
+vs. la conexión persistente de WebSocketService, con y sin lotes, contra un consumidor local.
+
+Uso: python benchmarks/bench_websocket.py [mensajes]
+"""
+
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import websocket
+
+from benchmarks.ws_stand_in import WebSocketStandIn
+from services.webhook_event import WebhookEvent
+from services.websocket_service import WebSocketService
+
+
+def wait_for(server: WebSocketStandIn, expected: int, timeout: float = 30, count=len):
+    deadline = time.monotonic() + timeout
+    while count(server.received) < expected and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def count_batched(frames) -> int:
+    return sum(len(json.loads(frame)) for frame in list(frames))
+
+
+def run(messages: int):
+    logging.disable(logging.CRITICAL)
+    payload = {"entry": [{"changes": [{"field": "messages", "value": {"messages": [
+        {"from": "573000000000", "id": "wamid.1", "type": "text", "text": {"body": "Hola " * 20}}
+    ]}}]}]}
+
+    server = WebSocketStandIn().start()
+
+    start = time.perf_counter()
+    for _ in range(messages):
+        ws = websocket.create_connection(server.url, timeout=15)
+        ws.send(json.dumps(payload, ensure_ascii=False))
+        ws.close()
+    wait_for(server, messages)
+    per_message = time.perf_counter() - start
+
+    server.received.clear()
+    service = WebSocketService(server.url)
+    start = time.perf_counter()
+    for _ in range(messages):
+        service.send_message(payload)
+    wait_for(server, messages)
+    persistent = time.perf_counter() - start
+    service.close()
+    server.stop()
+
+    batch_server = WebSocketStandIn(capabilities=['batch']).start()
+    os.environ['WEBSOCKET_BATCH_ENABLED'] = 'true'
+    batch_service = WebSocketService(batch_server.url)
+    raw_body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    events = [WebhookEvent(payload, raw_body=raw_body) for _ in range(messages)]
+    size = batch_service.batch_max_events
+    start = time.perf_counter()
+    for offset in range(0, messages, size):
+        batch_service.send_batch(events[offset:offset + size])
+    wait_for(batch_server, messages, count=count_batched)
+    batched = time.perf_counter() - start
+    batch_service.close()
+    batch_server.stop()
+
+    print(f"Conexión por mensaje : {messages / per_message:10.0f} eventos/s")
+    print(f"Conexión persistente : {messages / persistent:10.0f} eventos/s "
+          f"({per_message / persistent:.1f}x, {service.connections_opened} conexión(es))")
+    print(f"Persistente en lotes : {messages / batched:10.0f} eventos/s "
+          f"({per_message / batched:.1f}x, {batch_service.batches_sent} frame(s) de hasta {size})")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
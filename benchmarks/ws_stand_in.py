@@ -0,0 +1,147 @@
+"""
+Servidor WebSocket mínimo (solo librería estándar) que hace de consumidor local en
+los benchmarks. Cuenta los frames recibidos y responde pings.
+"""
+
+import base64
+import hashlib
+import socket
+import struct
+import threading
+from typing import Callable, Iterable, List, Optional
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class WebSocketStandIn:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, subprotocols: Iterable[str] = (),
+                 capabilities: Iterable[str] = (),
+                 on_message: Optional[Callable[['WebSocketStandIn', socket.socket, bytes], None]] = None):
+        self.subprotocols = list(subprotocols)
+        self.capabilities = list(capabilities)
+        self.on_message = on_message
+        self.received: List[bytes] = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(128)
+        self.running = False
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.getsockname()
+        return f"ws://{host}:{port}/ws"
+
+    def start(self) -> 'WebSocketStandIn':
+        self.running = True
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        try:
+            # shutdown desbloquea el accept() pendiente antes de cerrar
+            self.server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.server.close()
+        except OSError:
+            pass
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handshake(self, conn: socket.socket) -> bool:
+        request = b''
+        while b'\r\n\r\n' not in request:
+            chunk = conn.recv(4096)
+            if not chunk:
+                return False
+            request += chunk
+
+        headers = {}
+        for line in request.decode('latin-1').split('\r\n')[1:]:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+
+        accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + GUID).encode()).digest()).decode()
+        response = ("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                    f"Sec-WebSocket-Accept: {accept}\r\n")
+        offered = [p.strip() for p in headers.get('sec-websocket-protocol', '').split(',') if p.strip()]
+        chosen = next((p for p in offered if p in self.subprotocols), None)
+        if chosen:
+            response += f"Sec-WebSocket-Protocol: {chosen}\r\n"
+        requested = [c.strip() for c in headers.get('x-webhook-capabilities', '').split(',') if c.strip()]
+        accepted = [c for c in requested if c in self.capabilities]
+        if accepted:
+            response += f"X-Webhook-Capabilities: {', '.join(accepted)}\r\n"
+        conn.sendall((response + "\r\n").encode())
+        return True
+
+    def _recv_exact(self, conn: socket.socket, size: int) -> bytes:
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("conexión cerrada")
+            data += chunk
+        return data
+
+    @staticmethod
+    def send_frame(conn: socket.socket, payload: bytes, opcode: int = 0x1):
+        header = bytes([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header += bytes([length])
+        elif length < 65536:
+            header += bytes([126]) + struct.pack('!H', length)
+        else:
+            header += bytes([127]) + struct.pack('!Q', length)
+        conn.sendall(header + payload)
+
+    def _handle(self, conn: socket.socket):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            if not self._handshake(conn):
+                return
+            with self.lock:
+                self.connections += 1
+            while True:
+                first, second = self._recv_exact(conn, 2)
+                opcode = first & 0x0F
+                length = second & 0x7F
+                if length == 126:
+                    length = struct.unpack('!H', self._recv_exact(conn, 2))[0]
+                elif length == 127:
+                    length = struct.unpack('!Q', self._recv_exact(conn, 8))[0]
+                mask = self._recv_exact(conn, 4) if second & 0x80 else b'\x00\x00\x00\x00'
+                data = self._recv_exact(conn, length)
+                if length:
+                    # Desenmascarar con un único XOR de enteros grandes (mucho más rápido que byte a byte)
+                    full_mask = (mask * (length // 4 + 1))[:length]
+                    data = (int.from_bytes(data, 'big') ^ int.from_bytes(full_mask, 'big')).to_bytes(length, 'big')
+
+                if opcode == 0x8:
+                    self.send_frame(conn, data[:2], 0x8)
+                    return
+                if opcode == 0x9:
+                    self.send_frame(conn, data, 0xA)
+                    continue
+                if opcode in (0x1, 0x2):
+                    with self.lock:
+                        self.received.append(data)
+                    if self.on_message:
+                        self.on_message(self, conn, data)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            conn.close()
@@ -3,7 +3,10 @@ import multiprocessing
 
 # Configuración del servidor
 bind = f"0.0.0.0:{os.getenv('WEBHOOK_PORT', '5050')}"
-workers = 1  # UN SOLO WORKER para threading y FIFO queue
+# Con la cola FIFO en memoria se necesita UN SOLO WORKER. Con WEBHOOK_QUEUE_BACKEND=redis_streams
+# la cola vive en Redis y varios workers (o hosts) pueden recibir webhooks: GUNICORN_WORKERS
+queue_backend = os.getenv('WEBHOOK_QUEUE_BACKEND', 'memory').lower()
+workers = int(os.getenv('GUNICORN_WORKERS', '1')) if queue_backend == 'redis_streams' else 1
 worker_class = "gthread"  # THREADED WORKER
 threads = 4  # THREADS en lugar de múltiples procesos
 worker_connections = 1000
@@ -41,7 +44,7 @@ limit_request_field_size = 8190
 
 def when_ready(server):
     server.log.info("🚀 Servidor listo para recibir conexiones")
-    server.log.info("🔧 Configuración: 1 worker, 4 threads, preload_app=True")
+    server.log.info("🔧 Configuración: %s worker(s), 4 threads, preload_app=True, cola: %s", workers, queue_backend)
 
 def worker_int(worker):
     worker.log.info("⚠️ Worker recibió INT o QUIT señal")
@@ -53,10 +56,16 @@ def post_fork(server, worker):
     worker.log.info("✅ Worker spawned (pid: %s) - iniciando FIFO queue", worker.pid)
     try:
         from services.message_queue_service import MessageQueueService
-        MessageQueueService().restart_processor()
+        # Reencola el journal pendiente de workers anteriores y arranca los procesadores de cada sink
+        MessageQueueService.start_in_worker()
         worker.log.info("✅ Procesador FIFO iniciado en worker %s", worker.pid)
     except Exception as e:
         worker.log.warning("No se pudo iniciar el procesador FIFO: %s", e)
+    try:
+        from services.health_prober import get_health_prober
+        get_health_prober().start()
+    except Exception as e:
+        worker.log.warning("No se pudo iniciar el HealthProber: %s", e)
 
 def worker_abort(worker):
     worker.log.info("❌ Worker recibió SIGABRT señal")
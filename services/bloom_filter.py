@@ -0,0 +1,59 @@
+import hashlib
+import math
+from typing import Dict
+
+
+class BloomFilter:
+    """Filtro de Bloom: "seguro que no está" o "puede que esté".
+
+    Se dimensiona para `capacity` elementos con una tasa de falsos positivos
+    `error_rate`; pasada la capacidad la tasa real crece. No admite borrados: un
+    elemento eliminado sigue dando "puede que esté" hasta reconstruir el filtro.
+    Las posiciones salen de doble hashing sobre un único blake2b de 128 bits.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / self.capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item: str):
+        """Agrega el elemento. Solo cuenta como nuevo si cambió algún bit (volver a agregar
+        uno existente, p. ej. al actualizar un número, no consume capacidad)"""
+        bits = self.bits
+        new = False
+        for position in self._positions(item):
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def estimated_error_rate(self) -> float:
+        """Tasa de falsos positivos esperada con los elementos agregados hasta ahora"""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def get_stats(self) -> Dict:
+        return {
+            "capacity": self.capacity,
+            "items": self.count,
+            "target_error_rate": self.error_rate,
+            "estimated_error_rate": round(self.estimated_error_rate(), 6),
+            "bits": self.num_bits,
+            "hashes": self.num_hashes,
+            "memory_bytes": len(self.bits)
+        }
@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+from .webhook_event import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+
+class DeadLetterStore:
+    """Eventos que agotaron sus intentos de reenvío (poison messages), guardados en SQLite.
+
+    Se pueden listar, volver a encolar (replay) o purgar desde la API, así que un
+    evento malformado sale del carril en lugar de detener todo el pipeline.
+    """
+
+    PREVIEW_LENGTH = 200
+    # Máximo de eventos por replay: cada uno se decodifica y se encola dentro de la petición
+    MAX_REPLAY = 1000
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or os.getenv('WEBHOOK_DLQ_PATH', '/app/data/dead_letters.db')
+        self.lock = threading.Lock()
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+        self._init_db()
+        logger.info(f"🪦 DeadLetterStore inicializado: {self.db_path}")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _init_db(self):
+        with self.lock:
+            conn = self._connect()
+            try:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS dead_letters (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        sink TEXT NOT NULL,
+                        body BLOB NOT NULL,
+                        enrichment TEXT,
+                        received_at REAL,
+                        attempts INTEGER NOT NULL,
+                        error TEXT,
+                        failed_at REAL NOT NULL
+                    )
+                ''')
+                conn.commit()
+            finally:
+                conn.close()
+
+    def add(self, sink: str, events: List[WebhookEvent], error: str) -> int:
+        """Guarda los eventos fallidos. Devuelve cuántos se guardaron"""
+        rows = []
+        for event in events:
+            body = event.raw_body if event.raw_body is not None else json.dumps(event.payload, ensure_ascii=False).encode('utf-8')
+            # default=str: un enriquecimiento no serializable no debe impedir guardar el evento
+            enrichment = json.dumps(event.enrichment, ensure_ascii=False, default=str) if event.enrichment else None
+            rows.append((sink, body, enrichment, event.received_at, event.attempts, error, time.time()))
+        return self._insert(rows)
+
+    def add_raw(self, sink: str, body: bytes, enrichment: Optional[str], received_at: Optional[float],
+                attempts: int, error: str) -> int:
+        """Guarda una entrada que ni siquiera se pudo convertir en evento (cuerpo ilegible)"""
+        return self._insert([(sink, body, enrichment or None, received_at, attempts, error, time.time())])
+
+    def _insert(self, rows: List[tuple]) -> int:
+        with self.lock:
+            conn = self._connect()
+            try:
+                conn.executemany('''
+                    INSERT INTO dead_letters (sink, body, enrichment, received_at, attempts, error, failed_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+                conn.commit()
+            finally:
+                conn.close()
+        return len(rows)
+
+    def list(self, limit: int = 50, offset: int = 0, sink: Optional[str] = None) -> Dict:
+        """Lista los eventos muertos (más antiguos primero) con un extracto del cuerpo"""
+        where, params = ('WHERE sink = ?', [sink]) if sink else ('', [])
+        with self.lock:
+            conn = self._connect()
+            try:
+                total = conn.execute(f'SELECT COUNT(*) FROM dead_letters {where}', params).fetchone()[0]
+                rows = conn.execute(f'''
+                    SELECT id, sink, body, received_at, attempts, error, failed_at
+                    FROM dead_letters {where} ORDER BY id LIMIT ? OFFSET ?
+                ''', params + [limit, offset]).fetchall()
+            finally:
+                conn.close()
+
+        items = []
+        for dead_letter_id, row_sink, body, received_at, attempts, error, failed_at in rows:
+            items.append({
+                "id": dead_letter_id,
+                "sink": row_sink,
+                "received_at": received_at,
+                "attempts": attempts,
+                "error": error,
+                "failed_at": failed_at,
+                "body_preview": bytes(body)[:self.PREVIEW_LENGTH].decode('utf-8', errors='replace')
+            })
+        return {"total": total, "limit": limit, "offset": offset, "items": items}
+
+    def take(self, ids: Optional[List[int]] = None, limit: int = 10) -> List[Dict]:
+        """Saca eventos para replay (por id, o los más antiguos si ids es None).
+
+        La lectura y el borrado van en una misma transacción de escritura: dos replays
+        concurrentes (otro hilo u otro worker) nunca reciben el mismo evento. Quien los
+        saca y no logra encolarlos los devuelve con restore()"""
+        if ids is not None and not ids:
+            return []
+        with self.lock:
+            conn = self._connect()
+            try:
+                conn.isolation_level = None
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    columns = 'id, sink, body, enrichment, received_at, attempts, error, failed_at'
+                    if ids is not None:
+                        placeholders = ','.join('?' * len(ids))
+                        rows = conn.execute(
+                            f'SELECT {columns} FROM dead_letters WHERE id IN ({placeholders}) ORDER BY id', list(ids)
+                        ).fetchall()
+                    else:
+                        rows = conn.execute(
+                            f'SELECT {columns} FROM dead_letters ORDER BY id LIMIT ?', (limit,)
+                        ).fetchall()
+                    conn.executemany('DELETE FROM dead_letters WHERE id = ?', [(row[0],) for row in rows])
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+            finally:
+                conn.close()
+
+        return [
+            {"id": row[0], "sink": row[1], "body": bytes(row[2]), "enrichment": row[3], "received_at": row[4],
+             "attempts": row[5], "error": row[6], "failed_at": row[7]}
+            for row in rows
+        ]
+
+    def restore(self, records: List[Dict]) -> int:
+        """Devuelve a la dead-letter queue, con su id original, eventos sacados con take()"""
+        if not records:
+            return 0
+        rows = [
+            (record["id"], record["sink"], record["body"], record["enrichment"], record["received_at"],
+             record["attempts"], record["error"], record["failed_at"])
+            for record in records
+        ]
+        with self.lock:
+            conn = self._connect()
+            try:
+                conn.executemany('''
+                    INSERT OR REPLACE INTO dead_letters (id, sink, body, enrichment, received_at, attempts, error, failed_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+                conn.commit()
+            finally:
+                conn.close()
+        return len(rows)
+
+    def delete(self, ids: List[int]) -> int:
+        if not ids:
+            return 0
+        with self.lock:
+            conn = self._connect()
+            try:
+                cursor = conn.executemany('DELETE FROM dead_letters WHERE id = ?', [(dead_letter_id,) for dead_letter_id in ids])
+                conn.commit()
+                return cursor.rowcount
+            finally:
+                conn.close()
+
+    def purge(self, ids: Optional[List[int]] = None) -> int:
+        """Elimina los eventos indicados, o todos si ids es None (una lista vacía no borra nada)"""
+        if ids is not None:
+            return self.delete(ids)
+        with self.lock:
+            conn = self._connect()
+            try:
+                cursor = conn.execute('DELETE FROM dead_letters')
+                conn.commit()
+                return cursor.rowcount
+            finally:
+                conn.close()
+
+    def count(self) -> int:
+        with self.lock:
+            conn = self._connect()
+            try:
+                return conn.execute('SELECT COUNT(*) FROM dead_letters').fetchone()[0]
+            finally:
+                conn.close()
+
+
+# Instancia global
+_dead_letter_store = None
+_dead_letter_store_lock = threading.Lock()
+
+
+def get_dead_letter_store() -> DeadLetterStore:
+    """Obtiene la instancia del almacén de eventos muertos"""
+    global _dead_letter_store
+    if _dead_letter_store is None:
+        with _dead_letter_store_lock:
+            if _dead_letter_store is None:
+                _dead_letter_store = DeadLetterStore()
+    return _dead_letter_store
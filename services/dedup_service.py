@@ -0,0 +1,164 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryDedupBackend:
+    """Conjunto acotado con ventana de tiempo; las claves se ordenan por primera aparición"""
+
+    def __init__(self, max_keys: int, ttl: int):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def check_and_mark(self, keys: List[str]) -> List[str]:
+        """Marca las claves como vistas. Devuelve las que marcó esta llamada (vacío: TODAS ya se habían visto)"""
+        now = time.monotonic()
+        with self.lock:
+            self._purge_expired(now)
+
+            marked = []
+            for key in keys:
+                if key in self.entries:
+                    continue
+                marked.append(key)
+                self.entries[key] = now
+
+            # Acotar memoria descartando las claves más antiguas
+            while len(self.entries) > self.max_keys:
+                self.entries.popitem(last=False)
+
+            return marked
+
+    def unmark(self, keys: List[str]):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def _purge_expired(self, now: float):
+        while self.entries:
+            _, seen_at = next(iter(self.entries.items()))
+            if now - seen_at < self.ttl:
+                break
+            self.entries.popitem(last=False)
+
+    def size(self) -> int:
+        with self.lock:
+            return len(self.entries)
+
+
+class RedisDedupBackend:
+    """Ventana compartida entre instancias usando SET NX EX en Redis"""
+
+    KEY_PREFIX = 'webhook:dedup:'
+
+    def __init__(self, redis_url: str, ttl: int):
+        import redis
+        self.client = redis.Redis.from_url(redis_url, socket_timeout=2, socket_connect_timeout=2)
+        self.ttl = ttl
+
+    def check_and_mark(self, keys: List[str]) -> List[str]:
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.set(self.KEY_PREFIX + key, 1, nx=True, ex=self.ttl)
+        # SET NX devuelve None cuando la clave ya existía
+        return [key for key, result in zip(keys, pipeline.execute()) if result is not None]
+
+    def unmark(self, keys: List[str]):
+        self.client.delete(*(self.KEY_PREFIX + key for key in keys))
+
+    def size(self):
+        # El conteo de claves en Redis requeriría un SCAN; no se reporta
+        return None
+
+
+class DuplicateFilter:
+    """Descarta redeliveries de Meta por id de mensaje / id+estado de status antes del enriquecimiento"""
+
+    def __init__(self):
+        self.enabled = os.getenv('WEBHOOK_DEDUP_ENABLED', 'true').lower() == 'true'
+        self.backend_name = os.getenv('WEBHOOK_DEDUP_BACKEND', 'memory').lower()
+        ttl = int(os.getenv('WEBHOOK_DEDUP_TTL', '86400'))
+        max_keys = int(os.getenv('WEBHOOK_DEDUP_MAX_KEYS', '100000'))
+
+        self.memory_backend = MemoryDedupBackend(max_keys, ttl)
+        self.backend = self.memory_backend
+        if self.enabled and self.backend_name == 'redis':
+            try:
+                self.backend = RedisDedupBackend(os.getenv('REDIS_URL', 'redis://localhost:6379/0'), ttl)
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo iniciar dedup en Redis, usando memoria: {str(e)}")
+                self.backend_name = 'memory'
+
+        self.stats_lock = threading.Lock()
+        self.stats = {"checked": 0, "hits": 0, "released": 0, "backend_errors": 0}
+        logger.info(f"🧹 DuplicateFilter inicializado - activo: {self.enabled}, backend: {self.backend_name}")
+
+    def claim(self, keys: List[str]) -> Optional[List[str]]:
+        """Marca las claves del webhook. Devuelve None si ya fue recibido (todas sus claves ya
+        vistas); si no, las claves que marcó esta llamada, para liberarlas con release() si el
+        webhook no llega a encolarse (Meta lo reintentará y el reintento no debe descartarse)"""
+        if not self.enabled or not keys:
+            return []
+
+        try:
+            marked = self.backend.check_and_mark(keys)
+        except Exception as e:
+            # Si Redis falla no se bloquea la ingesta: se usa la ventana local
+            logger.warning(f"⚠️ Error en backend de dedup, usando memoria: {str(e)}")
+            with self.stats_lock:
+                self.stats["backend_errors"] += 1
+            marked = self.memory_backend.check_and_mark(keys)
+
+        with self.stats_lock:
+            self.stats["checked"] += 1
+            if not marked:
+                self.stats["hits"] += 1
+        return marked or None
+
+    def release(self, keys: List[str]):
+        """Olvida claves marcadas por claim() cuyo webhook falló al encolarse"""
+        if not keys:
+            return
+        with self.stats_lock:
+            self.stats["released"] += 1
+        # Se liberan en ambos backends: claim() pudo haber caído a la ventana local
+        self.memory_backend.unmark(keys)
+        if self.backend is not self.memory_backend:
+            try:
+                self.backend.unmark(keys)
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudieron liberar claves de dedup en Redis: {str(e)}")
+                with self.stats_lock:
+                    self.stats["backend_errors"] += 1
+
+    def get_stats(self) -> Dict:
+        with self.stats_lock:
+            stats = dict(self.stats)
+        return {
+            "enabled": self.enabled,
+            "backend": self.backend_name,
+            "tracked_keys": self.backend.size(),
+            **stats
+        }
+
+
+# Instancia global
+_duplicate_filter = None
+_duplicate_filter_lock = threading.Lock()
+
+
+def get_duplicate_filter() -> DuplicateFilter:
+    """Obtiene la instancia del filtro de duplicados"""
+    global _duplicate_filter
+    if _duplicate_filter is None:
+        with _duplicate_filter_lock:
+            if _duplicate_filter is None:
+                _duplicate_filter = DuplicateFilter()
+    return _duplicate_filter
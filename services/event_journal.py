@@ -0,0 +1,284 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List
+from .webhook_event import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+
+class JournalWrite:
+    """Escritura pendiente: quien la encola espera a que su grupo quede confirmado en disco"""
+    __slots__ = ('row', 'journal_id', 'error', 'done')
+
+    def __init__(self, row: tuple):
+        self.row = row
+        self.journal_id = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class EventJournal:
+    """Journal en disco (SQLite en modo WAL) de los eventos encolados hacia el WebSocket.
+
+    Cada evento se escribe antes de entrar a la cola FIFO y se borra cuando el
+    reenvío se completa, así que al reiniciar (deploy, reciclado por max_requests,
+    OOM) los eventos que quedaron pendientes se vuelven a encolar en orden.
+
+    Cada fila guarda el token del proceso que la encoló (un uuid nuevo en cada
+    proceso, también tras un fork). Al arrancar, el worker reclama dentro de una
+    transacción de escritura todas las filas con otro token: un pid reutilizado tras
+    reiniciar el contenedor no hace pasar por propias las filas del proceso anterior.
+
+    Las escrituras se agrupan: un único hilo escritor confirma en una transacción
+    (un fsync) todo lo que se acumuló mientras se confirmaba el grupo anterior.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv('WEBHOOK_JOURNAL_ENABLED', 'false').lower() == 'true'
+        self.db_path = os.getenv('WEBHOOK_JOURNAL_PATH', '/app/data/journal.db')
+        # FULL: fsync en cada commit (sobrevive a cortes de energía). NORMAL: sobrevive a caídas del proceso
+        self.synchronous = os.getenv('WEBHOOK_JOURNAL_SYNCHRONOUS', 'FULL').upper()
+        # Espera adicional para juntar más escrituras en el mismo commit
+        self.group_commit_delay = int(os.getenv('WEBHOOK_JOURNAL_GROUP_COMMIT_MS', '0')) / 1000
+
+        self.condition = threading.Condition()
+        self.pending_writes: List[JournalWrite] = []
+        self.pending_acks: List[int] = []
+        self.writer_thread = None
+
+        self.stats = {"appended": 0, "acked": 0, "commits": 0, "replayed": 0, "errors": 0}
+        self.process_token = uuid.uuid4().hex
+        # COUNT(*) del journal, refrescado por el HealthProber: /api/queue/status no toca SQLite
+        self.pending_cached = None
+        self.pending_counted_at = None
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+        if self.enabled:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir, exist_ok=True)
+            self._init_db()
+
+        logger.info(f"📒 EventJournal inicializado - activo: {self.enabled}, ruta: {self.db_path}, synchronous: {self.synchronous}")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS journal_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sink TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    enrichment TEXT,
+                    received_at REAL,
+                    owner_token TEXT
+                )
+            ''')
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(journal_events)')]
+            if 'owner_token' not in columns:
+                # Journals previos: las filas sin dueño se consideran huérfanas
+                conn.execute('ALTER TABLE journal_events ADD COLUMN owner_token TEXT')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def append(self, sink: str, event: WebhookEvent) -> int:
+        """Escribe el evento en el journal y espera a que su grupo se confirme. Devuelve su id"""
+        body = event.raw_body if event.raw_body is not None else json.dumps(event.payload, ensure_ascii=False).encode('utf-8')
+        enrichment = json.dumps(event.enrichment, ensure_ascii=False) if event.enrichment else None
+        write = JournalWrite((sink, body, enrichment, event.received_at))
+
+        self._ensure_writer_thread()
+        with self.condition:
+            self.pending_writes.append(write)
+            self.condition.notify()
+
+        write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.journal_id
+
+    def ack(self, events: List[WebhookEvent]):
+        """Marca eventos como reenviados; se borran en el siguiente commit del escritor"""
+        journal_ids = [event.journal_id for event in events if event.journal_id is not None]
+        if not journal_ids:
+            return
+        self._ensure_writer_thread()
+        with self.condition:
+            self.pending_acks.extend(journal_ids)
+            self.condition.notify()
+
+    def record_attempts(self, events: List[WebhookEvent]):
+        """Los intentos no se guardan: un evento recuperado con replay() vuelve a empezar su cuenta"""
+
+    def _after_fork(self):
+        # El hijo es otro proceso: sus filas no deben confundirse con las del padre
+        self.process_token = uuid.uuid4().hex
+        self.condition = threading.Condition()
+        self.pending_writes = []
+        self.pending_acks = []
+        self.writer_thread = None
+
+    def replay(self, sink: str) -> List[WebhookEvent]:
+        """Reclama para este proceso los eventos del sink escritos por cualquier otro proceso (o
+        sin dueño) y los devuelve en el orden en que se escribieron. Se llama al arrancar el
+        worker, que es el único proceso que escribe en el journal (cola en memoria)"""
+        if not self.enabled:
+            return []
+
+        token = self.process_token
+        events = []
+        corrupt = []
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE: dos workers que arrancan a la vez no reclaman la misma fila
+            conn.isolation_level = None
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                owner_filter = '(owner_token IS NULL OR owner_token != ?)'
+                rows = conn.execute(
+                    f'SELECT id, body, enrichment, received_at FROM journal_events '
+                    f'WHERE sink = ? AND {owner_filter} ORDER BY id', (sink, token)
+                ).fetchall()
+                if rows:
+                    conn.execute(f'UPDATE journal_events SET owner_token = ? WHERE sink = ? AND {owner_filter}',
+                                 (token, sink, token))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+            for journal_id, body, enrichment, received_at in rows:
+                try:
+                    event = WebhookEvent(json.loads(body), raw_body=bytes(body),
+                                         enrichment=json.loads(enrichment) if enrichment else None,
+                                         received_at=received_at)
+                except (ValueError, TypeError, AttributeError) as e:
+                    logger.error(f"❌ Evento {journal_id} del journal ilegible, se descarta: {str(e)}")
+                    corrupt.append((journal_id,))
+                    continue
+                event.journal_id = journal_id
+                events.append(event)
+
+            if corrupt:
+                with conn:
+                    conn.executemany('DELETE FROM journal_events WHERE id = ?', corrupt)
+        finally:
+            conn.close()
+
+        with self.condition:
+            self.stats["replayed"] += len(events)
+        return events
+
+    def _ensure_writer_thread(self):
+        # Tras un fork (gunicorn preload_app) el hilo no existe en el worker y se vuelve a crear
+        if self.writer_thread and self.writer_thread.is_alive():
+            return
+        with self.condition:
+            if self.writer_thread and self.writer_thread.is_alive():
+                return
+            self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True, name="EventJournalWriter")
+            self.writer_thread.start()
+
+    def _writer_loop(self):
+        """Confirma en una sola transacción todas las escrituras y acks acumulados"""
+        # La conexión se abre en el propio hilo: nunca se comparte entre procesos ni hilos
+        conn = self._connect()
+        token = self.process_token
+        while True:
+            with self.condition:
+                while not self.pending_writes and not self.pending_acks:
+                    self.condition.wait()
+
+            if self.group_commit_delay:
+                time.sleep(self.group_commit_delay)
+
+            with self.condition:
+                writes, self.pending_writes = self.pending_writes, []
+                acks, self.pending_acks = self.pending_acks, []
+
+            try:
+                with conn:
+                    for write in writes:
+                        cursor = conn.execute(
+                            'INSERT INTO journal_events (sink, body, enrichment, received_at, owner_token) VALUES (?, ?, ?, ?, ?)',
+                            (*write.row, token)
+                        )
+                        write.journal_id = cursor.lastrowid
+                    if acks:
+                        conn.executemany('DELETE FROM journal_events WHERE id = ?', [(journal_id,) for journal_id in acks])
+                with self.condition:
+                    self.stats["appended"] += len(writes)
+                    self.stats["acked"] += len(acks)
+                    self.stats["commits"] += 1
+            except Exception as e:
+                logger.error(f"❌ Error confirmando journal ({len(writes)} escrituras, {len(acks)} acks): {str(e)}")
+                with self.condition:
+                    self.stats["errors"] += 1
+                    # Los acks se reintentan en el siguiente commit; las escrituras fallan hacia quien las pidió
+                    self.pending_acks[:0] = acks
+                for write in writes:
+                    write.error = e
+                time.sleep(0.1)
+            finally:
+                for write in writes:
+                    write.done.set()
+
+    def pending_count(self) -> int:
+        if not self.enabled:
+            return 0
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM journal_events').fetchone()[0]
+        finally:
+            conn.close()
+
+    def refresh_pending_count(self) -> int:
+        """Cuenta los eventos pendientes y guarda el resultado para get_stats()"""
+        pending = self.pending_count()
+        with self.condition:
+            self.pending_cached = pending
+            self.pending_counted_at = time.time()
+        return pending
+
+    def get_stats(self) -> Dict:
+        with self.condition:
+            stats = dict(self.stats)
+            pending, counted_at = self.pending_cached, self.pending_counted_at
+        return {
+            "enabled": self.enabled,
+            "path": self.db_path,
+            "synchronous": self.synchronous,
+            # Último conteo del HealthProber (None hasta el primer chequeo)
+            "pending": pending if self.enabled else 0,
+            "pending_counted_at": counted_at,
+            **stats
+        }
+
+
+# Instancia global
+_event_journal = None
+_event_journal_lock = threading.Lock()
+
+
+def get_event_journal() -> EventJournal:
+    """Obtiene la instancia del journal de eventos"""
+    global _event_journal
+    if _event_journal is None:
+        with _event_journal_lock:
+            if _event_journal is None:
+                _event_journal = EventJournal()
+    return _event_journal
@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+import random
+import threading
+from typing import Dict, List, Optional
+from .message_queue_service import DEFAULT_SINK, get_configured_sinks
+from .webhook_event import WebhookEnvelope
+
+logger = logging.getLogger(__name__)
+
+
+class RouteDecision:
+    """Resultado del enrutamiento de un evento"""
+    __slots__ = ('action', 'sink', 'rule')
+
+    def __init__(self, action: str, sink: str = DEFAULT_SINK, rule: Optional[str] = None):
+        self.action = action
+        self.sink = sink
+        self.rule = rule
+
+    @property
+    def dropped(self) -> bool:
+        return self.action == 'drop'
+
+
+class RoutingRule:
+    """Regla compilada: cada criterio es un conjunto de valores aceptados (None = cualquiera)"""
+    __slots__ = ('name', 'fields', 'message_types', 'senders', 'phone_number_ids',
+                 'statuses', 'action', 'rate', 'sink', 'hits')
+
+    ACTIONS = ('forward', 'drop', 'sample', 'route')
+
+    def __init__(self, config: Dict, index: int, sinks: Dict[str, str]):
+        match = config.get('match', {})
+        self.name = config.get('name') or f"rule_{index}"
+        self.fields = self._as_set(match.get('field'))
+        self.message_types = self._as_set(match.get('message_type'))
+        self.senders = self._as_set(match.get('sender'))
+        self.phone_number_ids = self._as_set(match.get('phone_number_id'))
+        self.statuses = self._as_set(match.get('status'))
+        self.action = config.get('action', 'forward')
+        self.rate = float(config.get('rate', 1.0))
+        self.sink = config.get('sink', DEFAULT_SINK)
+        self.hits = 0
+
+        if self.action not in self.ACTIONS:
+            raise ValueError(f"acción desconocida '{self.action}'")
+        if self.sink not in sinks:
+            raise ValueError(f"sink desconocido '{self.sink}'")
+        if not 0.0 <= self.rate <= 1.0:
+            raise ValueError(f"rate fuera de rango: {self.rate}")
+
+    @staticmethod
+    def _as_set(value) -> Optional[frozenset]:
+        if value is None:
+            return None
+        if isinstance(value, (list, tuple, set)):
+            return frozenset(str(item) for item in value)
+        return frozenset((str(value),))
+
+    def matches(self, envelope: WebhookEnvelope) -> bool:
+        if self.fields is not None and envelope.field not in self.fields:
+            return False
+        if self.message_types is not None and envelope.message_type not in self.message_types:
+            return False
+        if self.senders is not None and envelope.sender not in self.senders:
+            return False
+        if self.phone_number_ids is not None and envelope.phone_number_id not in self.phone_number_ids:
+            return False
+        if self.statuses is not None:
+            # Solo coincide si TODOS los statuses del webhook están en la lista (ej. solo 'read')
+            if not envelope.statuses or envelope.messages:
+                return False
+            if any(status not in self.statuses for _, status in envelope.statuses):
+                return False
+        return True
+
+
+class EventRouter:
+    """Reglas de enrutamiento/filtrado evaluadas antes de la cola FIFO (la primera que coincide gana).
+
+    Las reglas se leen al iniciar desde WEBHOOK_ROUTING_RULES (JSON) o desde el
+    archivo indicado en WEBHOOK_ROUTING_RULES_FILE. Ejemplo:
+        [{"match": {"status": ["read"]}, "action": "drop"},
+         {"match": {"message_type": "reaction"}, "action": "sample", "rate": 0.1},
+         {"match": {"phone_number_id": "123"}, "action": "route", "sink": "ventas"}]
+    """
+
+    def __init__(self):
+        self.rules: List[RoutingRule] = []
+        self.lock = threading.Lock()
+        self.stats = {"routed": 0, "dropped": 0, "sampled_out": 0}
+        self._compile(self._load_config())
+        logger.info(f"🧭 EventRouter inicializado - {len(self.rules)} regla(s)")
+
+    def _load_config(self) -> List[Dict]:
+        rules_file = os.getenv('WEBHOOK_ROUTING_RULES_FILE')
+        raw_rules = os.getenv('WEBHOOK_ROUTING_RULES')
+        try:
+            if rules_file:
+                with open(rules_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            if raw_rules:
+                return json.loads(raw_rules)
+        except Exception as e:
+            logger.error(f"❌ Error leyendo reglas de enrutamiento, se reenvía todo: {str(e)}")
+        return []
+
+    def _compile(self, config: List[Dict]):
+        sinks = get_configured_sinks()
+        for index, rule_config in enumerate(config):
+            try:
+                self.rules.append(RoutingRule(rule_config, index, sinks))
+            except Exception as e:
+                logger.error(f"❌ Regla de enrutamiento {index} inválida, se ignora: {str(e)}")
+
+    def route(self, envelope: WebhookEnvelope) -> RouteDecision:
+        """Decide qué hacer con el evento: forward/route a un sink, drop o sample"""
+        for rule in self.rules:
+            if not rule.matches(envelope):
+                continue
+
+            with self.lock:
+                rule.hits += 1
+
+            if rule.action == 'drop':
+                self._count('dropped')
+                return RouteDecision('drop', rule=rule.name)
+
+            if rule.action == 'sample' and random.random() >= rule.rate:
+                self._count('sampled_out')
+                return RouteDecision('drop', rule=rule.name)
+
+            self._count('routed')
+            return RouteDecision('forward', sink=rule.sink, rule=rule.name)
+
+        self._count('routed')
+        return RouteDecision('forward')
+
+    def _count(self, key: str):
+        with self.lock:
+            self.stats[key] += 1
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {
+                **self.stats,
+                "rules": [
+                    {"name": rule.name, "action": rule.action, "sink": rule.sink, "hits": rule.hits}
+                    for rule in self.rules
+                ]
+            }
+
+
+# Instancia global
+_event_router = None
+_event_router_lock = threading.Lock()
+
+
+def get_event_router() -> EventRouter:
+    """Obtiene la instancia del enrutador de eventos"""
+    global _event_router
+    if _event_router is None:
+        with _event_router_lock:
+            if _event_router is None:
+                _event_router = EventRouter()
+    return _event_router
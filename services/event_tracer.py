@@ -0,0 +1,281 @@
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class EventTrace:
+    """Etapas de un webhook desde que llega hasta que se entrega al WebSocket.
+
+    Cada etapa es un span (nombre, inicio, fin, atributos) en tiempo epoch. La
+    traza pasa de hilo en hilo junto con el evento (petición, ingesta, procesador
+    del carril, lector de acks) y nunca la tocan dos hilos a la vez.
+    """
+    __slots__ = ('trace_id', 'started_at', 'finished_at', 'spans', 'attributes', 'outcome', 'mark')
+
+    def __init__(self, started_at: float):
+        self.trace_id = os.urandom(16).hex()
+        self.started_at = started_at
+        self.finished_at = None
+        self.spans = []
+        self.attributes = {}
+        self.outcome = None
+        # Fin de la última etapa registrada: inicio de la espera siguiente
+        self.mark = started_at
+
+    def add_span(self, name: str, start: float, end: float, **attributes):
+        self.spans.append((name, start, end, attributes))
+        self.mark = end
+
+    def span(self, name: str, **attributes) -> 'SpanTimer':
+        return SpanTimer(self, name, attributes)
+
+    @property
+    def duration_ms(self) -> float:
+        return round(((self.finished_at or time.time()) - self.started_at) * 1000, 3)
+
+    def stage_ms(self, name: str) -> float:
+        return round(sum(end - start for span_name, start, end, _ in self.spans if span_name == name) * 1000, 3)
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "outcome": self.outcome,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "spans": [
+                {
+                    "name": name,
+                    "offset_ms": round((start - self.started_at) * 1000, 3),
+                    "duration_ms": round((end - start) * 1000, 3),
+                    **({"attributes": attributes} if attributes else {})
+                }
+                for name, start, end, attributes in self.spans
+            ]
+        }
+
+    def to_otlp(self, service_name: str) -> Dict:
+        """ExportTraceServiceRequest de OTLP/JSON: un span raíz 'webhook' y un hijo por etapa"""
+        def otlp_attributes(attributes: Dict) -> List[Dict]:
+            result = []
+            for key, value in attributes.items():
+                if value is None:
+                    continue
+                if isinstance(value, bool):
+                    result.append({"key": key, "value": {"boolValue": value}})
+                elif isinstance(value, int):
+                    result.append({"key": key, "value": {"intValue": str(value)}})
+                elif isinstance(value, float):
+                    result.append({"key": key, "value": {"doubleValue": value}})
+                else:
+                    result.append({"key": key, "value": {"stringValue": str(value)}})
+            return result
+
+        root_id = os.urandom(8).hex()
+        spans = [{
+            "traceId": self.trace_id,
+            "spanId": root_id,
+            "name": "webhook",
+            "kind": 2,  # SPAN_KIND_SERVER
+            "startTimeUnixNano": str(int(self.started_at * 1e9)),
+            "endTimeUnixNano": str(int((self.finished_at or time.time()) * 1e9)),
+            "attributes": otlp_attributes({**self.attributes, "outcome": self.outcome}),
+            "status": {"code": 1 if self.outcome == 'delivered' else 0}
+        }]
+        for name, start, end, attributes in self.spans:
+            spans.append({
+                "traceId": self.trace_id,
+                "spanId": os.urandom(8).hex(),
+                "parentSpanId": root_id,
+                "name": name,
+                "kind": 1,  # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(int(start * 1e9)),
+                "endTimeUnixNano": str(int(end * 1e9)),
+                "attributes": otlp_attributes(attributes)
+            })
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": otlp_attributes({"service.name": service_name})},
+                "scopeSpans": [{"scope": {"name": "webhook.event_tracer"}, "spans": spans}]
+            }]
+        }
+
+
+class SpanTimer:
+    """Context manager que registra la duración del bloque como un span de la traza"""
+    __slots__ = ('trace', 'name', 'attributes', 'started')
+
+    def __init__(self, trace: EventTrace, name: str, attributes: Dict):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self) -> 'SpanTimer':
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.add_span(self.name, self.started, time.time(), **self.attributes)
+
+
+class EventTracer:
+    """Guarda las últimas N trazas completas en un ring buffer y opcionalmente las exporta.
+
+    Con TRACE_EXPORT_PATH cada traza se escribe como una línea OTLP/JSON desde un
+    hilo aparte, así que el camino de reenvío nunca hace E/S de archivo.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv('TRACING_ENABLED', 'true').lower() == 'true'
+        self.sample_rate = float(os.getenv('TRACE_SAMPLE_RATE', '1.0'))
+        self.buffer = deque(maxlen=int(os.getenv('TRACE_BUFFER_SIZE', '1000')))
+        self.lock = threading.Lock()
+        self.completed = 0
+
+        self.export_path = os.getenv('TRACE_EXPORT_PATH') or None
+        self.service_name = os.getenv('TRACE_SERVICE_NAME', 'whatsapp-webhook')
+        self.export_queue = queue.Queue(maxsize=10000)
+        self.export_thread = None
+        self.export_dropped = 0
+
+        logger.info(f"🧵 EventTracer inicializado - activo: {self.enabled}, muestreo: {self.sample_rate}, "
+                    f"buffer: {self.buffer.maxlen}, exportación: {self.export_path or 'no'}")
+
+    def start_trace(self, started_at: float = None, **attributes) -> Optional[EventTrace]:
+        """Nueva traza, o None si el tracing está apagado o el evento no entra en el muestreo"""
+        if not self.enabled or (self.sample_rate < 1.0 and random.random() >= self.sample_rate):
+            return None
+        trace = EventTrace(started_at or time.time())
+        trace.attributes.update(attributes)
+        return trace
+
+    def finish(self, trace: Optional[EventTrace], outcome: str = 'delivered'):
+        """Cierra la traza y la guarda en el ring buffer (y en la cola de exportación)"""
+        if trace is None or trace.finished_at is not None:
+            return
+        trace.finished_at = time.time()
+        trace.outcome = outcome
+        with self.lock:
+            self.buffer.append(trace)
+            self.completed += 1
+
+        if self.export_path:
+            self._ensure_export_thread()
+            try:
+                self.export_queue.put_nowait(trace)
+            except queue.Full:
+                with self.lock:
+                    self.export_dropped += 1
+
+    def _ensure_export_thread(self):
+        # Tras un fork (gunicorn preload_app) el hilo no existe en el worker y se vuelve a crear
+        if self.export_thread and self.export_thread.is_alive():
+            return
+        with self.lock:
+            if self.export_thread and self.export_thread.is_alive():
+                return
+            self.export_thread = threading.Thread(target=self._export_loop, daemon=True, name="TraceExporter")
+            self.export_thread.start()
+
+    def _export_loop(self):
+        """Escribe las trazas como líneas OTLP/JSON, agrupando las que se acumularon"""
+        export_dir = os.path.dirname(self.export_path)
+        if export_dir:
+            os.makedirs(export_dir, exist_ok=True)
+        while True:
+            traces = [self.export_queue.get()]
+            try:
+                while True:
+                    traces.append(self.export_queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                with open(self.export_path, 'a', encoding='utf-8') as f:
+                    for trace in traces:
+                        f.write(json.dumps(trace.to_otlp(self.service_name), ensure_ascii=False) + '\n')
+            except Exception as e:
+                logger.error(f"❌ Error exportando {len(traces)} traza(s) a {self.export_path}: {str(e)}")
+
+    def _snapshot(self) -> List[EventTrace]:
+        with self.lock:
+            return list(self.buffer)
+
+    def slow_traces(self, min_ms: float = 0, limit: int = 20, stage: str = None, sender: str = None) -> List[Dict]:
+        """Trazas más lentas del buffer (por duración total o de una etapa), de mayor a menor"""
+        traces = self._snapshot()
+        if sender:
+            traces = [trace for trace in traces if trace.attributes.get('sender') == sender]
+
+        def measure(trace: EventTrace) -> float:
+            return trace.stage_ms(stage) if stage else trace.duration_ms
+
+        ranked = sorted(((measure(trace), trace) for trace in traces), key=lambda item: item[0], reverse=True)
+        return [trace.to_dict() for value, trace in ranked[:limit] if value >= min_ms]
+
+    def get_trace(self, trace_id: str) -> Optional[Dict]:
+        for trace in self._snapshot():
+            if trace.trace_id == trace_id:
+                return trace.to_dict()
+        return None
+
+    def stage_stats(self) -> Dict:
+        """Percentiles por etapa sobre las trazas del buffer: dónde se va el tiempo"""
+        durations: Dict[str, List[float]] = {}
+        outcomes: Dict[str, int] = {}
+        for trace in self._snapshot():
+            outcomes[trace.outcome] = outcomes.get(trace.outcome, 0) + 1
+            durations.setdefault('total', []).append(trace.duration_ms / 1000)
+            for name, start, end, _ in trace.spans:
+                durations.setdefault(name, []).append(end - start)
+
+        def percentile(ordered: List[float], p: float) -> float:
+            index = min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))
+            return round(ordered[index] * 1000, 3)
+
+        stages = {}
+        for name, values in durations.items():
+            ordered = sorted(values)
+            stages[name] = {
+                "count": len(ordered),
+                "p50_ms": percentile(ordered, 0.50),
+                "p95_ms": percentile(ordered, 0.95),
+                "p99_ms": percentile(ordered, 0.99),
+                "max_ms": round(ordered[-1] * 1000, 3)
+            }
+        return {"stages": stages, "outcomes": outcomes}
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "sample_rate": self.sample_rate,
+                "buffered": len(self.buffer),
+                "buffer_size": self.buffer.maxlen,
+                "completed": self.completed,
+                "export_path": self.export_path,
+                "export_pending": self.export_queue.qsize(),
+                "export_dropped": self.export_dropped
+            }
+
+
+# Instancia global
+_event_tracer = None
+_event_tracer_lock = threading.Lock()
+
+
+def get_event_tracer() -> EventTracer:
+    """Obtiene la instancia del tracer de eventos"""
+    global _event_tracer
+    if _event_tracer is None:
+        with _event_tracer_lock:
+            if _event_tracer is None:
+                _event_tracer = EventTracer()
+    return _event_tracer
@@ -0,0 +1,211 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional
+import requests
+import websocket
+
+logger = logging.getLogger(__name__)
+
+
+class HealthProber:
+    """Verifica las dependencias (WebSocket, Redis, SQLite, Graph API) en segundo plano.
+
+    Un hilo ejecuta los chequeos cada HEALTH_PROBE_INTERVAL segundos y guarda el
+    resultado de cada uno con su marca de tiempo. /api/status y /api/queue/status
+    responden desde ese resultado en memoria, así que los healthchecks de Docker y
+    los dashboards ya no abren una conexión nueva al consumidor en cada consulta.
+    """
+
+    def __init__(self):
+        self.interval = float(os.getenv('HEALTH_PROBE_INTERVAL', '10'))
+        self.timeout = float(os.getenv('HEALTH_PROBE_TIMEOUT', '3'))
+        # Un resultado más viejo que esto se marca como "stale" (el hilo no está al día)
+        self.stale_after = self.interval * 3
+
+        self.results: Dict[str, Dict] = {}
+        self.last_run_at: Optional[float] = None
+        self.runs = 0
+        self.lock = threading.Lock()
+        self.probe_lock = threading.Lock()
+        self.prober_thread = None
+        self.redis_client = None
+
+        logger.info(f"🩺 HealthProber inicializado - intervalo: {self.interval}s, timeout: {self.timeout}s")
+
+    # --- Chequeos ---
+
+    def _check_websocket(self) -> Dict:
+        """Para cada sink: si un carril ya tiene la conexión abierta no se abre otra"""
+        from .message_queue_service import MessageQueueService, get_configured_sinks
+
+        active = {service.sink: service for service in MessageQueueService.all_instances()}
+        sinks = {}
+        for sink, url in get_configured_sinks().items():
+            url = url or os.getenv('WEBSOCKET_URL', 'ws://localhost:8080/ws')
+            service = active.get(sink)
+            lanes = service.lanes if service is not None and getattr(service, 'lanes', None) else []
+            if any(lane.websocket_service.ws is not None and lane.websocket_service.ws.connected for lane in lanes):
+                sinks[sink] = {"ok": True, "url": url, "mode": "passive"}
+                continue
+            try:
+                ws = websocket.create_connection(url, timeout=self.timeout)
+                ws.close()
+                sinks[sink] = {"ok": True, "url": url, "mode": "active"}
+            except Exception as e:
+                sinks[sink] = {"ok": False, "url": url, "mode": "active", "error": str(e)}
+        return {"ok": all(result["ok"] for result in sinks.values()), "sinks": sinks}
+
+    def _check_redis(self) -> Dict:
+        """Broker de Celery (y de la cola si WEBHOOK_QUEUE_BACKEND=redis_streams)"""
+        if self.redis_client is None:
+            import redis
+            self.redis_client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+                                                     socket_timeout=self.timeout, socket_connect_timeout=self.timeout)
+        self.redis_client.ping()
+        return {"ok": True}
+
+    def _check_sqlite(self) -> Dict:
+        """Cache de números: abre la base existente en solo lectura/escritura (sin crearla)"""
+        db_path = os.getenv('CACHE_DB_PATH', '/app/data/cache.db')
+        conn = sqlite3.connect(f"file:{db_path}?mode=rw", uri=True, timeout=self.timeout)
+        try:
+            conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        finally:
+            conn.close()
+        return {"ok": True, "path": db_path}
+
+    def _check_graph(self) -> Dict:
+        """Alcance de la Graph API: cualquier respuesta HTTP que no sea 5xx cuenta como disponible"""
+        url = f"{os.getenv('BASE_URL', 'https://graph.facebook.com')}/{os.getenv('VERSION', 'v17.0')}/"
+        response = requests.get(url, timeout=self.timeout)
+        return {"ok": response.status_code < 500, "status_code": response.status_code}
+
+    def _check_whatsapp_config(self) -> Dict:
+        """Credenciales de WhatsApp presentes en .env (WhatsAppService recarga el archivo)"""
+        from .whatsapp_service import WhatsAppService
+
+        whatsapp_service = WhatsAppService()
+        whatsapp_service._get_access_token()
+        return {"ok": True}
+
+    def _check_journal(self) -> Dict:
+        """Eventos pendientes del journal: el conteo queda cacheado para /api/queue/status"""
+        from .event_journal import get_event_journal
+
+        journal = get_event_journal()
+        return {"ok": True, "enabled": journal.enabled, "pending": journal.refresh_pending_count()}
+
+    def _checks(self) -> Dict[str, Callable[[], Dict]]:
+        return {
+            "websocket": self._check_websocket,
+            "redis": self._check_redis,
+            "sqlite": self._check_sqlite,
+            "graph_api": self._check_graph,
+            "whatsapp_config": self._check_whatsapp_config,
+            "journal": self._check_journal
+        }
+
+    # --- Ciclo de verificación ---
+
+    def probe(self) -> Dict[str, Dict]:
+        """Ejecuta todos los chequeos una vez y actualiza el resultado en memoria"""
+        with self.probe_lock:
+            results = {}
+            for name, check in self._checks().items():
+                started = time.monotonic()
+                try:
+                    result = check()
+                except Exception as e:
+                    result = {"ok": False, "error": str(e)}
+                result["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+                result["checked_at"] = time.time()
+                if not result["ok"]:
+                    previous = self.results.get(name)
+                    if previous is None or previous["ok"]:
+                        logger.warning(f"❌ Health check '{name}' falló: {result.get('error', result)}")
+                elif name in self.results and not self.results[name]["ok"]:
+                    logger.info(f"✅ Health check '{name}' recuperado")
+                results[name] = result
+
+            with self.lock:
+                self.results = results
+                self.last_run_at = time.time()
+                self.runs += 1
+            return results
+
+    def _probe_loop(self):
+        while True:
+            try:
+                self.probe()
+            except Exception as e:
+                logger.error(f"❌ Error en el ciclo de health checks: {str(e)}")
+            time.sleep(self.interval)
+
+    def start(self):
+        """Arranca el hilo de verificación (también tras un fork: el hilo no se hereda)"""
+        if self.prober_thread and self.prober_thread.is_alive():
+            return
+        with self.lock:
+            if self.prober_thread and self.prober_thread.is_alive():
+                return
+            self.prober_thread = threading.Thread(target=self._probe_loop, daemon=True, name="HealthProber")
+            self.prober_thread.start()
+
+    # --- Lectura ---
+
+    def get_results(self) -> Dict[str, Dict]:
+        """Último resultado de cada chequeo, con su antigüedad. Nunca abre conexiones
+        salvo la primera vez, cuando todavía no hay ningún resultado"""
+        self.start()
+        with self.lock:
+            results = self.results
+        if not results:
+            # Si el hilo ya está verificando, esperar su resultado en lugar de repetir los chequeos
+            with self.probe_lock:
+                results = self.results
+            if not results:
+                results = self.probe()
+
+        now = time.time()
+        snapshot = {}
+        for name, result in results.items():
+            age = now - result["checked_at"]
+            snapshot[name] = {**result, "age_seconds": round(age, 1), "stale": age > self.stale_after}
+        return snapshot
+
+    def is_ok(self, name: str) -> bool:
+        return self.get_results().get(name, {}).get("ok", False)
+
+    def websocket_available(self, sink: str) -> Optional[bool]:
+        """Disponibilidad cacheada del WebSocket de un sink (None si todavía no se verificó)"""
+        result = self.get_results().get("websocket", {})
+        sink_result = result.get("sinks", {}).get(sink)
+        return sink_result["ok"] if sink_result is not None else None
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {
+                "interval_seconds": self.interval,
+                "timeout_seconds": self.timeout,
+                "runs": self.runs,
+                "last_run_at": self.last_run_at,
+                "prober_thread_alive": bool(self.prober_thread and self.prober_thread.is_alive())
+            }
+
+
+# Instancia global
+_health_prober = None
+_health_prober_lock = threading.Lock()
+
+
+def get_health_prober() -> HealthProber:
+    """Obtiene la instancia del verificador de salud"""
+    global _health_prober
+    if _health_prober is None:
+        with _health_prober_lock:
+            if _health_prober is None:
+                _health_prober = HealthProber()
+    return _health_prober
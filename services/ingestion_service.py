@@ -0,0 +1,114 @@
+import logging
+import os
+import queue
+import threading
+from typing import Callable, Dict, Optional
+from .event_journal import get_event_journal
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionService:
+    """Recepción rápida de webhooks: encola el cuerpo crudo y difiere parseo, enriquecimiento y reenvío"""
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super(IngestionService, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if hasattr(self, '_initialized'):
+            return
+
+        # 'sync' procesa dentro de la petición, 'deferred' responde al instante y procesa en background
+        self.mode = os.getenv('WEBHOOK_INGESTION_MODE', 'sync').lower()
+        max_pending = int(os.getenv('WEBHOOK_INGESTION_MAX_PENDING', '10000'))
+        self.pending_queue = queue.Queue(maxsize=max_pending)
+
+        self.handler: Optional[Callable[[bytes, float], Dict]] = None
+        self.worker_thread = None
+        self.running = False
+
+        self.stats_lock = threading.Lock()
+        self.stats = {"accepted": 0, "rejected": 0, "processed": 0, "failed": 0}
+        self._initialized = True
+
+        logger.info(f"📥 IngestionService inicializado - modo: {self.mode}")
+        if self.deferred and get_event_journal().enabled:
+            # El 200 sale antes de que el worker de ingesta escriba el evento en el journal
+            logger.warning("⚠️ Ingesta diferida con journal activo: los webhooks aceptados que aún no se "
+                           "encolaron se pierden si el proceso cae (usar WEBHOOK_INGESTION_MODE=sync para durabilidad)")
+
+    @property
+    def deferred(self) -> bool:
+        return self.mode == 'deferred'
+
+    def set_handler(self, handler: Callable[[bytes, float], Dict]):
+        """Define la etapa que parsea, enriquece y reenvía cada cuerpo crudo"""
+        self.handler = handler
+
+    def submit(self, raw_body: bytes, received_at: float) -> bool:
+        """Encola un cuerpo crudo. Devuelve False si la cola de ingesta está llena"""
+        self._ensure_worker_running()
+        try:
+            self.pending_queue.put_nowait((raw_body, received_at))
+        except queue.Full:
+            self._increment('rejected')
+            logger.error(f"❌ Cola de ingesta llena ({self.pending_queue.qsize()}), webhook rechazado")
+            return False
+
+        self._increment('accepted')
+        return True
+
+    def _increment(self, key: str):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def _ensure_worker_running(self):
+        """Verifica y reinicia el worker de ingesta si no está activo"""
+        if self.worker_thread and self.worker_thread.is_alive():
+            return
+        with self._lock:
+            if self.worker_thread and self.worker_thread.is_alive():
+                return
+            self.running = True
+            # Un solo worker para conservar el orden de llegada antes de la cola FIFO
+            self.worker_thread = threading.Thread(target=self._worker_loop, daemon=True, name="IngestionWorker")
+            self.worker_thread.start()
+            logger.info("🎯 Worker de ingesta diferida iniciado")
+
+    def _worker_loop(self):
+        """Consume cuerpos crudos y ejecuta la etapa de procesamiento"""
+        while self.running:
+            try:
+                raw_body, received_at = self.pending_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            try:
+                if not self.handler:
+                    raise RuntimeError("Etapa de procesamiento no configurada")
+                self.handler(raw_body, received_at)
+                self._increment('processed')
+            except Exception as e:
+                self._increment('failed')
+                logger.error(f"❌ Error en etapa de ingesta diferida: {str(e)}")
+            finally:
+                self.pending_queue.task_done()
+
+        logger.info("🛑 Worker de ingesta terminado")
+
+    def get_status(self) -> Dict:
+        """Obtiene el estado de la ingesta"""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        return {
+            "mode": self.mode,
+            "pending": self.pending_queue.qsize(),
+            "worker_alive": self.worker_thread.is_alive() if self.worker_thread else False,
+            **stats
+        }
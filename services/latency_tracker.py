@@ -0,0 +1,56 @@
+import threading
+from collections import deque
+from typing import Dict
+
+
+class LatencyTracker:
+    """Mantiene una ventana de muestras de latencia y calcula percentiles"""
+
+    def __init__(self, name: str, max_samples: int = 2048):
+        self.name = name
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        """Registra una muestra de latencia en segundos"""
+        with self.lock:
+            self.samples.append(seconds)
+            self.count += 1
+
+    def snapshot(self) -> Dict:
+        """Devuelve percentiles en milisegundos de la ventana actual"""
+        with self.lock:
+            ordered = sorted(self.samples)
+            total = self.count
+
+        if not ordered:
+            return {"count": total, "window": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+
+        def percentile(p: float) -> float:
+            index = min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))
+            return round(ordered[index] * 1000, 3)
+
+        return {
+            "count": total,
+            "window": len(ordered),
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(ordered[-1] * 1000, 3)
+        }
+
+
+# Latencia de respuesta del endpoint /webhook (lo que ve Meta)
+webhook_ack_latency = LatencyTracker('webhook_ack')
+
+# Latencia desde la recepción del webhook hasta la entrega al WebSocket
+end_to_end_latency = LatencyTracker('end_to_end')
+
+
+def get_latency_stats() -> Dict:
+    """Obtiene las latencias de webhook y de extremo a extremo por separado"""
+    return {
+        "webhook_ack": webhook_ack_latency.snapshot(),
+        "end_to_end": end_to_end_latency.snapshot()
+    }
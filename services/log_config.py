@@ -0,0 +1,230 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from typing import Callable, Dict
+
+# Atributos estándar de LogRecord: lo demás que llegue en kwargs son campos estructurados
+_LOG_KWARGS = ('exc_info', 'stack_info', 'stacklevel', 'extra')
+
+
+class Truncated:
+    """Payload que se recorta (y se serializa) solo si el registro se llega a emitir"""
+    __slots__ = ('value', 'max_chars')
+
+    def __init__(self, value, max_chars: int = None):
+        self.value = value
+        self.max_chars = max_chars if max_chars is not None else int(os.getenv('LOG_PAYLOAD_MAX_CHARS', '1000'))
+
+    def __str__(self) -> str:
+        value = self.value
+        if isinstance(value, (bytes, bytearray)):
+            # Decodificar solo lo que se va a mostrar (con margen para caracteres multibyte)
+            text = bytes(value[:self.max_chars * 4]).decode('utf-8', errors='replace')
+            if len(text) > self.max_chars or len(value) > self.max_chars * 4:
+                return f"{text[:self.max_chars]}…({len(value)} bytes)"
+            return text
+        text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+        if len(text) > self.max_chars:
+            return f"{text[:self.max_chars]}…({len(text)} chars)"
+        return text
+
+
+class Lazy:
+    """Valor calculado solo si el registro se emite (p. ej. el tamaño de la cola)"""
+    __slots__ = ('func',)
+
+    def __init__(self, func: Callable[[], object]):
+        self.func = func
+
+    def __str__(self) -> str:
+        try:
+            return str(self.func())
+        except Exception as e:
+            return f"<error: {e}>"
+
+
+class LogSampler:
+    """Tasas de muestreo por categoría (LOG_SAMPLE_RATES="queue=0.01,websocket=0.1").
+    WARNING y superiores nunca se descartan"""
+
+    def __init__(self):
+        self.default_rate = float(os.getenv('LOG_SAMPLE_DEFAULT', '1.0'))
+        self.rates: Dict[str, float] = {}
+        for item in os.getenv('LOG_SAMPLE_RATES', '').split(','):
+            if '=' not in item:
+                continue
+            category, rate = item.split('=', 1)
+            try:
+                self.rates[category.strip()] = max(0.0, min(1.0, float(rate)))
+            except ValueError:
+                pass
+        self.lock = threading.Lock()
+        self.sampled_out: Dict[str, int] = {}
+
+    def should_emit(self, category: str, level: int) -> bool:
+        if level >= logging.WARNING:
+            return True
+        rate = self.rates.get(category, self.default_rate)
+        if rate >= 1.0 or (rate > 0.0 and random.random() < rate):
+            return True
+        with self.lock:
+            self.sampled_out[category] = self.sampled_out.get(category, 0) + 1
+        return False
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {"default_rate": self.default_rate, "rates": dict(self.rates), "sampled_out": dict(self.sampled_out)}
+
+
+class CategoryLogger(logging.LoggerAdapter):
+    """Logger de un camino caliente: aplica el muestreo de su categoría antes de crear el
+    registro y acepta campos clave/valor (logger.info("Evento entregado", lane=0, queue=Lazy(...)))"""
+
+    def __init__(self, logger: logging.Logger, category: str):
+        super().__init__(logger, {})
+        self.category = category
+
+    def log(self, level, msg, *args, **kwargs):
+        if not self.logger.isEnabledFor(level) or not _sampler.should_emit(self.category, level):
+            return
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in _LOG_KWARGS}
+        extra = kwargs.setdefault('extra', {})
+        extra['category'] = self.category
+        extra['fields'] = fields
+        self.logger.log(level, msg, *args, **kwargs)
+
+    def debug(self, msg, *args, **kwargs):
+        self.log(logging.DEBUG, msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self.log(logging.INFO, msg, *args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self.log(logging.WARNING, msg, *args, **kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self.log(logging.ERROR, msg, *args, **kwargs)
+
+
+class StructuredFormatter(logging.Formatter):
+    """Texto (formato de siempre + key=value) o JSON por línea, según LOG_FORMAT"""
+
+    def __init__(self, json_output: bool = False):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        self.json_output = json_output
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, 'fields', None) or {}
+        if not self.json_output:
+            line = super().format(record)
+            if fields:
+                line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+            return line
+
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        category = getattr(record, 'category', None)
+        if category:
+            entry["category"] = category
+        for key, value in fields.items():
+            entry[key] = value if isinstance(value, (int, float, bool)) or value is None else str(value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Encola el registro sin formatearlo: el formato y la escritura a stderr ocurren en el
+    hilo del QueueListener. Con la cola llena se descartan DEBUG/INFO (WARNING+ espera)"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Los argumentos se formatean después en otro hilo: deben ser inmutables o perezosos
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.WARNING:
+                self.queue.put(record)
+            else:
+                self.dropped += 1
+
+
+_sampler = LogSampler()
+_handler = None
+_listener = None
+_configure_lock = threading.Lock()
+
+
+def _start_listener():
+    global _listener
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(StructuredFormatter(os.getenv('LOG_FORMAT', 'text').lower() == 'json'))
+    _listener = logging.handlers.QueueListener(_handler.queue, stream_handler, respect_handler_level=False)
+    _listener.start()
+
+
+def _after_fork():
+    # El hilo del listener no sobrevive al fork (workers de gunicorn): cola y listener nuevos
+    if _handler is not None:
+        _handler.queue = queue.Queue(maxsize=_handler.queue.maxsize)
+        _start_listener()
+
+
+def _stop_listener():
+    if _listener is not None:
+        try:
+            _listener.stop()
+        except Exception:
+            pass
+
+
+def configure_logging():
+    """Configura el logging raíz con el handler asíncrono (idempotente)"""
+    global _handler, _sampler
+    with _configure_lock:
+        if _handler is not None:
+            return
+        # Releer las tasas: el módulo puede importarse antes de cargar el .env
+        _sampler = LogSampler()
+        _handler = NonBlockingQueueHandler(queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', '10000'))))
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(_handler)
+        root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+        _start_listener()
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=_after_fork)
+        # Vaciar la cola al terminar el proceso
+        atexit.register(_stop_listener)
+
+
+def get_category_logger(name: str, category: str) -> CategoryLogger:
+    """Logger con muestreo por categoría para los caminos calientes"""
+    return CategoryLogger(logging.getLogger(name), category)
+
+
+def get_logging_stats() -> Dict:
+    return {
+        "format": os.getenv('LOG_FORMAT', 'text').lower(),
+        "queued": _handler.queue.qsize() if _handler is not None else 0,
+        "dropped": _handler.dropped if _handler is not None else 0,
+        "sampling": _sampler.get_stats()
+    }
@@ -1,11 +1,20 @@
+import json
 import logging
+import time
 from typing import Dict, List, Optional
 from .whatsapp_service import WhatsAppService
 from .websocket_service import WebSocketService
 from .message_queue_service import MessageQueueService
 from .simple_cache import get_number_cache
+from .dedup_service import get_duplicate_filter
+from .status_coalescer import get_status_coalescer
+from .event_router import get_event_router
+from .webhook_event import WebhookEnvelope, WebhookEvent
+from .event_tracer import EventTrace, get_event_tracer
+from .log_config import Lazy, get_category_logger
 
 logger = logging.getLogger(__name__)
+webhook_log = get_category_logger(__name__, 'webhook')
 
 
 class MessageProcessor:
@@ -13,6 +22,10 @@ class MessageProcessor:
         self.whatsapp_service = whatsapp_service
         self.websocket_service = WebSocketService()
         self.message_queue_service = MessageQueueService()
+        self.duplicate_filter = get_duplicate_filter()
+        self.status_coalescer = get_status_coalescer()
+        self.event_router = get_event_router()
+        self.tracer = get_event_tracer()
         
     def process_webhook_data(self, data: Dict) -> List[Dict]:
         """Procesa los datos del webhook y extrae los mensajes"""
@@ -90,7 +103,7 @@ class MessageProcessor:
                     'text': button_info.get('text')
                 }
             
-            logger.info(f"Mensaje procesado: {msg_data['type']} de {msg_data['from']}")
+            webhook_log.info("Mensaje procesado", type=msg_data['type'], sender=msg_data['from'])
             return msg_data
             
         except Exception as e:
@@ -100,7 +113,7 @@ class MessageProcessor:
     def _process_status(self, status: Dict):
         """Procesa el estado de un mensaje"""
         try:
-            logger.info(f"Estado de mensaje: {status.get('status')} para {status.get('recipient_id')}")
+            webhook_log.info("Estado de mensaje", status=status.get('status'), recipient=status.get('recipient_id'))
         except Exception as e:
             logger.error(f"Error procesando estado: {str(e)}")
     
@@ -112,7 +125,7 @@ class MessageProcessor:
             # Enviar mensaje al WebSocket
             self.send_to_websocket(message_data)
             
-            logger.info(f"Mensaje procesado y enviado al WebSocket desde {from_number}")
+            webhook_log.info("Mensaje procesado y enviado al WebSocket", sender=from_number)
             return {
                 "processed": True,
                 "sent_to_websocket": True
@@ -127,61 +140,147 @@ class MessageProcessor:
         return self.whatsapp_service.get_media_url(media_id)
     
     
-    def send_to_websocket(self, webhook_data: Dict):
-        """Envía el JSON completo de WhatsApp al WebSocket usando el servicio dedicado con cola como respaldo"""
+    @staticmethod
+    def _build_cached_info(cached_data: Dict) -> Dict:
+        return {
+            'name': cached_data.get('name'),
+            'phone': cached_data.get('phone'),
+            'data': cached_data.get('data', {}),
+            'created_at': cached_data.get('created_at'),
+            'updated_at': cached_data.get('updated_at')
+        }
+
+    def enrich_envelope(self, envelope: WebhookEnvelope) -> Dict:
+        """Resuelve en el cache todos los remitentes del webhook con una sola consulta.
+
+        Los campos cached_info/save_number de primer nivel corresponden al primer
+        mensaje (compatibilidad); messages_cache_info trae el detalle por mensaje.
+        """
+        enrichment = {}
+        senders = envelope.senders
+
+        # Validar cache solo si hay números de teléfono
+        if not senders:
+            enrichment['save_number'] = False
+            # Ocurre con cada webhook de statuses: registro muestreado
+            webhook_log.info("📋 No se pudo extraer número de teléfono del webhook", statuses=len(envelope.statuses))
+            return enrichment
+
         try:
-            # Extraer el número de teléfono del webhook
-            from_number = None
-            if 'entry' in webhook_data:
-                for entry in webhook_data['entry']:
-                    if 'changes' in entry:
-                        for change in entry['changes']:
-                            if change.get('field') == 'messages':
-                                value = change.get('value', {})
-                                if 'messages' in value and value['messages']:
-                                    from_number = value['messages'][0].get('from')
-                                    break
-                        if from_number:
-                            break
-                    if from_number:
-                        break
-
-            # Validar cache solo si hay número de teléfono
-            if from_number:
-                try:
-                    cache = get_number_cache()
-                    cached_data = cache.get_number(from_number)
-
-                    # Agregar información del cache si está guardado
-                    if cached_data:
-                        webhook_data['cached_info'] = {
-                            'name': cached_data.get('name'),
-                            'phone': cached_data.get('phone'),
-                            'data': cached_data.get('data', {}),
-                            'created_at': cached_data.get('created_at'),
-                            'updated_at': cached_data.get('updated_at')
-                        }
-                        webhook_data['save_number'] = True
-                        logger.info(f"📋 Número {from_number} encontrado en cache - Nombre: {cached_data.get('name', 'N/A')}")
-                    else:
-                        webhook_data['save_number'] = False
-                        logger.info(f"📋 Número {from_number} NO encontrado en cache")
-                        
-                except Exception as cache_error:
-                    logger.error(f"❌ Error accediendo al cache: {cache_error}")
-                    webhook_data['save_number'] = False
-                    webhook_data['cache_error'] = str(cache_error)
+            cached_numbers = get_number_cache().get_numbers(senders)
+        except Exception as cache_error:
+            logger.error(f"❌ Error accediendo al cache: {cache_error}")
+            enrichment['save_number'] = False
+            enrichment['cache_error'] = str(cache_error)
+            return enrichment
+
+        cached_infos = {phone: self._build_cached_info(data) for phone, data in cached_numbers.items()}
+
+        # Agregar información del cache del primer remitente si está guardado
+        first_info = cached_infos.get(envelope.sender)
+        if first_info:
+            enrichment['cached_info'] = first_info
+            enrichment['save_number'] = True
+        else:
+            enrichment['save_number'] = False
+
+        enrichment['messages_cache_info'] = [
+            {
+                'message_id': message_id,
+                'from': sender,
+                'save_number': sender in cached_infos,
+                'cached_info': cached_infos.get(sender)
+            }
+            for message_id, sender in envelope.messages
+        ]
+
+        webhook_log.info("📋 Cache de remitentes consultado", found=len(cached_infos), senders=len(senders),
+                         messages=len(envelope.messages))
+        return enrichment
+
+    def process_webhook_body(self, raw_body: bytes, received_at: float = None) -> Dict:
+        """Etapa de procesamiento de un webhook crudo: parsea, enriquece con el cache y encola"""
+        trace = self.tracer.start_trace(received_at)
+        if trace is not None:
+            # Lectura del cuerpo en Flask (y espera en la ingesta diferida)
+            trace.add_span('webhook.receive', trace.started_at, time.time())
+        try:
+            webhook_data = json.loads(raw_body)
+            if not isinstance(webhook_data, dict):
+                raise ValueError("El webhook debe ser un objeto JSON")
+        except ValueError:
+            self.tracer.finish(trace, 'invalid')
+            raise
+        if trace is not None:
+            trace.add_span('webhook.parse', trace.mark, time.time(), bytes=len(raw_body))
+        return self.send_to_websocket(webhook_data, received_at=received_at, raw_body=raw_body, trace=trace)
+
+    def send_to_websocket(self, webhook_data: Dict, received_at: float = None, raw_body: bytes = None,
+                          trace: Optional[EventTrace] = None) -> Dict:
+        """Envía el JSON completo de WhatsApp al WebSocket usando el servicio dedicado con cola como respaldo.
+
+        Si se recibe el cuerpo crudo, se reenvía sin volver a serializarlo y el
+        enriquecimiento del cache viaja aparte en el evento.
+        """
+        claimed_keys = []
+        try:
+            # Extraer remitentes del webhook (una sola pasada, reutilizada por toda la cola)
+            envelope = WebhookEnvelope.from_payload(webhook_data)
+            filter_started = time.time()
+
+            # Redeliveries de Meta: se confirman con 200 pero no se enriquecen ni se encolan
+            claimed_keys = self.duplicate_filter.claim(envelope.dedup_keys())
+            if claimed_keys is None:
+                webhook_log.info("🔁 Webhook duplicado descartado", webhook=Lazy(envelope.describe))
+                self.tracer.finish(trace, 'duplicate_dropped')
+                return {"success": True, "method": "duplicate_dropped"}
+
+            # Reglas de enrutamiento: el tráfico descartado nunca ocupa memoria de cola ni WebSocket
+            decision = self.event_router.route(envelope)
+            if trace is not None:
+                trace.attributes.update(sender=envelope.sender, message_type=envelope.message_type,
+                                        messages=len(envelope.messages), sink=decision.sink)
+                trace.add_span('webhook.filter', filter_started, time.time())
+            if decision.dropped:
+                webhook_log.info("🧭 Webhook descartado por regla", rule=decision.rule, webhook=Lazy(envelope.describe))
+                self.tracer.finish(trace, 'dropped_by_rule')
+                return {"success": True, "method": "dropped_by_rule", "rule": decision.rule}
+
+            # Webhooks de solo statuses: se agrupan y se reenvía el último estado por mensaje
+            if self.status_coalescer.accepts(envelope):
+                self.tracer.finish(trace, 'status_coalesced')
+                result = self.status_coalescer.add(webhook_data, received_at, sink=decision.sink)
+                if not result.get('success'):
+                    self.duplicate_filter.release(claimed_keys)
+                return result
+
+            if trace is not None:
+                with trace.span('cache.lookup', senders=len(envelope.senders)):
+                    enrichment = self.enrich_envelope(envelope)
             else:
-                webhook_data['save_number'] = False
-                logger.info("📋 No se pudo extraer número de teléfono del webhook")
+                enrichment = self.enrich_envelope(envelope)
 
             # Usar el servicio de cola que maneja WebSocket directo y cola como respaldo
-            result = self.message_queue_service.add_message_to_queue(webhook_data)
+            event = WebhookEvent(webhook_data, raw_body=raw_body, enrichment=enrichment,
+                                 received_at=received_at, envelope=envelope)
+            event.trace = trace
+            queue_service = self.message_queue_service
+            if decision.sink != queue_service.sink:
+                queue_service = MessageQueueService(decision.sink)
+            result = queue_service.add_message_to_queue(event)
 
             if result['success']:
-                logger.info(f"✅ Webhook JSON enviado vía {result['method']}")
+                webhook_log.info("✅ Webhook JSON encolado", method=result['method'], sink=queue_service.sink)
             else:
                 logger.error(f"❌ Error enviando webhook: {result.get('error', 'Unknown error')}")
+                self.duplicate_filter.release(claimed_keys)
+                self.tracer.finish(trace, 'enqueue_failed')
+
+            return result
 
         except Exception as e:
-            logger.error(f"❌ Error crítico enviando webhook al WebSocket: {str(e)}")
\ No newline at end of file
+            logger.error(f"❌ Error crítico enviando webhook al WebSocket: {str(e)}")
+            # Sin encolar: el reintento de Meta debe procesarse, no descartarse como duplicado
+            self.duplicate_filter.release(claimed_keys)
+            self.tracer.finish(trace, 'error')
+            return {"success": False, "error": str(e)}
\ No newline at end of file
@@ -1,222 +1,555 @@
+import json
 import logging
+import os
 import threading
 import time
 import queue
-from typing import Dict
+import zlib
+from typing import Dict, List, Union
 from .websocket_service import WebSocketService
+from .webhook_event import WebhookEnvelope, WebhookEvent
+from .latency_tracker import end_to_end_latency, get_latency_stats
+from .event_journal import get_event_journal
+from .stream_queue import RedisStreamQueue
+from .dead_letter_store import DeadLetterStore, get_dead_letter_store
+from .health_prober import get_health_prober
+from .event_tracer import get_event_tracer
+from .log_config import Lazy, Truncated, get_category_logger, get_logging_stats
+from .metrics import (fifo_dead_lettered_total, fifo_dequeued_total, fifo_enqueued_total, get_metrics_registry,
+                      websocket_send_duration_seconds, websocket_send_failures_total)
 
 logger = logging.getLogger(__name__)
+# Una línea por evento en el camino caliente: muestreada con LOG_SAMPLE_RATES (queue=...)
+queue_log = get_category_logger(__name__, 'queue')
+
+DEFAULT_SINK = 'default'
+
+
+def get_configured_sinks() -> Dict[str, str]:
+    """Sinks con nombre definidos en WEBHOOK_SINKS ({"nombre": "ws://..."}). 'default' usa WEBSOCKET_URL"""
+    sinks = {DEFAULT_SINK: None}
+    raw_sinks = os.getenv('WEBHOOK_SINKS')
+    if raw_sinks:
+        try:
+            sinks.update(json.loads(raw_sinks))
+        except (ValueError, TypeError) as e:
+            logger.error(f"❌ WEBHOOK_SINKS inválido, se ignora: {str(e)}")
+    return sinks
+
+
+class QueueLane:
+    """Carril FIFO con su propio procesador y su propia conexión WebSocket.
+
+    Los eventos de un mismo remitente siempre caen en el mismo carril, así que el
+    orden por conversación se conserva aunque los carriles procesen en paralelo.
+    """
+
+    def __init__(self, sink: str, index: int, lane_count: int, stream_client=None):
+        self.sink = sink
+        self.index = index
+        self.websocket_service = WebSocketService(get_configured_sinks().get(sink))
+        if stream_client is not None:
+            # Backend Redis Streams: el stream es la cola y a la vez el almacenamiento durable
+            self.message_queue = RedisStreamQueue(stream_client, sink, index)
+            self.journal = self.message_queue
+        else:
+            self.message_queue = queue.Queue()
+            self.journal = get_event_journal()
+        # Slot de reintento: el lote que falló se reintenta antes de volver a leer la cola.
+        # Los productores no lo tocan (O(1) por fallo); el lock lo comparten el procesador y clear()
+        self.retry_batch: List[WebhookEvent] = []
+        self.lock = threading.Lock()
+
+        # Reintentos con backoff exponencial; tras WEBHOOK_MAX_ATTEMPTS fallos con el consumidor
+        # alcanzable el evento va a la dead-letter queue (0 = reintentar siempre)
+        self.retry_base_delay = float(os.getenv('WEBHOOK_RETRY_BASE_DELAY', '1'))
+        self.retry_max_delay = float(os.getenv('WEBHOOK_RETRY_MAX_DELAY', '60'))
+        self.max_attempts = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '10'))
+        self.dead_lettered = 0
+        self.tracer = get_event_tracer()
+        # Con acks negociados, los eventos se completan cuando el consumidor los confirma
+        self.websocket_service.on_acked = self._complete_acked_events
+        # Los reenvíos de eventos sin ack también consumen intentos y pueden terminar en la DLQ
+        self.websocket_service.max_attempts = self.max_attempts
+        self.websocket_service.on_exhausted = self._dead_letter_unacked
+        # Fallos seguidos con el consumidor caído: solo dimensionan el backoff, no consumen intentos
+        self.outage_failures = 0
+
+        base_name = "FIFOProcessor" if sink == DEFAULT_SINK else f"FIFOProcessor-{sink}"
+        self.thread_name = base_name if lane_count == 1 else f"{base_name}-lane{index}"
+        self.processor_thread = None
+        self.running = False
+
+    def depth(self) -> int:
+        """Eventos pendientes del carril, incluido el lote en espera de reintento"""
+        return self.message_queue.qsize() + len(self.retry_batch)
+
+    def oldest_age(self) -> float:
+        """Segundos que lleva encolado el evento más viejo del carril (0 si está vacío)"""
+        try:
+            head = self.retry_batch[0] if self.retry_batch else None
+        except IndexError:
+            head = None
+        if head is None:
+            if isinstance(self.message_queue, RedisStreamQueue):
+                return self.message_queue.oldest_age()
+            with self.message_queue.mutex:
+                head = self.message_queue.queue[0] if self.message_queue.queue else None
+        if head is None or head.queued_at is None:
+            return 0.0
+        return max(0.0, time.time() - head.queued_at)
+
+    def is_alive(self) -> bool:
+        return bool(self.processor_thread and self.processor_thread.is_alive())
+
+    def ensure_running(self):
+        """Verifica y reinicia el procesador del carril si no está activo"""
+        if not self.is_alive():
+            # Reiniciar flags para permitir nuevo thread
+            self.running = False
+            self.start()
+
+    def start(self):
+        """Inicia el procesador del carril en background usando threading"""
+        if self.running:
+            logger.warning("⚠️ Procesador ya está corriendo")
+            return
+
+        try:
+            self.running = True
+            self.processor_thread = threading.Thread(target=self._process_queue_loop, daemon=True, name=self.thread_name)
+            self.processor_thread.start()
+            logger.info("🎯 PROCESADOR DE COLA FIFO INICIADO CON THREADING")
+            logger.info(f"🔧 Thread ID: {self.processor_thread.ident}, Thread Name: {self.processor_thread.name}")
+        except Exception as e:
+            logger.error(f"❌ Error iniciando procesador de cola: {str(e)}")
+            self.running = False
+
+    def stop(self):
+        self.running = False
+        if self.is_alive():
+            self.processor_thread.join(timeout=5)
+
+    def _collect_batch(self, first_event: WebhookEvent) -> List[WebhookEvent]:
+        """Si el consumidor aceptó lotes, drena hasta N eventos o T ms de la cola conservando el orden"""
+        batch = [first_event]
+        if not self.websocket_service.batch_enabled:
+            return batch
+        try:
+            if not self.websocket_service.batching_active():
+                return batch
+        except Exception:
+            # Sin conexión: el envío del primer evento fallará y se reintentará
+            return batch
+
+        # El lote no debe desbordar la ventana de eventos sin ack
+        max_events = min(self.websocket_service.batch_max_events,
+                         max(1, self.websocket_service.ack_window_room()))
+        deadline = time.monotonic() + self.websocket_service.batch_linger
+        while len(batch) < max_events:
+            try:
+                batch.append(self.message_queue.get_nowait())
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.message_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        return batch
+
+    def _complete_events(self, events: List[WebhookEvent]):
+        """Marca eventos como entregados: latencia extremo a extremo, task_done y ack en el journal"""
+        delivered_at = time.time()
+        for event in events:
+            end_to_end_latency.record(delivered_at - event.received_at)
+            self.message_queue.task_done()
+            self.tracer.finish(event.trace)
+        self.journal.ack(events)
+
+    def _complete_acked_events(self, events: List[WebhookEvent]):
+        """Callback del lector de acks: registra la espera del ack en la traza y completa los eventos"""
+        acked_at = time.time()
+        for event in events:
+            if event.trace is not None:
+                # mark = inicio del envío: el lector de acks puede adelantarse al procesador, así que
+                # con acks el span cubre envío + confirmación y lo registra solo este hilo
+                event.trace.add_span('websocket.send_ack', event.trace.mark, acked_at,
+                                     attempt=event.attempts + 1, delivery_seq=event.seq)
+        self._complete_events(events)
+
+    def _wait_for_ack_window(self) -> bool:
+        """Espera hueco en la ventana de acks. Devuelve False si no se pudo reconectar para reenviar pendientes"""
+        try:
+            self.websocket_service.wait_for_ack_window()
+            return True
+        except Exception as e:
+            logger.warning(f"⏳ Eventos sin ack pendientes de reenvío, esperando conexión: {str(e)}")
+            time.sleep(1)
+            return False
+
+    def _retry_delay(self, attempts: int) -> float:
+        return min(self.retry_max_delay, self.retry_base_delay * (2 ** max(0, attempts - 1)))
+
+    def _handle_send_failure(self, batch: List[WebhookEvent], error: Exception):
+        """Cuenta el intento, manda a la DLQ lo que agotó sus intentos y espera con backoff"""
+        # Si no se pudo ni conectar es una caída del consumidor, no un evento envenenado:
+        # el intento no cuenta y una caída larga no manda el backlog a la DLQ
+        outage = self.websocket_service.connection_failing()
+        if outage:
+            self.outage_failures += 1
+            backoff_step = self.outage_failures
+        else:
+            self.outage_failures = 0
+            for item in batch:
+                item.attempts += 1
+            # Con Redis Streams los intentos se guardan junto al stream para el siguiente dueño del carril
+            self.journal.record_attempts(batch)
+            backoff_step = batch[0].attempts
+            if self.max_attempts and batch[0].attempts >= self.max_attempts and len(batch) == 1:
+                self._dead_letter(batch, error)
+                return
+
+        # Conservar los mensajes en el slot de reintento: siguen al frente del carril
+        # sin tocar la cola (sin task_done, así join() sigue contándolos como pendientes)
+        with self.lock:
+            self.retry_batch[:0] = batch
+
+        delay = self._retry_delay(backoff_step)
+        logger.info(f"🔄 {len(batch)} mensaje(s) en el slot de reintento al frente del carril "
+                    f"(intento {batch[0].attempts}{', consumidor caído' if outage else ''})")
+        logger.info(f"⏸️ ESPERANDO {delay:.1f} SEGUNDOS ANTES DE REINTENTAR...")
+        time.sleep(delay)
+
+    def _dead_letter(self, events: List[WebhookEvent], error: Exception):
+        """Saca eventos del carril y los guarda en la dead-letter queue"""
+        reason = f"{type(error).__name__}: {str(error)}"
+        try:
+            get_dead_letter_store().add(self.sink, events, reason)
+        except Exception as e:
+            # Sin DLQ disponible el evento no se descarta: sigue al frente del carril
+            logger.error(f"❌ No se pudo guardar en la dead-letter queue, se reintentará: {str(e)}")
+            with self.lock:
+                self.retry_batch[:0] = events
+            time.sleep(self.retry_max_delay)
+            return
+
+        for event in events:
+            self.message_queue.task_done()
+            self.tracer.finish(event.trace, 'dead_lettered')
+        self.journal.ack(events)
+        self.dead_lettered += len(events)
+        fifo_dead_lettered_total.inc(len(events), sink=self.sink)
+        logger.error(f"🪦 {len(events)} evento(s) enviados a la dead-letter queue tras {events[0].attempts} intentos: {reason}")
+
+    def _dead_letter_unacked(self, events: List[WebhookEvent]):
+        """Callback del WebSocket: eventos que agotaron sus intentos sin recibir ack"""
+        self._dead_letter(events, TimeoutError(f"Sin ack del consumidor tras {events[0].attempts} envíos"))
+
+    def _trace_send(self, batch: List[WebhookEvent], error: str = None):
+        """Span del envío al WebSocket (desde trace.mark) en la traza de cada evento del lote"""
+        sent_at = time.time()
+        for item in batch:
+            if item.trace is None:
+                continue
+            attributes = {"attempt": item.attempts + 1, "batch_size": len(batch)}
+            if error:
+                attributes["error"] = error
+            item.trace.add_span('websocket.send', item.trace.mark, sent_at, **attributes)
+
+    def _process_queue_loop(self):
+        """Loop principal del procesador de cola FIFO - UN mensaje (o un lote ordenado) a la vez"""
+        logger.info("🚀 INICIANDO LOOP DE PROCESADOR FIFO - UN SOLO MENSAJE A LA VEZ")
+        logger.info("🔄 Esperando mensajes en la cola...")
+        
+        while self.running:
+            try:
+                # Con acks se envían hasta N eventos sin esperar confirmación
+                if not self._wait_for_ack_window():
+                    continue
+
+                with self.lock:
+                    event = self.retry_batch.pop(0) if self.retry_batch else None
+                if event is not None:
+                    # El lote fallido sigue siendo la cabeza del carril; se reintenta de a un evento
+                    # para que un evento envenenado no arrastre al resto del lote
+                    batch = [event]
+                    if event.trace is not None:
+                        event.trace.add_span('retry.backoff', event.trace.mark, time.time(), attempt=event.attempts)
+                else:
+                    # Obtener mensaje de la cola FIFO (bloquea hasta que haya mensaje)
+                    event = self.message_queue.get(timeout=1)
+                    batch = self._collect_batch(event)
+                    fifo_dequeued_total.inc(len(batch), sink=self.sink)
+                    dequeued_at = time.time()
+                    for item in batch:
+                        if item.trace is not None:
+                            item.trace.add_span('queue.wait', item.queued_at, dequeued_at, lane=self.index)
+
+                # Intentar enviar el mensaje
+                send_started = time.perf_counter()
+                send_started_at = time.time()
+                for item in batch:
+                    if item.trace is not None:
+                        item.trace.mark = send_started_at
+                try:
+                    if len(batch) > 1:
+                        awaiting_ack = self.websocket_service.send_batch(batch)
+                    else:
+                        awaiting_ack = self.websocket_service.send_message(event)
+                    websocket_send_duration_seconds.observe(time.perf_counter() - send_started, sink=self.sink)
+                    self.outage_failures = 0
+                    # Con ack se completarán al llegar la confirmación; si no llega se reenvían al reconectar
+                    if not awaiting_ack:
+                        self._trace_send(batch)
+                        self._complete_events(batch)
+
+                    queue_log.info("✅ Evento FIFO enviado", sender=event.envelope.sender, text=Truncated(event.envelope.text_preview),
+                                   events=len(batch), lane=self.index, attempt=event.attempts + 1,
+                                   awaiting_ack=awaiting_ack, queue=Lazy(self.depth))
+
+                except Exception as e:
+                    logger.error(f"❌ Error enviando mensaje por WebSocket: {str(e)}")
+                    websocket_send_duration_seconds.observe(time.perf_counter() - send_started, sink=self.sink)
+                    websocket_send_failures_total.inc(sink=self.sink)
+                    self._trace_send(batch, error=type(e).__name__)
+                    self._handle_send_failure(batch, e)
+                    
+            except queue.Empty:
+                # No hay mensajes en la cola: reenviar eventos sin ack si la conexión cayó o expiraron
+                try:
+                    self.websocket_service.redeliver_stale()
+                except Exception as e:
+                    logger.debug(f"Reenvío de eventos sin ack pendiente: {str(e)}")
+                continue
+                
+            except Exception as e:
+                logger.error(f"❌ Error crítico en procesador FIFO: {str(e)}")
+                time.sleep(5)  # Esperar antes de continuar
+                
+        logger.info("🛑 Loop de procesador FIFO terminado")
+
+    def clear(self) -> int:
+        """Vacía la cola del carril y el slot de reintento"""
+        with self.lock:
+            cleared, self.retry_batch = self.retry_batch, []
+        for _ in cleared:
+            self.message_queue.task_done()
+        try:
+            while True:
+                cleared.append(self.message_queue.get_nowait())
+                self.message_queue.task_done()
+        except queue.Empty:
+            pass
+        # Lo descartado tampoco debe reaparecer al reiniciar
+        self.journal.ack(cleared)
+        if isinstance(self.message_queue, RedisStreamQueue):
+            return len(cleared) + self.message_queue.purge()
+        return len(cleared)
+
+    def get_status(self) -> Dict:
+        return {
+            "lane": self.index,
+            "queue_size": self.depth(),
+            "retry_pending": len(self.retry_batch),
+            "head_attempts": self.retry_batch[0].attempts if self.retry_batch else 0,
+            "dead_lettered": self.dead_lettered,
+            "processor_thread_alive": self.is_alive(),
+            "processor_thread_name": self.thread_name,
+            "acks_in_flight": self.websocket_service.get_ack_status()["in_flight"]
+        }
+
 
 class MessageQueueService:
-    _instance = None
+    """Cola FIFO hacia un WebSocket. Hay una instancia (singleton) por sink con nombre,
+    repartida en carriles por remitente (WEBHOOK_QUEUE_LANES)"""
+    _instances = {}
     _lock = threading.Lock()
+    # Procesadores, supervisor y replay del journal solo corren en el proceso que atiende
+    # peticiones, nunca en el master de gunicorn (ver start_in_worker)
+    _worker_started = False
     
-    def __new__(cls):
-        if cls._instance is None:
+    def __new__(cls, sink: str = DEFAULT_SINK):
+        if sink not in cls._instances:
             with cls._lock:
-                if cls._instance is None:
-                    cls._instance = super(MessageQueueService, cls).__new__(cls)
-        return cls._instance
+                if sink not in cls._instances:
+                    cls._instances[sink] = super(MessageQueueService, cls).__new__(cls)
+        return cls._instances[sink]
+
+    @classmethod
+    def all_instances(cls) -> List['MessageQueueService']:
+        """Colas creadas hasta el momento (una por sink)"""
+        with cls._lock:
+            return list(cls._instances.values())
     
-    def __init__(self):
+    def __init__(self, sink: str = DEFAULT_SINK):
         if hasattr(self, '_initialized'):
             return
         
-        self.websocket_service = WebSocketService()
-        self.message_queue = queue.Queue()
+        self.sink = sink
+        lane_count = max(1, int(os.getenv('WEBHOOK_QUEUE_LANES', '1')))
+        self.backend = os.getenv('WEBHOOK_QUEUE_BACKEND', 'memory').lower()
+        self.journal = get_event_journal()
+        self.journal_replayed_pid = None
+
+        self.lanes = None
+        if self.backend == 'redis_streams':
+            try:
+                import redis
+                stream_client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+                                                     socket_timeout=10, socket_connect_timeout=5)
+                self.lanes = [QueueLane(sink, index, lane_count, stream_client) for index in range(lane_count)]
+            except Exception as e:
+                logger.error(f"❌ No se pudo iniciar la cola en Redis Streams, usando memoria: {str(e)}")
+                self.backend = 'memory'
+        if self.lanes is None:
+            self.lanes = [QueueLane(sink, index, lane_count) for index in range(lane_count)]
+            if self._worker_started:
+                self._replay_journal()
 
         # Control de threading
-        self.processor_thread = None
         self.supervisor_thread = None
         self.running = False
         self.supervisor_interval = 5  # segundos entre verificaciones
         self._initialized = True
 
-        logger.info("🚀 MessageQueueService inicializado")
+        logger.info(f"🚀 MessageQueueService inicializado - sink: {self.sink}, carriles: {lane_count}, backend: {self.backend}")
 
-        # Asegurar que el procesador esté activo al inicializar
-        self._ensure_processor_running()
-        self._start_supervisor_thread()
+        # Asegurar que el procesador esté activo al inicializar (solo ya dentro del worker)
+        if self._worker_started:
+            self._ensure_processor_running()
+            self._start_supervisor_thread()
 
     def _ensure_processor_running(self):
-        """Verifica y reinicia el procesador de cola si no está activo"""
-        if not self.processor_thread or not self.processor_thread.is_alive():
-            # Reiniciar flags para permitir nuevo thread
-            self.running = False
-            self._start_queue_processor()
+        """Verifica y reinicia los procesadores de los carriles que no estén activos"""
+        self.running = True
+        for lane in self.lanes:
+            lane.ensure_running()
+
+    @classmethod
+    def start_in_worker(cls):
+        """Arranca el procesamiento en el proceso que atiende peticiones (post_fork de gunicorn
+        o `python app.py`). Con preload_app las colas se crean en el master: si el master
+        reencolara el journal, cada worker heredaría esos eventos y se entregarían dos veces,
+        y con Redis Streams el master tomaría leases de carriles que nunca procesa"""
+        cls._worker_started = True
+        cls()
+        for service in cls.all_instances():
+            service.restart_processor()
+
+    def _replay_journal(self):
+        """Vuelve a encolar, en orden, los eventos que procesos anteriores dejaron en el journal
+        sin reenviar. Una vez por proceso: lo que queda después en el journal es de este proceso"""
+        if self.backend != 'memory' or self.journal_replayed_pid == os.getpid():
+            return
+        self.journal_replayed_pid = os.getpid()
+        try:
+            events = self.journal.replay(self.sink)
+        except Exception as e:
+            logger.error(f"❌ Error leyendo el journal de eventos: {str(e)}")
+            return
+        for event in events:
+            event.queued_at = time.time()
+            self.lane_for(event.envelope).message_queue.put(event)
+        if events:
+            logger.info(f"📒 {len(events)} evento(s) recuperados del journal - sink: {self.sink}")
+
+    def lane_for(self, envelope: WebhookEnvelope) -> QueueLane:
+        """Carril del evento: hash estable del remitente (o del phone_number_id en statuses).
+        Con más de un carril los eventos llegan aquí con un solo remitente (split_by_sender)"""
+        if len(self.lanes) == 1:
+            return self.lanes[0]
+        key = envelope.sender or envelope.phone_number_id or ''
+        return self.lanes[zlib.crc32(key.encode('utf-8')) % len(self.lanes)]
     
-    def add_message_to_queue(self, message_data: Dict):
+    def add_message_to_queue(self, message_data: Union[WebhookEvent, Dict], received_at: float = None):
         """Añade un mensaje a la cola FIFO para procesamiento"""
         try:
             # Asegurar que el procesador esté activo
             self._ensure_processor_running()
 
-            # Extraer info básica para logging
-            from_number = "unknown"
-            message_text = "N/A"
-            
-            # Intentar extraer número y texto del webhook
-            if 'entry' in message_data:
-                for entry in message_data['entry']:
-                    if 'changes' in entry:
-                        for change in entry['changes']:
-                            if change.get('field') == 'messages':
-                                value = change.get('value', {})
-                                if 'messages' in value and value['messages']:
-                                    msg = value['messages'][0]
-                                    from_number = msg.get('from', 'unknown')
-                                    if msg.get('type') == 'text':
-                                        message_text = msg.get('text', {}).get('body', 'N/A')[:30]
-                                    else:
-                                        message_text = f"[{msg.get('type', 'unknown')}]"
-                                    break
-                        if from_number != "unknown":
-                            break
-                    if from_number != "unknown":
-                        break
-            
-            # SIEMPRE añadir a la cola, nunca intentar envío directo
-            message_with_timestamp = {
-                **message_data,
-                'queued_at': time.time(),
-                'attempts': 0
-            }
-            
-            self.message_queue.put(message_with_timestamp)
-            logger.info(f"📩 MENSAJE AÑADIDO A COLA FIFO - de: {from_number} - texto: '{message_text}' - cola actual: {self.message_queue.qsize()}")
+            if isinstance(message_data, WebhookEvent):
+                event = message_data
+            else:
+                event = WebhookEvent(message_data, received_at=received_at)
+
+            # Con varios carriles, un webhook con mensajes de varios remitentes se divide para que
+            # cada parte vaya al carril de su remitente y conserve el orden de esa conversación
+            for part in (event.split_by_sender() if len(self.lanes) > 1 else [event]):
+                self._enqueue(part)
             
             return {"success": True, "method": "webhook_fifo_queue"}
                 
         except Exception as e:
             logger.error(f"❌ Error crítico añadiendo mensaje a cola: {str(e)}")
             return {"success": False, "error": str(e)}
-    
-    def _start_queue_processor(self):
-        """Inicia el procesador de cola en background usando threading"""
-        if self.running:
-            logger.warning("⚠️ Procesador ya está corriendo")
-            return
-        
-        try:
-            self.running = True
-            self.processor_thread = threading.Thread(target=self._process_queue_loop, daemon=True, name="FIFOProcessor")
-            self.processor_thread.start()
-            logger.info("🎯 PROCESADOR DE COLA FIFO INICIADO CON THREADING")
-            logger.info(f"🔧 Thread ID: {self.processor_thread.ident}, Thread Name: {self.processor_thread.name}")
-        except Exception as e:
-            logger.error(f"❌ Error iniciando procesador de cola: {str(e)}")
-            self.running = False
+
+    def _enqueue(self, event: WebhookEvent):
+        # Info básica para logging, extraída una sola vez en la ingesta
+        envelope = event.envelope
+
+        # SIEMPRE añadir a la cola, nunca intentar envío directo
+        event.queued_at = time.time()
+        if event.received_at is None:
+            event.received_at = event.queued_at
+
+        # Durabilidad: el evento queda en disco antes de entrar a la cola
+        if self.backend == 'memory' and self.journal.enabled and event.journal_id is None:
+            journal_started = time.time()
+            event.journal_id = self.journal.append(self.sink, event)
+            if event.trace is not None:
+                event.trace.add_span('journal.append', journal_started, time.time())
+
+        lane = self.lane_for(envelope)
+        if event.trace is not None:
+            event.trace.attributes['lane'] = lane.index
+        lane.message_queue.put(event)
+        fifo_enqueued_total.inc(sink=self.sink)
+        if self.backend == 'redis_streams':
+            # El evento viaja serializado por Redis: la traza local termina al encolar
+            lane.tracer.finish(event.trace, 'enqueued_to_stream')
+        queue_log.info("📩 Mensaje añadido a cola FIFO", sender=envelope.sender, text=Truncated(envelope.text_preview),
+                       lane=lane.index, queue=Lazy(lane.depth))
 
     def _start_supervisor_thread(self):
-        """Inicia un hilo que supervisa el estado del procesador"""
+        """Inicia un hilo que supervisa el estado de los procesadores"""
         if self.supervisor_thread and self.supervisor_thread.is_alive():
             return
         self.supervisor_thread = threading.Thread(
             target=self._supervise_processor,
             daemon=True,
-            name="FIFOProcessorSupervisor"
+            name="FIFOProcessorSupervisor" if self.sink == DEFAULT_SINK else f"FIFOProcessorSupervisor-{self.sink}"
         )
         self.supervisor_thread.start()
         logger.info("👁️ Supervisor del procesador iniciado")
 
     def _supervise_processor(self):
-        """Verifica periódicamente que el procesador esté activo"""
+        """Verifica periódicamente que los procesadores estén activos"""
         while True:
             time.sleep(self.supervisor_interval)
-            if self.running and (not self.processor_thread or not self.processor_thread.is_alive()):
+            if self.running and not all(lane.is_alive() for lane in self.lanes):
                 logger.warning("⚠️ Procesador de cola inactivo, reiniciando...")
                 self.restart_processor()
     
-    def _process_queue_loop(self):
-        """Loop principal del procesador de cola FIFO - UN mensaje a la vez"""
-        logger.info("🚀 INICIANDO LOOP DE PROCESADOR FIFO - UN SOLO MENSAJE A LA VEZ")
-        logger.info("🔄 Esperando mensajes en la cola...")
-        
-        while self.running:
-            try:
-                # Obtener mensaje de la cola FIFO (bloquea hasta que haya mensaje)
-                message_data = self.message_queue.get(timeout=1)
-                
-                # Extraer info para logging
-                from_number = "unknown"
-                message_text = "N/A"
-                
-                try:
-                    if 'entry' in message_data:
-                        for entry in message_data['entry']:
-                            if 'changes' in entry:
-                                for change in entry['changes']:
-                                    if change.get('field') == 'messages':
-                                        value = change.get('value', {})
-                                        if 'messages' in value and value['messages']:
-                                            msg = value['messages'][0]
-                                            from_number = msg.get('from', 'unknown')
-                                            if msg.get('type') == 'text':
-                                                message_text = msg.get('text', {}).get('body', 'N/A')[:30]
-                                            else:
-                                                message_text = f"[{msg.get('type', 'unknown')}]"
-                                            break
-                                    if from_number != "unknown":
-                                        break
-                            if from_number != "unknown":
-                                break
-                except:
-                    pass  # Si hay error extrayendo info, usar defaults
-                
-                logger.info(f"\n➡️ PROCESANDO MENSAJE FIFO - de: {from_number} - texto: '{message_text}' - cola restante: {self.message_queue.qsize()}")
-                
-                # Intentar enviar el mensaje
-                try:
-                    self.websocket_service.send_message(message_data)
-                    logger.info(f"✅ MENSAJE COMPLETADO - de: {from_number} - texto: '{message_text}'")
-                    
-                    # Marcar como completado
-                    self.message_queue.task_done()
-                    logger.info(f"🚀 LISTO PARA SIGUIENTE MENSAJE (cola: {self.message_queue.qsize()})\n")
-                    
-                except Exception as e:
-                    logger.error(f"❌ Error enviando mensaje por WebSocket: {str(e)}")
-                    
-                    # Devolver el mensaje al frente de la cola para reintentarlo inmediatamente
-                    # Usar una cola temporal para mantener el orden FIFO
-                    temp_queue = queue.Queue()
-                    temp_queue.put(message_data)
-                    
-                    # Mover todos los mensajes restantes a la cola temporal
-                    while not self.message_queue.empty():
-                        try:
-                            temp_queue.put(self.message_queue.get_nowait())
-                        except queue.Empty:
-                            break
-                    
-                    # Restaurar todos los mensajes con el mensaje fallido al frente
-                    while not temp_queue.empty():
-                        try:
-                            self.message_queue.put(temp_queue.get_nowait())
-                        except queue.Empty:
-                            break
-                    
-                    logger.info(f"🔄 Mensaje devuelto al frente de la cola para reintento - de: {from_number}")
-                    logger.info(f"⏸️ ESPERANDO 5 SEGUNDOS ANTES DE REINTENTAR...")
-                    time.sleep(5)
-                    # Continuar con el siguiente ciclo (que será el mismo mensaje)
-                    
-            except queue.Empty:
-                # No hay mensajes en la cola, continuar esperando
-                continue
-                
-            except Exception as e:
-                logger.error(f"❌ Error crítico en procesador FIFO: {str(e)}")
-                time.sleep(5)  # Esperar antes de continuar
-                
-        logger.info("🛑 Loop de procesador FIFO terminado")
-    
     def stop_processor(self):
-        """Detiene el procesador de cola"""
+        """Detiene los procesadores de todos los carriles"""
         self.running = False
-        if self.processor_thread and self.processor_thread.is_alive():
-            self.processor_thread.join(timeout=5)
-            logger.info("🛑 Procesador de cola detenido")
+        for lane in self.lanes:
+            lane.stop()
+        logger.info("🛑 Procesador de cola detenido")
+
+    def queue_size(self) -> int:
+        return sum(lane.depth() for lane in self.lanes)
+
+    @staticmethod
+    def _merge_lane_stats(stats: List[Dict], summed: tuple) -> Dict:
+        """Combina el estado de las conexiones de cada carril sumando los contadores"""
+        merged = dict(stats[0])
+        merged["negotiated"] = any(item["negotiated"] for item in stats)
+        for key in summed:
+            merged[key] = sum(item[key] for item in stats)
+        return merged
     
     def get_queue_status(self) -> Dict:
         """Obtiene el estado de la cola"""
@@ -224,14 +557,28 @@ class MessageQueueService:
             # Verificar y reiniciar si el procesador no está activo
             self._ensure_processor_running()
 
-            thread_alive = self.processor_thread.is_alive() if self.processor_thread else False
+            websocket_services = [lane.websocket_service for lane in self.lanes]
             return {
-                "websocket_available": self.websocket_service.health_check(),
+                "sink": self.sink,
+                "backend": self.backend,
+                "websocket_available": get_health_prober().websocket_available(self.sink),
                 "processor_running": self.running,
-                "processor_thread_alive": thread_alive,
-                "processor_thread_name": self.processor_thread.name if self.processor_thread else None,
-                "queue_size": self.message_queue.qsize(),
-                "queue_healthy": True
+                "processor_thread_alive": all(lane.is_alive() for lane in self.lanes),
+                "processor_thread_name": self.lanes[0].thread_name,
+                "queue_size": self.queue_size(),
+                "queue_healthy": True,
+                "journal": self.journal.get_stats(),
+                "lanes": [lane.get_status() for lane in self.lanes],
+                "batching": self._merge_lane_stats(
+                    [service.get_batching_status() for service in websocket_services],
+                    ("batches_sent", "events_in_batches")
+                ),
+                "acks": self._merge_lane_stats(
+                    [service.get_ack_status() for service in websocket_services],
+                    ("in_flight", "acks_received", "redelivered")
+                ),
+                "latency": get_latency_stats(),
+                "logging": get_logging_stats()
             }
         except Exception as e:
             logger.error(f"Error obteniendo estado de cola: {str(e)}")
@@ -241,7 +588,9 @@ class MessageQueueService:
         """Obtiene las longitudes de las diferentes colas"""
         try:
             return {
-                "pending": self.message_queue.qsize()
+                "pending": self.queue_size(),
+                "by_lane": [lane.depth() for lane in self.lanes],
+                "by_sink": {service.sink: service.queue_size() for service in self.all_instances()}
             }
         except Exception as e:
             logger.error(f"Error obteniendo longitudes de cola: {str(e)}")
@@ -251,8 +600,11 @@ class MessageQueueService:
         """Reinicia el procesador de cola"""
         try:
             logger.info("🔄 Reiniciando procesador de cola...")
+            if self._worker_started:
+                self._replay_journal()
             self._ensure_processor_running()
-            if self.processor_thread and self.processor_thread.is_alive():
+            self._start_supervisor_thread()
+            if all(lane.is_alive() for lane in self.lanes):
                 logger.info("✅ Procesador de cola operativo")
                 return {"success": True, "message": "Procesador en funcionamiento"}
             else:
@@ -266,14 +618,8 @@ class MessageQueueService:
     def clear_queue(self) -> Dict:
         """Limpia la cola (usar con precaución)"""
         try:
-            # Vaciar la cola
-            cleared_count = 0
-            try:
-                while True:
-                    self.message_queue.get_nowait()
-                    cleared_count += 1
-            except queue.Empty:
-                pass
+            # Vaciar los carriles
+            cleared_count = sum(lane.clear() for lane in self.lanes)
             
             logger.warning(f"🧹 Cola limpiada - {cleared_count} mensajes removidos")
             return {"cleared": cleared_count}
@@ -283,9 +629,92 @@ class MessageQueueService:
             return {"error": str(e)}
     
     def clear_all_queues(self) -> Dict:
-        """Alias para clear_queue para compatibilidad con la API"""
-        return self.clear_queue()
+        """Limpia las colas de todos los sinks"""
+        results = {service.sink: service.clear_queue() for service in self.all_instances()}
+        cleared = sum(result.get("cleared", 0) for result in results.values())
+        return {"cleared": cleared, "by_sink": results}
     
     def retry_failed_messages(self, limit: int = 10) -> Dict:
-        """No aplicable para FIFO queue, pero mantenemos para compatibilidad API"""
-        return {"success": True, "message": "FIFO queue reintenta automáticamente"}
+        """Vuelve a encolar los eventos más antiguos de la dead-letter queue"""
+        return self.replay_dead_letters(limit=limit)
+
+    def list_dead_letters(self, limit: int = 50, offset: int = 0, sink: str = None) -> Dict:
+        """Lista los eventos de la dead-letter queue"""
+        try:
+            return {"success": True, **get_dead_letter_store().list(limit, offset, sink)}
+        except Exception as e:
+            logger.error(f"❌ Error listando dead-letter queue: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    def replay_dead_letters(self, ids: List[int] = None, limit: int = 10) -> Dict:
+        """Vuelve a encolar eventos de la dead-letter queue (por id o los más antiguos) con los intentos en cero.
+        Los eventos se sacan de la DLQ antes de encolarlos; los que no se pudieron encolar se devuelven"""
+        try:
+            store = get_dead_letter_store()
+            sinks = get_configured_sinks()
+            replayed = []
+            failed = []
+            returned = []
+            limit = max(0, min(limit, DeadLetterStore.MAX_REPLAY))
+            records = store.take(ids, limit)
+            try:
+                for record in records:
+                    if record["sink"] not in sinks:
+                        # Sin el sink en WEBHOOK_SINKS el evento iría al WEBSOCKET_URL por defecto
+                        failed.append({"id": record["id"], "error": f"Sink desconocido: {record['sink']}"})
+                        returned.append(record)
+                        continue
+                    try:
+                        event = WebhookEvent(json.loads(record["body"]), raw_body=record["body"],
+                                             enrichment=json.loads(record["enrichment"]) if record["enrichment"] else None,
+                                             received_at=record["received_at"])
+                    except (ValueError, TypeError, AttributeError) as e:
+                        failed.append({"id": record["id"], "error": f"Cuerpo ilegible: {str(e)}"})
+                        returned.append(record)
+                        continue
+
+                    result = MessageQueueService(record["sink"]).add_message_to_queue(event)
+                    if result.get("success"):
+                        replayed.append(record["id"])
+                    else:
+                        failed.append({"id": record["id"], "error": result.get("error")})
+                        returned.append(record)
+            except BaseException:
+                # Un error inesperado no debe perder los eventos que aún no se encolaron
+                pending = records[len(replayed) + len(returned):]
+                store.restore(returned + pending)
+                raise
+
+            store.restore(returned)
+            logger.info(f"♻️ {len(replayed)} evento(s) de la dead-letter queue vueltos a encolar")
+            return {"success": True, "replayed": len(replayed), "ids": replayed, "failed": failed}
+        except Exception as e:
+            logger.error(f"❌ Error en replay de dead-letter queue: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    def purge_dead_letters(self, ids: List[int] = None) -> Dict:
+        """Elimina eventos de la dead-letter queue (todos si no se indican ids)"""
+        try:
+            purged = get_dead_letter_store().purge(ids)
+            logger.warning(f"🧹 Dead-letter queue purgada - {purged} evento(s) eliminados")
+            return {"success": True, "purged": purged}
+        except Exception as e:
+            logger.error(f"❌ Error purgando dead-letter queue: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+
+def _lane_gauge(measure) -> List:
+    """Muestras por sink y carril para los gauges de /metrics"""
+    samples = []
+    for service in MessageQueueService.all_instances():
+        for lane in getattr(service, 'lanes', None) or []:
+            samples.append(({"sink": service.sink, "lane": lane.index}, measure(lane)))
+    return samples
+
+
+get_metrics_registry().register_collector(
+    'fifo_queue_depth', 'Eventos pendientes por carril (incluye el slot de reintento)', ('sink', 'lane'),
+    lambda: _lane_gauge(QueueLane.depth))
+get_metrics_registry().register_collector(
+    'fifo_oldest_item_age_seconds', 'Antigüedad del evento más viejo de cada carril', ('sink', 'lane'),
+    lambda: _lane_gauge(QueueLane.oldest_age))
@@ -0,0 +1,456 @@
+import atexit
+import fcntl
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Buckets por defecto de los histogramas de latencia (segundos)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames: Iterable[str], labelvalues: Iterable[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """Base de las métricas: valores por combinación de etiquetas, protegidos por un lock propio"""
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+    def samples(self) -> List:
+        with self.lock:
+            return [[list(key), self._copy(value)] for key, value in self.values.items()]
+
+    def _copy(self, value):
+        return value
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # [conteo por bucket (no acumulado, el último es +Inf), suma, total]
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels) -> 'HistogramTimer':
+        return HistogramTimer(self, labels)
+
+    def _copy(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+
+class HistogramTimer:
+    """Context manager que observa la duración del bloque en segundos"""
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram: Histogram, labels: Dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> 'HistogramTimer':
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class MetricsRegistry:
+    """Registro de métricas en memoria con salida en formato de texto de Prometheus.
+
+    Contadores e histogramas se actualizan con un lock por métrica (sin E/S en el
+    camino caliente). Para sumar varios procesos (workers de gunicorn, workers de
+    Celery) cada proceso escribe cada METRICS_FLUSH_INTERVAL segundos una foto de
+    sus valores en METRICS_MULTIPROC_DIR; /metrics suma las fotos de los procesos
+    vivos con los valores propios. Los gauges se calculan al momento del scrape
+    (collectors) y no se agregan entre procesos.
+
+    La foto de un proceso terminado se suma a un acumulado (retired.json) antes de
+    borrarla, así que los contadores e histogramas agregados nunca bajan. Cada foto
+    lleva un uuid por proceso (nuevo también tras un fork): un pid reutilizado al
+    reiniciar el contenedor no sobrescribe la foto del proceso anterior, que se
+    acumula en cuanto aparece otra foto con el mismo host y pid.
+    """
+
+    RETIRED_FILE = 'retired.json'
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.collectors: Dict[str, Tuple[str, Tuple[str, ...], Callable[[], List[Tuple[Dict, float]]]]] = {}
+        self.lock = threading.Lock()
+
+        self.multiproc_dir = os.getenv('METRICS_MULTIPROC_DIR', '/app/data/metrics')
+        self.flush_interval = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+        # Fotos más viejas que esto son de procesos terminados (reciclados por max_requests, reinicios)
+        self.stale_after = float(os.getenv('METRICS_STALE_SECONDS', '300'))
+        self.flusher_thread = None
+        self.process_token = uuid.uuid4().hex
+
+        if self.multiproc_dir:
+            try:
+                os.makedirs(self.multiproc_dir, exist_ok=True)
+            except OSError as e:
+                logger.warning(f"⚠️ No se pudo crear {self.multiproc_dir}, métricas solo de este proceso: {str(e)}")
+                self.multiproc_dir = None
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+        # Al terminar (reciclado del worker) escribir lo acumulado desde la última foto
+        atexit.register(self._flush_quietly)
+        self.ensure_flusher()
+
+    # --- Definición ---
+
+    def _register(self, metric: Metric) -> Metric:
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, name: str, documentation: str, labelnames: Tuple[str, ...],
+                           collect: Callable[[], List[Tuple[Dict, float]]]):
+        """Gauge calculado al momento del scrape: collect() devuelve [(etiquetas, valor), ...]"""
+        with self.lock:
+            self.collectors[name] = (documentation, tuple(labelnames), collect)
+
+    # --- Multiproceso ---
+
+    def _after_fork(self):
+        # Los valores heredados son del proceso padre, que los sigue reportando en su propia foto
+        for metric in list(self.metrics.values()):
+            metric.lock = threading.Lock()
+            metric.reset()
+        self.lock = threading.Lock()
+        self.flusher_thread = None
+        self.process_token = uuid.uuid4().hex
+        self.ensure_flusher()
+
+    def _snapshot_prefix(self) -> str:
+        return f"{socket.gethostname()}-{os.getpid()}"
+
+    def _snapshot_path(self) -> str:
+        return os.path.join(self.multiproc_dir, f"{self._snapshot_prefix()}-{self.process_token}.json")
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {
+            metric.name: {
+                "type": metric.kind,
+                "help": metric.documentation,
+                "labelnames": list(metric.labelnames),
+                "buckets": list(getattr(metric, 'buckets', ())),
+                "samples": metric.samples()
+            }
+            for metric in metrics
+        }
+
+    def flush(self):
+        """Escribe la foto de este proceso (escritura atómica con rename)"""
+        if not self.multiproc_dir:
+            return
+        path = self._snapshot_path()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"pid": os.getpid(), "written_at": time.time(), "metrics": self.snapshot()}, f)
+        os.replace(tmp_path, path)
+
+    def _flush_quietly(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.warning(f"⚠️ Error escribiendo métricas en {self.multiproc_dir}: {str(e)}")
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self._flush_quietly()
+
+    def ensure_flusher(self):
+        """Arranca el hilo que escribe la foto del proceso (uno por proceso, también tras un fork)"""
+        if not self.multiproc_dir or (self.flusher_thread and self.flusher_thread.is_alive()):
+            return
+        with self.lock:
+            if self.flusher_thread and self.flusher_thread.is_alive():
+                return
+            self.flusher_thread = threading.Thread(target=self._flush_loop, daemon=True, name="MetricsFlusher")
+            self.flusher_thread.start()
+
+    def _other_snapshots(self) -> List[Dict]:
+        if not self.multiproc_dir:
+            return []
+        own_path = self._snapshot_path()
+        # Mismo host y pid con otro uuid (o sin uuid): proceso anterior con el pid reutilizado
+        own_prefix = self._snapshot_prefix()
+        snapshots = []
+        stale = []
+        now = time.time()
+        for filename in os.listdir(self.multiproc_dir):
+            path = os.path.join(self.multiproc_dir, filename)
+            if not filename.endswith('.json') or path == own_path or filename == self.RETIRED_FILE:
+                continue
+            name = filename[:-len('.json')]
+            if name == own_prefix or name.rsplit('-', 1)[0] == own_prefix:
+                stale.append(filename)
+                continue
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+                if now - snapshot.get("written_at", 0) > self.stale_after:
+                    stale.append(filename)
+                    continue
+                snapshots.append(snapshot["metrics"])
+            except (OSError, ValueError, KeyError) as e:
+                logger.debug(f"Foto de métricas ilegible {path}: {str(e)}")
+
+        try:
+            retired = self._retire_snapshots(stale)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Error acumulando fotos de métricas de procesos terminados: {str(e)}")
+            retired = None
+        if retired:
+            snapshots.append(retired)
+        return snapshots
+
+    def _retire_snapshots(self, filenames: List[str]) -> Optional[Dict]:
+        """Suma al acumulado las fotos de procesos terminados y las borra; devuelve el acumulado.
+        Con flock un solo proceso a la vez las acumula, y cada foto se registra en `merged` antes
+        de borrarla para no sumarla dos veces si el borrado no llega a ocurrir"""
+        retired_path = os.path.join(self.multiproc_dir, self.RETIRED_FILE)
+        if not filenames:
+            try:
+                with open(retired_path) as f:
+                    return json.load(f)["metrics"]
+            except FileNotFoundError:
+                return None
+
+        with open(os.path.join(self.multiproc_dir, 'retired.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(retired_path) as f:
+                    retired = json.load(f)
+            except FileNotFoundError:
+                retired = {"metrics": {}, "merged": []}
+            merged_ids = set(retired["merged"])
+
+            changed = False
+            for filename in filenames:
+                path = os.path.join(self.multiproc_dir, filename)
+                try:
+                    with open(path) as f:
+                        snapshot = json.load(f)
+                except FileNotFoundError:
+                    # Otro proceso ya la acumuló
+                    continue
+                snapshot_id = f"{filename}:{snapshot.get('written_at')}"
+                if snapshot_id not in merged_ids:
+                    _merge_snapshot(retired["metrics"], snapshot["metrics"])
+                    merged_ids.add(snapshot_id)
+                    changed = True
+
+            if changed:
+                # Solo se recuerdan las fotos que aún existen: al borrarlas ya no hace falta
+                existing = set(os.listdir(self.multiproc_dir))
+                retired["merged"] = sorted(snapshot_id for snapshot_id in merged_ids
+                                           if snapshot_id.rsplit(':', 1)[0] in existing)
+                tmp_path = f"{retired_path}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(retired, f)
+                os.replace(tmp_path, retired_path)
+
+            for filename in filenames:
+                try:
+                    os.remove(os.path.join(self.multiproc_dir, filename))
+                except FileNotFoundError:
+                    pass
+        return retired["metrics"]
+
+    # --- Exposición ---
+
+    def render(self) -> str:
+        """Métricas en formato de texto de Prometheus (0.0.4), sumando todos los procesos"""
+        self.ensure_flusher()
+        merged = self.snapshot()
+        for snapshot in self._other_snapshots():
+            _merge_snapshot(merged, snapshot)
+
+        lines = []
+        for name in sorted(merged):
+            data = merged[name]
+            lines.append(f"# HELP {name} {data['help']}")
+            lines.append(f"# TYPE {name} {data['type']}")
+            labelnames = data["labelnames"]
+            for labels, value in sorted(data["samples"]):
+                if data["type"] == 'histogram':
+                    cumulative = 0
+                    bounds = list(data["buckets"]) + [float('inf')]
+                    for bound, count in zip(bounds, value[0]):
+                        cumulative += count
+                        le = f'le="{_format_value(bound)}"'
+                        lines.append(f"{name}_bucket{_format_labels(labelnames, labels, le)} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labelnames, labels)} {_format_value(value[1])}")
+                    lines.append(f"{name}_count{_format_labels(labelnames, labels)} {value[2]}")
+                else:
+                    lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+
+        with self.lock:
+            collectors = list(self.collectors.items())
+        for name, (documentation, labelnames, collect) in collectors:
+            try:
+                samples = collect()
+            except Exception as e:
+                logger.warning(f"⚠️ Error calculando la métrica {name}: {str(e)}")
+                continue
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labelnames, [labels.get(label, '') for label in labelnames])} {_format_value(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+
+def _merge_snapshot(merged: Dict, snapshot: Dict):
+    """Suma en `merged` los contadores e histogramas de otra foto (por métrica y etiquetas)"""
+    for name, data in snapshot.items():
+        target = merged.setdefault(name, {**data, "samples": []})
+        if target["type"] != data["type"]:
+            continue
+        by_labels = {tuple(labels): value for labels, value in target["samples"]}
+        for labels, value in data["samples"]:
+            key = tuple(labels)
+            current = by_labels.get(key)
+            if current is None:
+                by_labels[key] = value
+            elif data["type"] == 'histogram':
+                if len(current[0]) == len(value[0]):
+                    by_labels[key] = [[a + b for a, b in zip(current[0], value[0])], current[1] + value[1], current[2] + value[2]]
+            else:
+                by_labels[key] = current + value
+        target["samples"] = [[list(key), value] for key, value in by_labels.items()]
+
+
+# Instancia global
+_metrics_registry = None
+_metrics_registry_lock = threading.Lock()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """Obtiene el registro de métricas del proceso"""
+    global _metrics_registry
+    if _metrics_registry is None:
+        with _metrics_registry_lock:
+            if _metrics_registry is None:
+                _metrics_registry = MetricsRegistry()
+    return _metrics_registry
+
+
+def timed(histogram: Histogram, **labels):
+    """Decorador: observa la duración de la función en el histograma (operation = nombre de la función)"""
+    def decorator(func):
+        observed_labels = {"operation": func.__name__, **labels}
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **observed_labels)
+        return wrapper
+    return decorator
+
+
+registry = get_metrics_registry()
+
+# --- Métricas del pipeline ---
+
+http_requests_total = registry.counter(
+    'webhook_http_requests_total', 'Peticiones HTTP atendidas', ('endpoint', 'method', 'status'))
+http_request_duration_seconds = registry.histogram(
+    'webhook_http_request_duration_seconds', 'Duración de las peticiones HTTP', ('endpoint', 'method'))
+
+fifo_enqueued_total = registry.counter(
+    'fifo_enqueued_total', 'Eventos encolados hacia el WebSocket', ('sink',))
+fifo_dequeued_total = registry.counter(
+    'fifo_dequeued_total', 'Eventos tomados de la cola por el procesador', ('sink',))
+fifo_dead_lettered_total = registry.counter(
+    'fifo_dead_lettered_total', 'Eventos enviados a la dead-letter queue', ('sink',))
+
+websocket_send_duration_seconds = registry.histogram(
+    'websocket_send_duration_seconds', 'Duración de cada envío (mensaje o lote) al WebSocket', ('sink',))
+websocket_send_failures_total = registry.counter(
+    'websocket_send_failures_total', 'Envíos al WebSocket fallidos', ('sink',))
+
+number_cache_operation_duration_seconds = registry.histogram(
+    'number_cache_operation_duration_seconds', 'Duración de las operaciones de NumberCache', ('operation',))
+
+graph_requests_total = registry.counter(
+    'graph_requests_total', 'Llamadas a la Graph API', ('message_type', 'status_code'))
+graph_request_duration_seconds = registry.histogram(
+    'graph_request_duration_seconds', 'Duración de las llamadas a la Graph API', ('message_type', 'status_code'),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
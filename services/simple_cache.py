@@ -1,21 +1,68 @@
 import sqlite3
+import base64
 import json
 import logging
 import os
+import time
+import uuid
+from collections import OrderedDict
 from datetime import datetime
-from typing import Optional, Dict, List
 from threading import Lock
+from typing import Optional, Dict, Iterator, List, Tuple
+from .bloom_filter import BloomFilter
+from .metrics import number_cache_operation_duration_seconds, timed
+from .sqlite_connections import SQLiteConnectionManager
 
 logger = logging.getLogger(__name__)
 
 class NumberCache:
+    # Límite conservador de parámetros por consulta (SQLITE_MAX_VARIABLE_NUMBER antiguo = 999)
+    MAX_IN_VARIABLES = 900
+    # Filas que se conservan como máximo del registro de altas (un proceso más atrasado reconstruye su filtro)
+    INSERT_LOG_KEEP = 100000
+    # Un proceso que no reporta su avance en este tiempo deja de frenar el recorte del registro de altas
+    BLOOM_READER_TTL = 3600
+    # Tamaño máximo de página en list_numbers
+    PAGE_MAX_LIMIT = 1000
+    # Error por fila cuando el dato guardado no es un objeto JSON (no se le puede aplicar un parche)
+    INVALID_STORED_DATA = "Stored data is not a valid JSON object"
+
     def __init__(self, db_path: str = None):
         # Usar variable de entorno o default
         if db_path is None:
             db_path = os.getenv('CACHE_DB_PATH', '/app/data/cache.db')
         
         self.db_path = db_path
-        self.lock = Lock()
+        # Conexión persistente por hilo en modo WAL: las lecturas ya no se serializan con un lock global
+        self.db = SQLiteConnectionManager(db_path)
+
+        # LRU en memoria delante de SQLite: teléfono -> (expira_en, registro o None si no existe)
+        self.lru_size = int(os.getenv('CACHE_LRU_SIZE', '10000'))
+        self.lru_ttl = float(os.getenv('CACHE_LRU_TTL', '60'))
+        self.lru: 'OrderedDict[str, Tuple[float, Optional[Dict]]]' = OrderedDict()
+        self.lru_lock = Lock()
+        # Cambia con cada invalidación: una lectura de SQLite que empezó antes no se guarda en el LRU
+        self.lru_generation = 0
+        self.lru_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "external_invalidations": 0}
+
+        # Filtro de Bloom de los números guardados: un remitente desconocido no llega a SQLite
+        self.bloom_enabled = os.getenv('CACHE_BLOOM_ENABLED', 'true').lower() == 'true'
+        self.bloom_capacity = int(os.getenv('CACHE_BLOOM_CAPACITY', '100000'))
+        self.bloom_error_rate = float(os.getenv('CACHE_BLOOM_ERROR_RATE', '0.01'))
+        self.bloom: Optional[BloomFilter] = None
+        self.bloom_lock = Lock()
+        self.bloom_rebuild_lock = Lock()
+        # Último seq del registro de altas (number_inserts) ya agregado al filtro
+        self.bloom_seq = 0
+        self.bloom_stats = {"skipped": 0, "false_positives": 0, "rebuilds": 0}
+        # Cada proceso reporta en bloom_readers hasta qué seq aplicó; el registro se recorta hasta el
+        # menor de esos seq, a lo sumo cada CACHE_INSERT_LOG_TRIM_SECONDS
+        self.insert_log_trim_interval = float(os.getenv('CACHE_INSERT_LOG_TRIM_SECONDS', '60'))
+        self.insert_log_trimmed_at = time.monotonic()
+        self.bloom_reader = uuid.uuid4().hex
+        self.bloom_reader_reported = (0, 0.0)  # (seq, momento) del último reporte
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
         
         # CREAR DIRECTORIO PADRE AUTOMÁTICAMENTE
         db_dir = os.path.dirname(self.db_path)
@@ -28,16 +75,15 @@ class NumberCache:
         
         logger.info(f"🗄️ Inicializando cache en: {self.db_path}")
         self._init_db()
+        if self.bloom_enabled:
+            self._bloom_rebuild()
     
     def _init_db(self):
         """Inicializa la base de datos"""
-        with self.lock:
-            try:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
+        try:
+            with self.db.write() as conn:
                 # Tabla simple para números
-                cursor.execute('''
+                conn.execute('''
                     CREATE TABLE IF NOT EXISTS numbers (
                         phone TEXT PRIMARY KEY,
                         name TEXT,
@@ -46,25 +92,291 @@ class NumberCache:
                         updated_at TEXT NOT NULL
                     )
                 ''')
-                
-                conn.commit()
-                conn.close()
-                
-                # Verificar que se creó correctamente
-                if os.path.exists(self.db_path):
-                    logger.info(f"✅ Base de datos cache inicializada: {self.db_path}")
-                else:
-                    logger.error(f"❌ Base de datos NO se creó: {self.db_path}")
-                    
-            except Exception as e:
-                logger.error(f"❌ Error inicializando base de datos: {e}")
-                raise
+                # Registro de altas para mantener al día el filtro de Bloom de cada proceso,
+                # incluidas las de otros procesos (AUTOINCREMENT: el seq nunca se reutiliza)
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS number_inserts (
+                        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                        phone TEXT NOT NULL
+                    )
+                ''')
+                # Avance de cada proceso en number_inserts: lo que todos aplicaron se puede borrar
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS bloom_readers (
+                        reader TEXT PRIMARY KEY,
+                        applied_seq INTEGER NOT NULL,
+                        reported_at REAL NOT NULL
+                    )
+                ''')
+                # Orden del listado paginado: (updated_at, phone) descendente, recorrido por el índice
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_numbers_updated_at_phone ON numbers (updated_at, phone)')
+                conn.execute('''
+                    CREATE TRIGGER IF NOT EXISTS numbers_insert_log AFTER INSERT ON numbers
+                    BEGIN
+                        INSERT INTO number_inserts (phone) VALUES (NEW.phone);
+                    END
+                ''')
+
+            # Verificar que se creó correctamente
+            if os.path.exists(self.db_path):
+                logger.info(f"✅ Base de datos cache inicializada: {self.db_path} ({self.db.journal_mode})")
+            else:
+                logger.error(f"❌ Base de datos NO se creó: {self.db_path}")
+
+        except Exception as e:
+            logger.error(f"❌ Error inicializando base de datos: {e}")
+            raise
     
+    def _after_fork(self):
+        # El hijo es otro lector del registro de altas
+        self.bloom_reader = uuid.uuid4().hex
+        self.bloom_reader_reported = (0, 0.0)
+
+    # --- LRU en memoria ---
+
+    def _sync_external_changes(self):
+        """Si otro proceso escribió en la base (el worker de Celery, otro worker de gunicorn o
+        un proceso externo) vacía el LRU y agrega al filtro de Bloom los números dados de alta.
+        Las escrituras de este proceso, desde cualquier hilo, ya actualizan ambos directamente"""
+        if not self.db.data_version_changed():
+            return
+        with self.lru_lock:
+            self.lru_generation += 1
+            if self.lru:
+                self.lru.clear()
+                self.lru_stats["external_invalidations"] += 1
+        if self.bloom is not None:
+            self._bloom_catch_up()
+
+    def _lru_get(self, phones: List[str]) -> Tuple[Dict[str, Optional[Dict]], List[str], int]:
+        """Separa los teléfonos en aciertos del LRU y pendientes de consultar en SQLite"""
+        found, missing = {}, []
+        now = time.monotonic()
+        with self.lru_lock:
+            for phone in phones:
+                entry = self.lru.get(phone)
+                if entry is not None and entry[0] > now:
+                    self.lru.move_to_end(phone)
+                    found[phone] = entry[1]
+                else:
+                    missing.append(phone)
+            self.lru_stats["hits"] += len(found)
+            self.lru_stats["misses"] += len(missing)
+            return found, missing, self.lru_generation
+
+    def _lru_put(self, generation: int, entries: Dict[str, Optional[Dict]]):
+        expires_at = time.monotonic() + self.lru_ttl
+        with self.lru_lock:
+            if generation != self.lru_generation:
+                return
+            for phone, record in entries.items():
+                self.lru[phone] = (expires_at, record)
+                self.lru.move_to_end(phone)
+            while len(self.lru) > self.lru_size:
+                self.lru.popitem(last=False)
+                self.lru_stats["evictions"] += 1
+
+    def _lru_invalidate(self, phone: str = None):
+        """Invalida un número (o todo el LRU) tras una escritura propia"""
+        with self.lru_lock:
+            self.lru_generation += 1
+            self.lru_stats["invalidations"] += 1
+            if phone is None:
+                self.lru.clear()
+            else:
+                self.lru.pop(phone, None)
+
+    # --- Filtro de Bloom de números guardados ---
+
+    def _bloom_rebuild(self):
+        """Construye el filtro con todos los números de la tabla y recorta el registro de altas"""
+        if not self.bloom_rebuild_lock.acquire(blocking=False):
+            # Otro hilo ya lo está reconstruyendo
+            return
+        try:
+            with self.db.read() as conn:
+                # El seq se lee antes que los teléfonos: lo que entre en medio se vuelve a agregar al ponerse al día
+                seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM number_inserts').fetchone()[0]
+                phones = [row[0] for row in conn.execute('SELECT phone FROM numbers')]
+
+            bloom = BloomFilter(max(self.bloom_capacity, len(phones) * 2), self.bloom_error_rate)
+            for phone in phones:
+                bloom.add(phone)
+            with self.bloom_lock:
+                self.bloom = bloom
+                self.bloom_seq = seq
+                self.bloom_stats["rebuilds"] += 1
+            self._bloom_catch_up()
+
+            with self.db.write() as conn:
+                conn.execute('DELETE FROM number_inserts WHERE seq <= ?', (seq - self.INSERT_LOG_KEEP,))
+            logger.info(f"🌸 Filtro de Bloom construido - {len(phones)} números, "
+                        f"{bloom.get_stats()['memory_bytes']} bytes, {bloom.num_hashes} hashes")
+        except Exception as e:
+            # Sin filtro todas las búsquedas van a SQLite, como antes
+            logger.error(f"❌ Error construyendo filtro de Bloom: {str(e)}")
+            with self.bloom_lock:
+                self.bloom = None
+        finally:
+            self.bloom_rebuild_lock.release()
+
+    def _bloom_catch_up(self, trim: bool = True):
+        """Agrega al filtro las altas registradas después de la última que se vio"""
+        with self.bloom_lock:
+            seq = self.bloom_seq
+        with self.db.read() as conn:
+            rows = conn.execute('SELECT seq, phone FROM number_inserts WHERE seq > ? ORDER BY seq', (seq,)).fetchall()
+        if rows and rows[0][0] > seq + 1:
+            # Otro proceso recortó el registro más allá de lo que este filtro había visto
+            self._bloom_rebuild()
+            return
+
+        needs_rebuild = False
+        with self.bloom_lock:
+            if self.bloom is None:
+                return
+            for row_seq, phone in rows:
+                if row_seq > self.bloom_seq:
+                    self.bloom.add(phone)
+                    self.bloom_seq = row_seq
+            needs_rebuild = self.bloom.count > self.bloom.capacity
+        if needs_rebuild:
+            self._bloom_rebuild()
+        elif trim:
+            self._trim_insert_log()
+
+    def _trim_insert_log(self):
+        """Reporta hasta qué seq aplicó este proceso y borra del registro de altas lo que todos los
+        procesos activos ya aplicaron. Siempre queda la última fila: un proceso atrasado que ya no
+        figura en bloom_readers ve el salto de seq y reconstruye su filtro"""
+        now = time.monotonic()
+        with self.bloom_lock:
+            if self.bloom is None or now - self.insert_log_trimmed_at < self.insert_log_trim_interval:
+                return
+            self.insert_log_trimmed_at = now
+        # Las altas propias no cambian data_version: se aplican aquí antes de reportar
+        self._bloom_catch_up(trim=False)
+        with self.bloom_lock:
+            applied = self.bloom_seq
+
+        try:
+            wall_now = time.time()
+            reported_seq, reported_at = self.bloom_reader_reported
+            with self.db.read() as conn:
+                oldest, newest = conn.execute('SELECT MIN(seq), MAX(seq) FROM number_inserts').fetchone()
+                lowest = conn.execute('SELECT MIN(applied_seq) FROM bloom_readers WHERE reader != ? AND reported_at >= ?',
+                                      (self.bloom_reader, wall_now - self.BLOOM_READER_TTL)).fetchone()[0]
+            if newest is None:
+                # Registro vacío: solo hace falta reportar el avance
+                oldest, newest = applied + 1, applied
+            trim_to = min(applied if lowest is None else min(lowest, applied), newest - 1)
+            trim_to = max(trim_to, newest - self.INSERT_LOG_KEEP)
+            must_report = applied != reported_seq or wall_now - reported_at >= self.BLOOM_READER_TTL / 2
+            if not must_report and trim_to < oldest:
+                # Nada que reportar ni que borrar: sin escritura (no invalida el LRU de otros procesos)
+                return
+
+            with self.db.write() as conn:
+                conn.execute('''
+                    INSERT INTO bloom_readers (reader, applied_seq, reported_at) VALUES (?, ?, ?)
+                    ON CONFLICT(reader) DO UPDATE SET applied_seq = excluded.applied_seq, reported_at = excluded.reported_at
+                ''', (self.bloom_reader, applied, wall_now))
+                conn.execute('DELETE FROM bloom_readers WHERE reported_at < ?', (wall_now - self.BLOOM_READER_TTL,))
+                trimmed = conn.execute('DELETE FROM number_inserts WHERE seq <= ?', (trim_to,)).rowcount
+            self.bloom_reader_reported = (applied, wall_now)
+            if trimmed:
+                logger.debug(f"🌸 Registro de altas recortado: {trimmed} fila(s) hasta seq {trim_to}")
+        except Exception as e:
+            logger.warning(f"⚠️ Error recortando el registro de altas: {str(e)}")
+
+    def _bloom_add(self, phones: List[str]):
+        with self.bloom_lock:
+            if self.bloom is None:
+                return
+            for phone in phones:
+                self.bloom.add(phone)
+            needs_rebuild = self.bloom.count > self.bloom.capacity
+        if needs_rebuild:
+            # Pasada la capacidad los falsos positivos crecen: reconstruir con el tamaño actual
+            self._bloom_rebuild()
+        else:
+            self._trim_insert_log()
+
+    def _lookup(self, phones: List[str]) -> Dict[str, Optional[Dict]]:
+        """Registro de cada teléfono (None si no existe): primero el LRU, luego el filtro de
+        Bloom descarta los que seguro no están y el resto se consulta con un solo IN (...).
+        Los registros del LRU se comparten entre llamadas: no modificarlos"""
+        self._sync_external_changes()
+        if self.lru_size > 0:
+            found, missing, generation = self._lru_get(phones)
+        else:
+            found, missing, generation = {}, phones, None
+
+        bloom = self.bloom
+        if missing and bloom is not None:
+            candidates = []
+            for phone in missing:
+                if phone in bloom:
+                    candidates.append(phone)
+                else:
+                    found[phone] = None
+            if len(candidates) < len(missing):
+                with self.bloom_lock:
+                    self.bloom_stats["skipped"] += len(missing) - len(candidates)
+            missing = candidates
+
+        if missing:
+            loaded = self._select_numbers(missing)
+            if bloom is not None:
+                false_positives = sum(1 for record in loaded.values() if record is None)
+                if false_positives:
+                    with self.bloom_lock:
+                        self.bloom_stats["false_positives"] += false_positives
+            if generation is not None:
+                self._lru_put(generation, loaded)
+            found.update(loaded)
+        return found
+
+    def _select_numbers(self, phones: List[str]) -> Dict[str, Optional[Dict]]:
+        results = dict.fromkeys(phones)
+        with self.db.read() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+
+            # Respetar el límite de variables de SQLite partiendo en bloques
+            for start in range(0, len(phones), self.MAX_IN_VARIABLES):
+                chunk = phones[start:start + self.MAX_IN_VARIABLES]
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(f'SELECT * FROM numbers WHERE phone IN ({placeholders})', chunk)
+                for row in cursor.fetchall():
+                    result = dict(row)
+                    if result['data']:
+                        result['data'] = json.loads(result['data'])
+                    results[result['phone']] = result
+        return results
+
+    def get_stats(self) -> Dict:
+        with self.lru_lock:
+            lru = {
+                "size": len(self.lru),
+                "max_size": self.lru_size,
+                "ttl_seconds": self.lru_ttl,
+                **self.lru_stats
+            }
+        lookups = lru["hits"] + lru["misses"]
+        lru["hit_ratio"] = round(lru["hits"] / lookups, 4) if lookups else None
+
+        with self.bloom_lock:
+            bloom = {"enabled": self.bloom is not None, "applied_seq": self.bloom_seq, **self.bloom_stats}
+            if self.bloom is not None:
+                bloom.update(self.bloom.get_stats())
+        return {"lru": lru, "bloom": bloom, "database": self.db.get_stats()}
+
+    @timed(number_cache_operation_duration_seconds)
     def add_number(self, phone: str, name: str = None, data: Dict = None) -> bool:
         """Agrega un número. Si ya existe, elimina el registro anterior y crea uno nuevo"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
+            with self.db.write() as conn:
                 cursor = conn.cursor()
                 
                 # Verificar si el número ya existe
@@ -88,65 +400,124 @@ class NumberCache:
                     VALUES (?, ?, ?, ?, ?)
                 ''', (phone, name, data_str, now, now))
                 
-                conn.commit()
-                conn.close()
-                return True
+            self._lru_invalidate(phone)
+            self._bloom_add([phone])
+            return True
                 
         except Exception as e:
             logger.error(f"Error adding number {phone}: {str(e)}")
             return False
+
+    @timed(number_cache_operation_duration_seconds)
+    def bulk_upsert(self, numbers: List[Dict]) -> Dict:
+        """Crea o actualiza muchos números en una sola transacción (executemany + ON CONFLICT).
+
+        Cada elemento es {"phone", "name", "data"}. Un número existente conserva su
+        created_at y se le reemplazan name y data. Si un teléfono se repite gana la
+        última aparición. Los elementos inválidos se saltan y se reportan en errors.
+        """
+        rows: Dict[str, Tuple] = {}
+        errors = []
+        now = datetime.now().isoformat()
+        for index, item in enumerate(numbers):
+            if not isinstance(item, dict):
+                errors.append({"index": index, "error": "Each number must be an object"})
+                continue
+            phone = item.get('phone')
+            if isinstance(phone, int) and not isinstance(phone, bool):
+                phone = str(phone)
+            if not isinstance(phone, str) or not phone.strip():
+                errors.append({"index": index, "error": "Phone number is required"})
+                continue
+            data = item.get('data')
+            if data is not None and not isinstance(data, dict):
+                errors.append({"index": index, "phone": phone, "error": "data must be an object"})
+                continue
+            phone = phone.strip()
+            rows[phone] = (phone, item.get('name'), json.dumps(data) if data else None, now, now)
+
+        if not rows:
+            return {"success": True, "created": 0, "updated": 0, "invalid": len(errors), "errors": errors}
+
+        phones = list(rows)
+        try:
+            with self.db.write() as conn:
+                # Los existentes se cuentan dentro de la misma transacción: nadie los cambia en medio
+                existing = 0
+                for start in range(0, len(phones), self.MAX_IN_VARIABLES):
+                    chunk = phones[start:start + self.MAX_IN_VARIABLES]
+                    placeholders = ','.join('?' * len(chunk))
+                    existing += conn.execute(f'SELECT COUNT(*) FROM numbers WHERE phone IN ({placeholders})', chunk).fetchone()[0]
+
+                conn.executemany('''
+                    INSERT INTO numbers (phone, name, data, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(phone) DO UPDATE SET
+                        name = excluded.name,
+                        data = excluded.data,
+                        updated_at = excluded.updated_at
+                ''', rows.values())
+
+            self._lru_invalidate()
+            self._bloom_add(phones)
+            logger.info(f"📥 Carga masiva de números: {len(phones) - existing} creados, {existing} actualizados, "
+                        f"{len(errors)} inválidos")
+            return {
+                "success": True,
+                "created": len(phones) - existing,
+                "updated": existing,
+                "invalid": len(errors),
+                "errors": errors
+            }
+
+        except Exception as e:
+            logger.error(f"Error in bulk upsert of {len(phones)} numbers: {str(e)}")
+            return {"success": False, "error": str(e), "invalid": len(errors), "errors": errors}
     
+    @timed(number_cache_operation_duration_seconds)
     def exists(self, phone: str) -> bool:
         """Verifica si un número existe en el cache"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
-                cursor.execute('SELECT 1 FROM numbers WHERE phone = ? LIMIT 1', (phone,))
-                exists = cursor.fetchone() is not None
-                conn.close()
-                
-                return exists
+            return self._lookup([phone])[phone] is not None
                 
         except Exception as e:
             logger.error(f"Error checking if number {phone} exists: {str(e)}")
             return False
     
+    @timed(number_cache_operation_duration_seconds)
     def get_number(self, phone: str) -> Optional[Dict]:
         """Obtiene información de un número"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                
-                cursor.execute('SELECT * FROM numbers WHERE phone = ?', (phone,))
-                row = cursor.fetchone()
-                conn.close()
-                
-                if row:
-                    result = dict(row)
-                    if result['data']:
-                        result['data'] = json.loads(result['data'])
-                    return result
-                return None
+            return self._lookup([phone])[phone]
                 
         except Exception as e:
             logger.error(f"Error getting number {phone}: {str(e)}")
             return None
     
+    @timed(number_cache_operation_duration_seconds)
+    def get_numbers(self, phones: List[str]) -> Dict[str, Dict]:
+        """Obtiene varios números (LRU y luego una sola consulta IN (...)). Devuelve solo los encontrados"""
+        unique_phones = list(dict.fromkeys(phones))
+        if not unique_phones:
+            return {}
+
+        try:
+            return {phone: record for phone, record in self._lookup(unique_phones).items() if record is not None}
+
+        except Exception as e:
+            logger.error(f"Error getting numbers {unique_phones[:5]}...: {str(e)}")
+            return {}
+
+    @timed(number_cache_operation_duration_seconds)
     def get_all_numbers(self) -> List[Dict]:
         """Obtiene todos los números"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                conn.row_factory = sqlite3.Row
+            with self.db.read() as conn:
                 cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
                 
                 cursor.execute('SELECT * FROM numbers ORDER BY updated_at DESC')
                 rows = cursor.fetchall()
-                conn.close()
                 
                 results = []
                 for row in rows:
@@ -160,46 +531,102 @@ class NumberCache:
         except Exception as e:
             logger.error(f"Error getting all numbers: {str(e)}")
             return []
+
+    @staticmethod
+    def encode_cursor(updated_at: str, phone: str) -> str:
+        return base64.urlsafe_b64encode(json.dumps([updated_at, phone]).encode('utf-8')).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[str, str]:
+        """Posición (updated_at, phone) de un cursor. ValueError si no es válido"""
+        try:
+            updated_at, phone = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        except Exception:
+            raise ValueError(f"Invalid cursor: {cursor}")
+        if not isinstance(updated_at, str) or not isinstance(phone, str):
+            raise ValueError(f"Invalid cursor: {cursor}")
+        return updated_at, phone
+
+    def _select_page(self, after: Optional[Tuple[str, str]], limit: int) -> List[Dict]:
+        """Números después de la posición `after` en orden (updated_at, phone) descendente.
+        La condición sobre la clave usa el índice: el costo no depende de qué tan lejos esté la página"""
+        with self.db.read() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            if after is None:
+                cursor.execute('SELECT * FROM numbers ORDER BY updated_at DESC, phone DESC LIMIT ?', (limit,))
+            else:
+                cursor.execute('''
+                    SELECT * FROM numbers WHERE (updated_at, phone) < (?, ?)
+                    ORDER BY updated_at DESC, phone DESC LIMIT ?
+                ''', (*after, limit))
+
+            results = []
+            for row in cursor.fetchall():
+                result = dict(row)
+                if result['data']:
+                    result['data'] = json.loads(result['data'])
+                results.append(result)
+            return results
+
+    @timed(number_cache_operation_duration_seconds)
+    def list_numbers(self, limit: int = 100, cursor: str = None) -> Dict:
+        """Una página de números (más recientes primero) y el cursor de la siguiente, o None si es
+        la última. Un número que se actualiza mientras se pagina pasa al principio del orden"""
+        limit = max(1, min(limit, self.PAGE_MAX_LIMIT))
+        after = self.decode_cursor(cursor) if cursor else None
+
+        # Se pide una fila de más para saber si hay otra página sin devolver una página vacía
+        numbers = self._select_page(after, limit + 1)
+        next_cursor = None
+        if len(numbers) > limit:
+            numbers = numbers[:limit]
+            next_cursor = self.encode_cursor(numbers[-1]['updated_at'], numbers[-1]['phone'])
+        return {"numbers": numbers, "next_cursor": next_cursor}
+
+    def iter_numbers(self, batch_size: int = 1000) -> Iterator[Dict]:
+        """Recorre todos los números por páginas: la memoria no crece con el tamaño de la tabla
+        y ninguna lectura queda abierta mientras el consumidor procesa un lote"""
+        after = None
+        while True:
+            batch = self._select_page(after, batch_size)
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            after = (batch[-1]['updated_at'], batch[-1]['phone'])
     
+    @timed(number_cache_operation_duration_seconds)
     def delete_number(self, phone: str) -> bool:
         """Elimina un número"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
-                cursor.execute('DELETE FROM numbers WHERE phone = ?', (phone,))
-                conn.commit()
-                deleted = cursor.rowcount > 0
-                conn.close()
-                return deleted
+            with self.db.write() as conn:
+                deleted = conn.execute('DELETE FROM numbers WHERE phone = ?', (phone,)).rowcount > 0
+            self._lru_invalidate(phone)
+            return deleted
                 
         except Exception as e:
             logger.error(f"Error deleting number {phone}: {str(e)}")
             return False
     
+    @timed(number_cache_operation_duration_seconds)
     def clear_all(self) -> int:
         """Limpia todos los números"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
-                cursor.execute('DELETE FROM numbers')
-                conn.commit()
-                deleted = cursor.rowcount
-                conn.close()
-                return deleted
+            with self.db.write() as conn:
+                deleted = conn.execute('DELETE FROM numbers').rowcount
+            self._lru_invalidate()
+            return deleted
                 
         except Exception as e:
             logger.error(f"Error clearing all numbers: {str(e)}")
             return 0
     
+    @timed(number_cache_operation_duration_seconds)
     def update_number_data(self, phone: str, data_content: Dict) -> bool:
         """Actualiza los datos de un número existente. Si una llave existe, la edita; si no existe, la agrega. Si el valor es '__DELETE__', elimina la llave"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
+            # La lectura y la escritura van en la misma transacción: nadie cambia la fila entre ambas
+            with self.db.write() as conn:
                 cursor = conn.cursor()
                 
                 # Obtener los datos actuales
@@ -208,7 +635,6 @@ class NumberCache:
                 
                 if not row:
                     # El número no existe
-                    conn.close()
                     return False
                 
                 # Parsear los datos existentes
@@ -239,19 +665,104 @@ class NumberCache:
                     WHERE phone = ?
                 ''', (data_str, now, phone))
                 
-                conn.commit()
                 success = cursor.rowcount > 0
-                conn.close()
-                
-                if success:
-                    logger.info(f"Datos actualizados para número {phone}")
                 
-                return success
+            self._lru_invalidate(phone)
+            if success:
+                logger.info(f"Datos actualizados para número {phone}")
+            
+            return success
                 
         except Exception as e:
             logger.error(f"Error updating number data {phone}: {str(e)}")
             return False
 
+    @timed(number_cache_operation_duration_seconds)
+    def bulk_update_number_data(self, phones: List[str], data_content: Dict) -> List[Dict]:
+        """Aplica el mismo parche (edita/agrega llaves, '__DELETE__' las elimina) a muchos números
+        en una sola transacción. El parche se aplica dentro de SQLite con json_set/json_remove,
+        sin decodificar ni codificar el JSON en Python. Devuelve el resultado de cada teléfono;
+        los números cuyo dato guardado no es un objeto JSON válido se reportan y no se tocan"""
+        unique_phones = list(dict.fromkeys(phones))
+        if not unique_phones:
+            return []
+
+        removed_keys = [key for key, value in data_content.items() if value == '__DELETE__']
+        updated_keys = {key: value for key, value in data_content.items() if value != '__DELETE__'}
+        now = datetime.now().isoformat()
+
+        try:
+            found = set()
+            errors: Dict[str, str] = {}
+            with self.db.write() as conn:
+                # Las rutas JSON de SQLite no admiten comillas dobles escapadas dentro de la llave
+                if any('"' in key for key in data_content):
+                    found, errors = self._patch_rows_in_python(conn, unique_phones, updated_keys, removed_keys, now)
+                else:
+                    expression, expression_params = 'COALESCE(data, \'{}\')', []
+                    if updated_keys:
+                        expression = f"json_set({expression}, {', '.join(['?, json(?)'] * len(updated_keys))})"
+                        for key, value in updated_keys.items():
+                            expression_params += [f'$."{key}"', json.dumps(value)]
+                    if removed_keys:
+                        expression = f"json_remove({expression}, {', '.join(['?'] * len(removed_keys))})"
+                        expression_params += [f'$."{key}"' for key in removed_keys]
+
+                    # CASE evalúa json_type solo si el JSON es válido (json_type falla con JSON malformado)
+                    is_object = "CASE WHEN json_valid(COALESCE(data, '{}')) THEN json_type(COALESCE(data, '{}')) END = 'object'"
+                    chunk_size = max(1, self.MAX_IN_VARIABLES - len(expression_params))
+                    for start in range(0, len(unique_phones), chunk_size):
+                        chunk = unique_phones[start:start + chunk_size]
+                        placeholders = ','.join('?' * len(chunk))
+                        for phone, valid in conn.execute(
+                                f'SELECT phone, {is_object} FROM numbers WHERE phone IN ({placeholders})', chunk):
+                            if valid:
+                                found.add(phone)
+                            else:
+                                errors[phone] = self.INVALID_STORED_DATA
+                        conn.execute(f'UPDATE numbers SET data = {expression}, updated_at = ? '
+                                     f'WHERE phone IN ({placeholders}) AND {is_object}',
+                                     expression_params + [now] + chunk)
+
+            self._lru_invalidate()
+            logger.info(f"Datos actualizados para {len(found)} de {len(unique_phones)} números")
+            return [
+                {"phone": phone, "success": phone in found,
+                 "error": None if phone in found else errors.get(phone, "Number not found")}
+                for phone in phones
+            ]
+
+        except Exception as e:
+            logger.error(f"Error in bulk update of {len(unique_phones)} numbers: {str(e)}")
+            return [{"phone": phone, "success": False, "error": str(e)} for phone in phones]
+
+    def _patch_rows_in_python(self, conn: sqlite3.Connection, phones: List[str], updated_keys: Dict,
+                              removed_keys: List[str], now: str) -> Tuple[set, Dict[str, str]]:
+        """Mismo parche que bulk_update_number_data, decodificando en Python (llaves con comillas dobles).
+        Devuelve los teléfonos actualizados y el error de los que tienen datos guardados ilegibles"""
+        rows = []
+        for start in range(0, len(phones), self.MAX_IN_VARIABLES):
+            chunk = phones[start:start + self.MAX_IN_VARIABLES]
+            placeholders = ','.join('?' * len(chunk))
+            rows += conn.execute(f'SELECT phone, data FROM numbers WHERE phone IN ({placeholders})', chunk).fetchall()
+
+        updates = []
+        errors = {}
+        for phone, data_str in rows:
+            try:
+                current_data = json.loads(data_str) if data_str else {}
+            except ValueError:
+                current_data = None
+            if not isinstance(current_data, dict):
+                errors[phone] = self.INVALID_STORED_DATA
+                continue
+            current_data.update(updated_keys)
+            for key in removed_keys:
+                current_data.pop(key, None)
+            updates.append((json.dumps(current_data), now, phone))
+        conn.executemany('UPDATE numbers SET data = ?, updated_at = ? WHERE phone = ?', updates)
+        return {update[2] for update in updates}, errors
+
 # Instancia global
 _cache_instance = None
 
@@ -0,0 +1,138 @@
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteConnectionManager:
+    """Conexiones SQLite persistentes, una por hilo, sobre una base en modo WAL.
+
+    Cada hilo (de gunicorn, del procesador, de Celery) abre su conexión de lectura
+    la primera vez y la reutiliza, con su cache de sentencias preparadas. Con WAL los
+    lectores no bloquean al escritor ni entre sí, así que las lecturas corren en
+    paralelo. Las escrituras del proceso usan una única conexión compartida y se
+    serializan con un lock; las de otros procesos (el worker de Celery comparte el
+    archivo) esperan hasta busy_timeout.
+
+    PRAGMA data_version de una conexión solo cambia con commits de otras conexiones,
+    así que consultarlo en la conexión de escritura detecta exactamente los cambios
+    hechos por otros procesos.
+    """
+
+    def __init__(self, db_path: str, synchronous: str = None, busy_timeout_ms: int = None,
+                 cached_statements: int = None):
+        self.db_path = db_path
+        # NORMAL en WAL: un commit sobrevive a la caída del proceso (no a un corte de energía) sin fsync por escritura
+        self.synchronous = (synchronous or os.getenv('CACHE_DB_SYNCHRONOUS', 'NORMAL')).upper()
+        self.busy_timeout_ms = busy_timeout_ms if busy_timeout_ms is not None else int(os.getenv('CACHE_DB_BUSY_TIMEOUT_MS', '5000'))
+        self.cached_statements = cached_statements if cached_statements is not None else int(os.getenv('CACHE_DB_CACHED_STATEMENTS', '128'))
+
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        self.writer: sqlite3.Connection = None
+        self.writer_open_lock = threading.Lock()
+        self.version_lock = threading.Lock()
+        self.data_version = None
+        self.stats_lock = threading.Lock()
+        self.connections_opened = 0
+        self.journal_mode = None
+        # Conexiones heredadas de un fork: no se cierran en el hijo (sus locks de archivo son del padre)
+        self.inherited: List[sqlite3.Connection] = []
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        for conn in (getattr(self.local, 'conn', None), self.writer):
+            if conn is not None:
+                self.inherited.append(conn)
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        self.writer = None
+        self.writer_open_lock = threading.Lock()
+        self.version_lock = threading.Lock()
+        # Los commits del padre son externos para el hijo: la primera consulta cuenta como cambio
+        self.data_version = None
+
+    def _open(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000,
+                               cached_statements=self.cached_statements, check_same_thread=check_same_thread)
+        conn.execute(f'PRAGMA busy_timeout={self.busy_timeout_ms}')
+        # journal_mode=WAL queda guardado en el archivo; las demás pragmas son por conexión
+        journal_mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        with self.stats_lock:
+            self.connections_opened += 1
+            if journal_mode != self.journal_mode:
+                if journal_mode.lower() != 'wal':
+                    logger.warning(f"⚠️ SQLite {self.db_path} no admite WAL (journal_mode={journal_mode})")
+                self.journal_mode = journal_mode
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """Conexión de lectura del hilo actual (se abre la primera vez)"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self._open()
+            self.local.conn = conn
+        return conn
+
+    def _writer_connection(self) -> sqlite3.Connection:
+        """Conexión de escritura del proceso, compartida entre hilos (las escrituras van bajo write_lock)"""
+        if self.writer is None:
+            with self.writer_open_lock:
+                if self.writer is None:
+                    self.writer = self._open(check_same_thread=False)
+        return self.writer
+
+    @contextmanager
+    def read(self) -> Iterator[sqlite3.Connection]:
+        """Lectura sin lock: cada SELECT ve una foto consistente de la base"""
+        yield self.connection()
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Connection]:
+        """Transacción de escritura (BEGIN IMMEDIATE): confirma al salir o revierte si hay error.
+        Lo que se lee dentro de la transacción no cambia hasta el commit"""
+        with self.write_lock:
+            conn = self._writer_connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    def data_version_changed(self) -> bool:
+        """True si otro proceso confirmó cambios desde la última consulta de este proceso.
+        Se consulta en la conexión de escritura, así que los commits propios (de cualquier hilo)
+        no cuentan. PRAGMA data_version no lee disco, así que es barato en cada lectura.
+        La primera consulta del proceso cuenta como cambio porque no hay con qué comparar"""
+        conn = self._writer_connection()
+        with self.version_lock:
+            version = conn.execute('PRAGMA data_version').fetchone()[0]
+            previous, self.data_version = self.data_version, version
+        return version != previous
+
+    def close(self):
+        """Cierra la conexión de lectura del hilo actual"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            self.local.conn = None
+            conn.close()
+
+    def get_stats(self) -> Dict:
+        with self.stats_lock:
+            return {
+                "path": self.db_path,
+                "journal_mode": self.journal_mode,
+                "synchronous": self.synchronous,
+                "busy_timeout_ms": self.busy_timeout_ms,
+                "cached_statements": self.cached_statements,
+                "connections_opened": self.connections_opened
+            }
@@ -0,0 +1,232 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from .message_queue_service import DEFAULT_SINK, MessageQueueService
+from .webhook_event import WebhookEnvelope, WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+
+class StatusCoalescer:
+    """Agrupa webhooks de estados de entrega y reenvía solo el último estado de cada mensaje.
+
+    Durante campañas los statuses (sent/delivered/read/failed) superan varias veces a
+    los mensajes entrantes. Los webhooks que solo traen statuses se acumulan durante
+    una ventana corta y se reenvían como un único webhook con la misma forma que los
+    de Meta, conservando un status por id de mensaje.
+    """
+
+    # Orden de avance de un status; failed es terminal
+    STATUS_RANK = {'sent': 1, 'delivered': 2, 'read': 3, 'failed': 4}
+
+    def __init__(self):
+        self.enabled = os.getenv('STATUS_COALESCE_ENABLED', 'false').lower() == 'true'
+        self.window = int(os.getenv('STATUS_COALESCE_WINDOW_MS', '2000')) / 1000
+        self.max_batch = int(os.getenv('STATUS_COALESCE_MAX_BATCH', '500'))
+
+        # sink -> (entry_id, phone_number_id) -> {"metadata": ..., "statuses": {status_id: status}}
+        self.pending = OrderedDict()
+        # sink -> statuses recibidos (antes de agrupar) desde el último flush
+        self.pending_received = {}
+        self.first_received_at: Optional[float] = None
+        self.first_buffered_at: Optional[float] = None
+        self.lock = threading.Lock()
+        # Serializa la extracción + encolado de digests para conservar su orden en la FIFO
+        self.emit_lock = threading.Lock()
+        self.flush_thread = None
+
+        self.stats = {"statuses_received": 0, "statuses_forwarded": 0, "digests_sent": 0}
+        logger.info(f"🧮 StatusCoalescer inicializado - activo: {self.enabled}, ventana: {self.window}s")
+
+    def accepts(self, envelope: WebhookEnvelope) -> bool:
+        """Solo se agrupan webhooks de statuses puros; los mensajes nunca se retrasan"""
+        return self.enabled and bool(envelope.statuses) and not envelope.messages
+
+    def add(self, webhook_data: Dict, received_at: float = None, sink: str = DEFAULT_SINK) -> Dict:
+        """Acumula los statuses del webhook para el siguiente digest"""
+        self._ensure_flush_thread()
+        received_at = received_at or time.time()
+        full = False
+
+        with self.lock:
+            for entry in webhook_data.get('entry') or ():
+                for change in entry.get('changes') or ():
+                    value = change.get('value', {})
+                    metadata = value.get('metadata', {})
+                    group_key = (entry.get('id'), metadata.get('phone_number_id'))
+                    sink_groups = self.pending.setdefault(sink, OrderedDict())
+                    group = sink_groups.setdefault(group_key, {"metadata": metadata, "statuses": OrderedDict()})
+
+                    for status in value.get('statuses') or ():
+                        self.pending_received[sink] = self.pending_received.get(sink, 0) + 1
+                        self.stats["statuses_received"] += 1
+                        # Sin id no hay con qué agrupar: se conserva tal cual
+                        status_id = status.get('id') or f"sin_id_{self.stats['statuses_received']}"
+                        current = group["statuses"].get(status_id)
+                        if current is None or self._is_newer(status, current):
+                            group["statuses"][status_id] = status
+
+            if self.first_buffered_at is None:
+                self.first_buffered_at = time.monotonic()
+                self.first_received_at = received_at
+
+            full = self._buffered_locked() >= self.max_batch
+
+        if full:
+            self.flush()
+
+        return {"success": True, "method": "status_coalesced"}
+
+    def _buffered_locked(self) -> int:
+        return sum(len(group["statuses"]) for groups in self.pending.values() for group in groups.values())
+
+    def _is_newer(self, candidate: Dict, current: Dict) -> bool:
+        def sort_key(status: Dict):
+            try:
+                timestamp = int(status.get('timestamp', 0))
+            except (TypeError, ValueError):
+                timestamp = 0
+            return self.STATUS_RANK.get(status.get('status'), 0), timestamp
+
+        return sort_key(candidate) >= sort_key(current)
+
+    def _take_locked(self):
+        """Extrae el buffer actual. Debe llamarse con self.lock tomado"""
+        if not self.pending:
+            return None
+        batch = (self.pending, self.pending_received, self.first_received_at)
+        self.pending = OrderedDict()
+        # sink -> statuses recibidos (antes de agrupar) desde el último flush
+        self.pending_received = {}
+        self.first_received_at = None
+        self.first_buffered_at = None
+        return batch
+
+    def _emit(self, groups: OrderedDict, received_count: int, received_at: float, sink: str) -> bool:
+        """Construye un webhook con forma de Meta con el último status de cada mensaje y lo encola.
+        Devuelve False si no se pudo encolar"""
+        entries: List[Dict] = []
+        forwarded = 0
+        for (entry_id, _), group in groups.items():
+            statuses = list(group["statuses"].values())
+            if not statuses:
+                continue
+            forwarded += len(statuses)
+            entries.append({
+                "id": entry_id,
+                "changes": [{
+                    "field": "messages",
+                    "value": {
+                        "messaging_product": "whatsapp",
+                        "metadata": group["metadata"],
+                        "statuses": statuses
+                    }
+                }]
+            })
+
+        if not entries:
+            return True
+
+        digest = {"object": "whatsapp_business_account", "entry": entries}
+        enrichment = {
+            'save_number': False,
+            'coalesced_statuses': {"received": received_count, "forwarded": forwarded}
+        }
+        event = WebhookEvent(digest, enrichment=enrichment, received_at=received_at)
+        result = MessageQueueService(sink).add_message_to_queue(event)
+
+        if not result.get('success'):
+            logger.error(f"❌ Error encolando digest de statuses, se reintentará: {result.get('error')}")
+            return False
+
+        with self.lock:
+            self.stats["statuses_forwarded"] += forwarded
+            self.stats["digests_sent"] += 1
+        logger.info(f"🧮 Digest de statuses encolado: {received_count} recibidos → {forwarded} reenviados")
+        return True
+
+    def _restore(self, groups: OrderedDict, received_count: int, received_at: float, sink: str):
+        """Devuelve al buffer un digest que no se pudo encolar. Sus claves de dedup siguen tomadas,
+        así que descartarlo perdería esos statuses. Van delante de lo acumulado después y, si un
+        mensaje recibió entretanto un status más nuevo, se conserva el más nuevo"""
+        with self.lock:
+            restored = groups
+            for group_key, group in self.pending.get(sink, OrderedDict()).items():
+                target = restored.setdefault(group_key, {"metadata": group["metadata"], "statuses": OrderedDict()})
+                for status_id, status in group["statuses"].items():
+                    current = target["statuses"].get(status_id)
+                    if current is None or self._is_newer(status, current):
+                        target["statuses"][status_id] = status
+            self.pending[sink] = restored
+            self.pending_received[sink] = self.pending_received.get(sink, 0) + received_count
+
+            if self.first_buffered_at is None:
+                # Se reintenta tras una ventana completa
+                self.first_buffered_at = time.monotonic()
+            if self.first_received_at is None or (received_at is not None and received_at < self.first_received_at):
+                self.first_received_at = received_at
+
+    def flush(self, only_if_due: bool = False):
+        """Reenvía lo acumulado; con only_if_due solo si el status más antiguo cumplió la ventana"""
+        with self.emit_lock:
+            with self.lock:
+                due = (self.first_buffered_at is not None
+                       and time.monotonic() - self.first_buffered_at >= self.window)
+                batch = self._take_locked() if due or not only_if_due else None
+            if batch:
+                pending, received_counts, received_at = batch
+                for sink, groups in pending.items():
+                    try:
+                        emitted = self._emit(groups, received_counts.get(sink, 0), received_at, sink)
+                    except Exception as e:
+                        logger.error(f"❌ Error emitiendo digest de statuses ({sink}), se reintentará: {str(e)}")
+                        emitted = False
+                    if not emitted:
+                        self._restore(groups, received_counts.get(sink, 0), received_at, sink)
+
+    def _ensure_flush_thread(self):
+        if self.flush_thread and self.flush_thread.is_alive():
+            return
+        with self.lock:
+            if self.flush_thread and self.flush_thread.is_alive():
+                return
+            self.flush_thread = threading.Thread(target=self._flush_loop, daemon=True, name="StatusCoalescer")
+            self.flush_thread.start()
+
+    def _flush_loop(self):
+        """Vacía el buffer cuando el status más antiguo cumple la ventana"""
+        while True:
+            time.sleep(min(self.window, 0.25))
+            try:
+                self.flush(only_if_due=True)
+            except Exception as e:
+                logger.error(f"❌ Error en flush de statuses: {str(e)}")
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            stats = dict(self.stats)
+            buffered = self._buffered_locked()
+        return {
+            "enabled": self.enabled,
+            "window_ms": int(self.window * 1000),
+            "buffered": buffered,
+            **stats
+        }
+
+
+# Instancia global
+_status_coalescer = None
+_status_coalescer_lock = threading.Lock()
+
+
+def get_status_coalescer() -> StatusCoalescer:
+    """Obtiene la instancia del agrupador de statuses"""
+    global _status_coalescer
+    if _status_coalescer is None:
+        with _status_coalescer_lock:
+            if _status_coalescer is None:
+                _status_coalescer = StatusCoalescer()
+    return _status_coalescer
@@ -0,0 +1,332 @@
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+from typing import List, Optional
+from .dead_letter_store import get_dead_letter_store
+from .webhook_event import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+# Renueva el lease solo si sigue siendo del mismo consumidor
+RENEW_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class RedisStreamQueue:
+    """Carril de la cola FIFO sobre un Redis Stream con consumer group.
+
+    Cualquier worker de gunicorn (o host) puede encolar con XADD. Para conservar
+    el orden, solo el consumidor que tiene el lease del carril (SET NX PX) lee
+    del stream; el resto espera su turno. Al tomar el lease, el nuevo dueño
+    reclama con XAUTOCLAIM las entradas pendientes de un consumidor caído (sin
+    actividad durante al menos un TTL del lease, para no robarle una entrada en
+    vuelo a un dueño anterior que sigue vivo) y las reenvía antes que las nuevas.
+    Las entradas se confirman (XACK + XDEL) cuando el reenvío se completa.
+
+    Los intentos viajan con la entrada: el campo attempts guarda los del evento al
+    encolarlo y un hash junto al stream los intentos fallidos de las entradas en
+    vuelo (los campos de una entrada no se pueden modificar), así que el nuevo dueño
+    continúa la cuenta hacia WEBHOOK_MAX_ATTEMPTS. Una entrada ilegible va a la
+    dead-letter queue y se confirma en lugar de quedar pendiente para siempre.
+
+    Expone la parte de la interfaz de queue.Queue que usa QueueLane, más ack().
+    """
+
+    GROUP = 'webhook-forwarders'
+
+    def __init__(self, client, sink: str, lane: int):
+        self.client = client
+        self.sink = sink
+        self.stream = f"webhook:stream:{sink}:{lane}"
+        self.lease_key = f"{self.stream}:owner"
+        self.attempts_key = f"{self.stream}:attempts"
+        self.lease_ttl_ms = int(os.getenv('WEBHOOK_STREAM_LEASE_MS', '15000'))
+        self.renew_lease = client.register_script(RENEW_LEASE_SCRIPT)
+
+        # pid del proceso dueño del lease: tras el fork de gunicorn el worker no hereda la propiedad
+        self.owner_pid = None
+        # Última renovación confirmada: sin renovar durante un TTL el lease pudo pasar a otro
+        self.lease_renewed_at = 0.0
+        # Con el lease recién tomado se leen primero las pendientes, a partir de este id
+        self.recovery_cursor = None
+        # Con el lease recién tomado no se leen entradas nuevas hasta reclamar las del dueño anterior
+        self.takeover_pending = False
+        self.in_hand = 0
+        self.lock = threading.Lock()
+        self.lease_thread = None
+        self.unfinished_tasks = 0  # compatibilidad con queue.Queue; el estado real vive en Redis
+
+        self._ensure_group()
+
+    @property
+    def consumer(self) -> str:
+        return f"{socket.gethostname()}-{os.getpid()}"
+
+    @property
+    def owner(self) -> bool:
+        return (self.owner_pid == os.getpid()
+                and time.monotonic() - self.lease_renewed_at < self.lease_ttl_ms / 1000)
+
+    def _ensure_group(self):
+        try:
+            self.client.xgroup_create(self.stream, self.GROUP, id='0', mkstream=True)
+        except Exception as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    # --- Productores ---
+
+    def put(self, event: WebhookEvent):
+        body = event.raw_body if event.raw_body is not None else json.dumps(event.payload, ensure_ascii=False).encode('utf-8')
+        self.client.xadd(self.stream, {
+            'body': body,
+            'enrichment': json.dumps(event.enrichment, ensure_ascii=False) if event.enrichment else '',
+            'received_at': repr(event.received_at or time.time()),
+            'attempts': event.attempts
+        })
+
+    # --- Consumidor ---
+
+    def _acquire_lease(self) -> bool:
+        if self.owner:
+            return True
+        acquired_at = time.monotonic()
+        if not self.client.set(self.lease_key, self.consumer, nx=True, px=self.lease_ttl_ms):
+            return False
+
+        self.owner_pid = os.getpid()
+        self.lease_renewed_at = acquired_at
+        self.recovery_cursor = '0'
+        self.takeover_pending = True
+        logger.info(f"🔑 Lease de {self.stream} tomado por {self.consumer}")
+        self._start_lease_thread()
+        return True
+
+    def _claim_abandoned(self) -> bool:
+        """Reclama las entradas pendientes de consumidores anteriores que llevan al menos un TTL
+        del lease sin actividad. Devuelve True cuando ya no queda ninguna en manos de otro consumidor"""
+        start_id = '0-0'
+        claimed = 0
+        while True:
+            next_id, entries = self.client.xautoclaim(self.stream, self.GROUP, self.consumer,
+                                                      self.lease_ttl_ms, start_id, count=100)[:2]
+            claimed += len(entries)
+            if next_id in (b'0-0', '0-0'):
+                break
+            start_id = next_id
+        if claimed:
+            self.recovery_cursor = '0'
+            logger.info(f"♻️ {claimed} pendiente(s) de {self.stream} recuperados por {self.consumer}")
+
+        consumer = self.consumer
+        summary = self.client.xpending(self.stream, self.GROUP)
+        held_by_others = 0
+        for entry in summary.get('consumers') or []:
+            name = entry['name'].decode() if isinstance(entry['name'], bytes) else entry['name']
+            if name != consumer:
+                held_by_others += int(entry['pending'])
+        return held_by_others == 0
+
+    def _start_lease_thread(self):
+        if self.lease_thread and self.lease_thread.is_alive():
+            return
+        self.lease_thread = threading.Thread(target=self._lease_loop, daemon=True, name=f"StreamLease-{self.stream}")
+        self.lease_thread.start()
+
+    def _lease_loop(self):
+        """Renueva el lease mientras este proceso sea el dueño del carril"""
+        while self.owner:
+            time.sleep(self.lease_ttl_ms / 3000)
+            renewing_at = time.monotonic()
+            try:
+                if self.renew_lease(keys=[self.lease_key], args=[self.consumer, self.lease_ttl_ms]):
+                    self.lease_renewed_at = renewing_at
+                else:
+                    logger.warning(f"⚠️ Lease de {self.stream} perdido; otro consumidor continuará el carril")
+                    self.owner_pid = None
+            except Exception as e:
+                logger.warning(f"⚠️ Error renovando lease de {self.stream}: {str(e)}")
+                if time.monotonic() - self.lease_renewed_at >= self.lease_ttl_ms / 1000:
+                    # El lease ya expiró en Redis: otro consumidor puede haberlo tomado
+                    logger.warning(f"⚠️ Lease de {self.stream} sin renovar durante un TTL, se deja de leer el carril")
+                    self.owner_pid = None
+
+    def record_attempts(self, events: List[WebhookEvent]):
+        """Guarda los intentos de entradas en vuelo para que sobrevivan a un cambio de dueño"""
+        attempts = {event.journal_id: event.attempts for event in events if event.journal_id is not None}
+        if not attempts:
+            return
+        try:
+            self.client.hset(self.attempts_key, mapping=attempts)
+        except Exception as e:
+            # Sin el registro, un nuevo dueño continúa desde los intentos con que se encoló
+            logger.warning(f"⚠️ Error guardando intentos de {self.stream}: {str(e)}")
+
+    def _read(self, block_ms: Optional[int]) -> Optional[WebhookEvent]:
+        while True:
+            # Primero las pendientes propias (recuperadas o leídas y no confirmadas), luego las nuevas
+            if self.recovery_cursor is not None:
+                entries = self.client.xreadgroup(self.GROUP, self.consumer, {self.stream: self.recovery_cursor}, count=1)
+                if entries and entries[0][1]:
+                    entry_id, fields = entries[0][1][0]
+                    retry_cursor, self.recovery_cursor = self.recovery_cursor, entry_id
+                    event = self._to_event(entry_id, fields, retry_cursor, recovered=True)
+                    if event is not None:
+                        return event
+                    continue
+                self.recovery_cursor = None
+
+            entries = self.client.xreadgroup(self.GROUP, self.consumer, {self.stream: '>'}, count=1, block=block_ms)
+            if not entries or not entries[0][1]:
+                return None
+            entry_id, fields = entries[0][1][0]
+            event = self._to_event(entry_id, fields, self._id_before(entry_id), recovered=False)
+            if event is not None:
+                return event
+
+    @staticmethod
+    def _id_before(entry_id) -> str:
+        """Id inmediatamente anterior: leer las pendientes desde ahí vuelve a entregar la entrada"""
+        if isinstance(entry_id, bytes):
+            entry_id = entry_id.decode()
+        millis, sequence = (int(part) for part in entry_id.split('-'))
+        if sequence:
+            return f"{millis}-{sequence - 1}"
+        return f"{millis - 1}-{2 ** 64 - 1}"
+
+    def _to_event(self, entry_id, fields, retry_cursor: str, recovered: bool) -> Optional[WebhookEvent]:
+        """Evento de una entrada del stream, o None si era ilegible y se mandó a la dead-letter queue"""
+        try:
+            attempts = int(fields.get(b'attempts') or 0)
+            if recovered:
+                # Intentos fallidos del dueño anterior (o de este proceso antes de perder el lease)
+                attempts = max(attempts, int(self.client.hget(self.attempts_key, entry_id) or 0))
+        except ValueError:
+            attempts = 0
+
+        body = fields.get(b'body')
+        enrichment = fields.get(b'enrichment')
+        try:
+            event = WebhookEvent(json.loads(body), raw_body=body,
+                                 enrichment=json.loads(enrichment) if enrichment else None,
+                                 received_at=float(fields.get(b'received_at', time.time())))
+        except (ValueError, TypeError, AttributeError) as e:
+            self._dead_letter_unreadable(entry_id, fields, attempts, e, retry_cursor)
+            return None
+
+        event.attempts = attempts
+        event.queued_at = time.time()
+        event.journal_id = entry_id
+        with self.lock:
+            self.in_hand += 1
+        return event
+
+    def _dead_letter_unreadable(self, entry_id, fields, attempts: int, error: Exception, retry_cursor: str):
+        """Guarda en la dead-letter queue una entrada que no se puede decodificar y la confirma.
+        Si la DLQ falla, la entrada sigue pendiente y se vuelve a leer desde retry_cursor"""
+        try:
+            received_at = float(fields.get(b'received_at') or 0) or None
+        except ValueError:
+            received_at = None
+        enrichment = fields.get(b'enrichment')
+        try:
+            get_dead_letter_store().add_raw(
+                self.sink, fields.get(b'body') or b'',
+                enrichment.decode('utf-8', errors='replace') if enrichment else None,
+                received_at, attempts, f"{type(error).__name__}: entrada ilegible en {self.stream}: {str(error)}"
+            )
+        except Exception:
+            self.recovery_cursor = retry_cursor
+            raise
+        logger.error(f"🪦 Entrada {entry_id} de {self.stream} ilegible, enviada a la dead-letter queue: {str(error)}")
+        self._remove([entry_id])
+
+    def get(self, block: bool = True, timeout: float = None) -> WebhookEvent:
+        try:
+            if not self._acquire_lease():
+                # Otro consumidor tiene el carril: esperar y volver a intentar
+                if block:
+                    time.sleep(timeout or 1)
+                raise queue.Empty
+            if self.takeover_pending:
+                # Entradas recientes de otro consumidor: se reclaman cuando cumplan el TTL
+                # (o desaparecen si su dueño las confirma); mientras tanto no se leen las nuevas
+                if not self._claim_abandoned():
+                    if block:
+                        time.sleep(timeout or 1)
+                    raise queue.Empty
+                self.takeover_pending = False
+            block_ms = max(1, int((timeout or 1) * 1000)) if block else None
+            event = self._read(block_ms)
+        except queue.Empty:
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ Error leyendo {self.stream}: {str(e)}")
+            if block:
+                time.sleep(timeout or 1)
+            raise queue.Empty
+        if event is None:
+            raise queue.Empty
+        return event
+
+    def get_nowait(self) -> WebhookEvent:
+        return self.get(block=False)
+
+    def task_done(self):
+        # La confirmación real es ack(), con los ids de las entradas
+        pass
+
+    def ack(self, events: List[WebhookEvent]):
+        """Confirma las entradas reenviadas y las elimina del stream"""
+        entry_ids = [event.journal_id for event in events if event.journal_id is not None]
+        if not entry_ids:
+            return
+        self._remove(entry_ids)
+        with self.lock:
+            self.in_hand = max(0, self.in_hand - len(entry_ids))
+
+    def _remove(self, entry_ids: List):
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            pipeline.xack(self.stream, self.GROUP, *entry_ids)
+            pipeline.xdel(self.stream, *entry_ids)
+            pipeline.hdel(self.attempts_key, *entry_ids)
+            pipeline.execute()
+        except Exception as e:
+            # Sin ack la entrada queda pendiente y se reenviará (al menos una vez)
+            logger.error(f"❌ Error confirmando {len(entry_ids)} entrada(s) de {self.stream}: {str(e)}")
+
+    def qsize(self) -> int:
+        try:
+            return max(0, self.client.xlen(self.stream) - self.in_hand)
+        except Exception:
+            return 0
+
+    def oldest_age(self) -> float:
+        """Segundos desde que se agregó la entrada más vieja del stream (el id lleva el timestamp en ms)"""
+        try:
+            entries = self.client.xrange(self.stream, count=1)
+        except Exception:
+            return 0.0
+        if not entries:
+            return 0.0
+        entry_id = entries[0][0]
+        if isinstance(entry_id, bytes):
+            entry_id = entry_id.decode()
+        return max(0.0, time.time() - int(entry_id.split('-')[0]) / 1000)
+
+    def purge(self) -> int:
+        """Vacía el stream (usar con precaución). Devuelve las entradas eliminadas"""
+        removed = self.client.xtrim(self.stream, maxlen=0)
+        self.client.delete(self.attempts_key)
+        with self.lock:
+            self.in_hand = 0
+        return removed
@@ -0,0 +1,198 @@
+import json
+from typing import Dict, List, Optional, Tuple, Union
+
+
+class WebhookEnvelope:
+    """Resumen del webhook extraído en una sola pasada al momento de la ingesta"""
+    __slots__ = ('field', 'sender', 'message_type', 'message_ids', 'text_preview', 'messages', 'statuses',
+                 'phone_number_id')
+
+    PREVIEW_LENGTH = 50
+
+    def __init__(self, field: Optional[str] = None, sender: Optional[str] = None,
+                 message_type: Optional[str] = None, message_ids: Tuple[str, ...] = (),
+                 text_preview: str = "N/A", messages: Tuple[Tuple[str, str], ...] = (),
+                 statuses: Tuple[Tuple[str, str], ...] = (), phone_number_id: Optional[str] = None):
+        self.field = field
+        self.sender = sender
+        self.message_type = message_type
+        self.message_ids = message_ids
+        self.text_preview = text_preview
+        # (message_id, from) de cada mensaje del webhook, en orden
+        self.messages = messages
+        # (id, status) de cada estado de entrega (sent/delivered/read/failed)
+        self.statuses = statuses
+        self.phone_number_id = phone_number_id
+
+    @property
+    def senders(self) -> List[str]:
+        """Remitentes únicos de todos los mensajes del webhook, en orden de aparición"""
+        return list(dict.fromkeys(sender for _, sender in self.messages if sender))
+
+    @classmethod
+    def from_payload(cls, webhook_data: Dict) -> 'WebhookEnvelope':
+        """Recorre entry -> changes -> value una única vez"""
+        envelope = cls()
+        message_ids = []
+        messages = []
+        statuses = []
+        try:
+            for entry in webhook_data.get('entry') or ():
+                for change in entry.get('changes') or ():
+                    if envelope.field is None:
+                        envelope.field = change.get('field')
+                    if change.get('field') != 'messages':
+                        continue
+
+                    value = change.get('value', {})
+                    if envelope.phone_number_id is None:
+                        envelope.phone_number_id = value.get('metadata', {}).get('phone_number_id')
+                    for status in value.get('statuses') or ():
+                        statuses.append((status.get('id'), status.get('status')))
+
+                    for msg in value.get('messages') or ():
+                        if msg.get('id'):
+                            message_ids.append(msg['id'])
+                        messages.append((msg.get('id'), msg.get('from')))
+                        if envelope.sender is None:
+                            envelope.sender = msg.get('from')
+                            envelope.message_type = msg.get('type', 'unknown')
+                            if envelope.message_type == 'text':
+                                body = msg.get('text', {}).get('body', 'N/A')
+                                envelope.text_preview = body[:cls.PREVIEW_LENGTH]
+                            else:
+                                envelope.text_preview = f"[{envelope.message_type}]"
+        except (AttributeError, TypeError):
+            # Payload con forma inesperada: se conserva lo extraído hasta el momento
+            pass
+
+        envelope.message_ids = tuple(message_ids)
+        envelope.messages = tuple(messages)
+        envelope.statuses = tuple(statuses)
+        return envelope
+
+    def dedup_keys(self) -> List[str]:
+        """Claves de deduplicación: id de cada mensaje e id+estado de cada status"""
+        keys = [f"msg:{message_id}" for message_id in self.message_ids]
+        # Un mismo id de status pasa por sent -> delivered -> read, por eso se incluye el estado
+        keys.extend(f"status:{status_id}:{status}" for status_id, status in self.statuses if status_id)
+        return keys
+
+    def describe(self) -> str:
+        """Descripción corta para logs"""
+        if self.sender is None:
+            if self.statuses:
+                return f"{len(self.statuses)} estado(s) de entrega"
+            return "webhook sin mensajes"
+        extra = f" (+{len(self.messages) - 1} mensajes)" if len(self.messages) > 1 else ""
+        if self.message_type == 'text':
+            return f"text de {self.sender}: '{self.text_preview}'{extra}"
+        return f"{self.message_type} de {self.sender}{extra}"
+
+
+class WebhookEvent:
+    """Evento en tránsito por la cola FIFO: cuerpo original del webhook + enriquecimiento serializado aparte"""
+    __slots__ = ('payload', 'raw_body', 'envelope', 'enrichment', 'received_at', 'queued_at', 'attempts', 'seq', 'journal_id',
+                 'trace')
+
+    def __init__(self, payload: Dict, raw_body: Optional[bytes] = None,
+                 enrichment: Optional[Dict] = None, received_at: float = None,
+                 envelope: Optional[WebhookEnvelope] = None):
+        # payload es de solo lectura: nunca se muta ni se copia en el hot path
+        self.payload = payload
+        self.envelope = envelope or WebhookEnvelope.from_payload(payload)
+        self.raw_body = raw_body
+        self.enrichment = enrichment or {}
+        self.received_at = received_at
+        self.queued_at = None
+        self.attempts = 0
+        # Número de secuencia de entrega; solo se asigna si el consumidor confirma con acks
+        self.seq = None
+        # Id en el almacenamiento durable: fila del journal en disco o entrada del Redis Stream
+        self.journal_id = None
+        # Traza de etapas (EventTrace) si el evento entró en el muestreo
+        self.trace = None
+
+    def split_by_sender(self) -> List['WebhookEvent']:
+        """Divide un webhook con mensajes de varios remitentes en un evento por remitente, en orden
+        de aparición, para que cada uno vaya al carril de su remitente. Cada parte conserva solo los
+        mensajes y contactos de su remitente; los statuses y los cambios sin mensajes van en la
+        primera. Un webhook de un solo remitente se devuelve tal cual"""
+        senders = self.envelope.senders
+        if len(senders) <= 1:
+            return [self]
+
+        parts = []
+        for index, sender in enumerate(senders):
+            entries = []
+            for entry in self.payload.get('entry') or ():
+                changes = []
+                for change in entry.get('changes') or ():
+                    value = change.get('value') or {}
+                    all_messages = value.get('messages') or ()
+                    messages = [msg for msg in all_messages if (msg.get('from') or senders[0]) == sender]
+                    if messages:
+                        value = {**value, 'messages': messages}
+                        if 'contacts' in value:
+                            value['contacts'] = [contact for contact in value['contacts'] or ()
+                                                 if contact.get('wa_id') == sender]
+                        if index:
+                            value.pop('statuses', None)
+                    elif index:
+                        continue
+                    elif all_messages:
+                        # Solo mensajes de otros remitentes: la primera parte conserva sus statuses
+                        if not value.get('statuses'):
+                            continue
+                        value = {key: item for key, item in value.items() if key not in ('messages', 'contacts')}
+                    changes.append({**change, 'value': value})
+                if changes:
+                    entries.append({**entry, 'changes': changes})
+
+            payload = {**self.payload, 'entry': entries}
+            enrichment = dict(self.enrichment)
+            if 'messages_cache_info' in enrichment:
+                infos = [info for info in enrichment['messages_cache_info'] if info.get('from') == sender]
+                enrichment['messages_cache_info'] = infos
+                enrichment['save_number'] = bool(infos and infos[0].get('save_number'))
+                enrichment.pop('cached_info', None)
+                if infos and infos[0].get('cached_info'):
+                    enrichment['cached_info'] = infos[0]['cached_info']
+
+            part = WebhookEvent(payload, enrichment=enrichment, received_at=self.received_at)
+            part.attempts = self.attempts
+            parts.append(part)
+        # Una sola traza por webhook recibido: la lleva la primera parte
+        parts[0].trace = self.trace
+        return parts
+
+    def frame_extras(self) -> Dict:
+        """Campos que se añaden al JSON del webhook al reenviarlo"""
+        extras = {
+            **self.enrichment,
+            'received_at': self.received_at,
+            'queued_at': self.queued_at,
+            'attempts': self.attempts
+        }
+        if self.seq is not None:
+            extras['delivery_seq'] = self.seq
+        return extras
+
+    def to_frame(self) -> Union[str, bytes]:
+        """Serializa el evento para el WebSocket.
+
+        Con cuerpo crudo disponible, los bytes originales se reenvían tal cual y solo
+        se serializan los campos extra, que se insertan antes de la llave de cierre.
+        El JSON resultante tiene la misma forma que el webhook enriquecido completo.
+        """
+        extras = self.frame_extras()
+        if self.raw_body is not None:
+            body = self.raw_body.rstrip()
+            if body.endswith(b'}'):
+                head = body[:-1].rstrip()
+                extras_json = json.dumps(extras, ensure_ascii=False).encode('utf-8')
+                separator = b'' if head.endswith(b'{') else b','
+                # extras_json[1:] omite la llave de apertura y conserva la de cierre
+                return head + separator + extras_json[1:]
+
+        return json.dumps({**self.payload, **extras}, ensure_ascii=False)
@@ -1,42 +1,460 @@
 import logging
 import json
+import random
+import time
 import websocket
-from typing import Dict
-from threading import Thread
+from collections import OrderedDict
+from typing import Callable, Dict, List, Union
+from threading import Condition, Event, RLock, Thread
 import os
 from dotenv import load_dotenv
+from .log_config import Lazy, get_category_logger
+from .webhook_event import WebhookEnvelope, WebhookEvent
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
+ws_log = get_category_logger(__name__, 'websocket')
 
 
 class WebSocketService:
+    """Cliente WebSocket con conexión persistente, keepalive ping/pong y reconexión con backoff"""
+
+    # Capacidades opcionales que el consumidor acepta devolviendo el mismo header en el handshake.
+    # Se usa un header propio porque websocket-client rechaza el handshake si se ofrece un
+    # subprotocolo que el servidor no elige, y eso rompería a consumidores existentes.
+    CAPABILITIES_HEADER = 'X-Webhook-Capabilities'
+    BATCH_CAPABILITY = 'batch'
+    ACK_CAPABILITY = 'ack'
+
     def __init__(self, websocket_url: str = None):
         self.websocket_url = websocket_url or os.getenv('WEBSOCKET_URL', 'ws://localhost:8080/ws')
+
+        # Configuración de la conexión persistente
+        self.connect_timeout = float(os.getenv('WEBSOCKET_CONNECT_TIMEOUT', '15'))
+        self.send_timeout = float(os.getenv('WEBSOCKET_SEND_TIMEOUT', '10'))
+        self.ping_interval = float(os.getenv('WEBSOCKET_PING_INTERVAL', '20'))
+        self.pong_timeout = float(os.getenv('WEBSOCKET_PONG_TIMEOUT', '5'))
+        self.reconnect_base_delay = float(os.getenv('WEBSOCKET_RECONNECT_BASE_DELAY', '0.5'))
+        self.reconnect_max_delay = float(os.getenv('WEBSOCKET_RECONNECT_MAX_DELAY', '30'))
+
+        # Lotes: varios eventos en un solo frame JSON array (requiere opt-in del consumidor)
+        self.batch_enabled = os.getenv('WEBSOCKET_BATCH_ENABLED', 'false').lower() == 'true'
+        self.batch_max_events = int(os.getenv('WEBSOCKET_BATCH_MAX_EVENTS', '100'))
+        self.batch_linger = int(os.getenv('WEBSOCKET_BATCH_LINGER_MS', '5')) / 1000
+        self.negotiated_capabilities = frozenset()
+        self.batches_sent = 0
+        self.events_in_batches = 0
+
+        # Acks: cada evento lleva delivery_seq y el consumidor confirma con {"ack": <seq>} (acumulativo).
+        # Se permiten hasta N eventos sin confirmar; los pendientes se reenvían al reconectar.
+        self.ack_enabled = os.getenv('WEBSOCKET_ACK_ENABLED', 'false').lower() == 'true'
+        self.ack_window = max(1, int(os.getenv('WEBSOCKET_ACK_WINDOW', '32')))
+        self.ack_timeout = float(os.getenv('WEBSOCKET_ACK_TIMEOUT', '30'))
+        self.unacked = OrderedDict()  # seq -> [evento, momento del último envío]
+        self.ack_condition = Condition()
+        self.next_seq = 1
+        self.acks_received = 0
+        self.redelivered = 0
+        self.on_acked: Callable[[List[WebhookEvent]], None] = None
+        # Cada reenvío de un evento sin ack cuenta como intento; al llegar a max_attempts (0 = sin
+        # límite) deja de reenviarse y se entrega a on_exhausted (la dead-letter queue del carril)
+        self.max_attempts = 0
+        self.on_exhausted: Callable[[List[WebhookEvent]], None] = None
+        self.pong_received = Event()
+
+        self.ws = None
+        self.connection_lock = RLock()
+        self.last_activity = 0.0
+        self.reconnect_failures = 0
+        self.next_connect_at = 0.0
+        self.keepalive_thread = None
+        self.connections_opened = 0
+
         logger.info(f"🔌 WebSocketService inicializado - URL: {self.websocket_url}")
-    
-    def send_message(self, message_data: Dict):
-        """Envía un mensaje al WebSocket"""
+
+    def _get_connection(self):
+        """Devuelve la conexión persistente, abriéndola si hace falta (con backoff tras fallos)"""
+        if self.ws is not None and self.ws.connected:
+            return self.ws
+
+        self._close_connection()
+        now = time.monotonic()
+        if now < self.next_connect_at:
+            raise ConnectionError(
+                f"Reconexión en espera por backoff ({self.next_connect_at - now:.1f}s restantes)"
+            )
+
         try:
-            # Crear conexión con timeout más largo para debugging
-            logger.info(f"🔗 Conectando a WebSocket: {self.websocket_url}")
-            ws = websocket.create_connection(self.websocket_url, timeout=15)
-            
-            # Preparar mensaje JSON
-            message_json = json.dumps(message_data, ensure_ascii=False)
-            message_size = len(message_json)
-            
-            # Enviar mensaje
-            logger.info(f"📤 Enviando mensaje ({message_size} chars) al WebSocket...")
-            ws.send(message_json)
-            
-            # Cerrar conexión
-            ws.close()
+            ws_log.info("🔗 Conectando a WebSocket", url=self.websocket_url)
+            offered = self._offered_capabilities()
+            header = [f"{self.CAPABILITIES_HEADER}: {', '.join(offered)}"] if offered else None
+            ws = websocket.create_connection(self.websocket_url, timeout=self.connect_timeout, header=header)
+        except Exception:
+            self.reconnect_failures += 1
+            delay = min(self.reconnect_max_delay, self.reconnect_base_delay * (2 ** (self.reconnect_failures - 1)))
+            # Jitter para no sincronizar reconexiones de varias instancias
+            self.next_connect_at = time.monotonic() + delay * random.uniform(0.8, 1.2)
+            logger.warning("⏳ Reconexión #%d fallida, próximo intento en ~%.1fs", self.reconnect_failures, delay)
+            raise
+
+        ws.settimeout(self.send_timeout)
+        self.ws = ws
+        self.negotiated_capabilities = self._accepted_capabilities(ws, offered)
+        self.reconnect_failures = 0
+        self.next_connect_at = 0.0
+        self.last_activity = time.monotonic()
+        self.connections_opened += 1
+        self._start_keepalive_thread()
+        ws_log.info("✅ Conexión WebSocket persistente establecida", opened=self.connections_opened,
+                    capabilities=Lazy(lambda: ','.join(sorted(self.negotiated_capabilities)) or 'ninguna'))
+
+        if self.acks_active():
+            Thread(target=self._reader_loop, args=(ws,), daemon=True, name="WebSocketAckReader").start()
+        self._redeliver_unacked(ws)
+        return ws
+
+    def connection_failing(self) -> bool:
+        """True si el último intento de conexión falló (consumidor caído o inalcanzable)"""
+        return self.reconnect_failures > 0
+
+    def _offered_capabilities(self):
+        offered = []
+        if self.batch_enabled:
+            offered.append(self.BATCH_CAPABILITY)
+        if self.ack_enabled:
+            offered.append(self.ACK_CAPABILITY)
+        return offered
+
+    def _accepted_capabilities(self, ws, offered) -> frozenset:
+        """Capacidades que el consumidor devolvió en la respuesta del handshake"""
+        if not offered:
+            return frozenset()
+        raw = (ws.getheaders() or {}).get(self.CAPABILITIES_HEADER.lower(), '')
+        accepted = {item.strip().lower() for item in raw.split(',') if item.strip()}
+        return frozenset(accepted.intersection(offered))
+
+    def batching_active(self) -> bool:
+        """Abre la conexión si hace falta e indica si el consumidor aceptó lotes"""
+        if not self.batch_enabled:
+            return False
+        with self.connection_lock:
+            self._get_connection()
+            return self.BATCH_CAPABILITY in self.negotiated_capabilities
+
+    def get_batching_status(self) -> Dict:
+        return {
+            "enabled": self.batch_enabled,
+            "negotiated": self.BATCH_CAPABILITY in self.negotiated_capabilities,
+            "max_events": self.batch_max_events,
+            "linger_ms": int(self.batch_linger * 1000),
+            "batches_sent": self.batches_sent,
+            "events_in_batches": self.events_in_batches
+        }
+
+    def acks_active(self) -> bool:
+        return self.ACK_CAPABILITY in self.negotiated_capabilities
+
+    def get_ack_status(self) -> Dict:
+        with self.ack_condition:
+            in_flight = len(self.unacked)
+        return {
+            "enabled": self.ack_enabled,
+            "negotiated": self.acks_active(),
+            "window": self.ack_window,
+            "in_flight": in_flight,
+            "next_seq": self.next_seq,
+            "acks_received": self.acks_received,
+            "redelivered": self.redelivered
+        }
+
+    def ack_window_room(self) -> int:
+        """Cuántos eventos más caben en la ventana sin confirmar"""
+        if not self.acks_active():
+            return self.ack_window
+        with self.ack_condition:
+            return max(0, self.ack_window - len(self.unacked))
+
+    def wait_for_ack_window(self):
+        """Bloquea mientras la ventana de eventos sin confirmar esté llena"""
+        while True:
+            with self.ack_condition:
+                if len(self.unacked) < self.ack_window:
+                    return
+                self.ack_condition.wait(timeout=1)
+                if len(self.unacked) < self.ack_window:
+                    return
+            self.redeliver_stale()
+
+    def redeliver_stale(self):
+        """Reenvía los eventos sin confirmar si se perdió la conexión o el más antiguo superó el timeout de ack"""
+        with self.connection_lock:
+            with self.ack_condition:
+                if not self.unacked:
+                    return
+                oldest_sent_at = next(iter(self.unacked.values()))[1]
+            connected = self.ws is not None and self.ws.connected
+            if connected and time.monotonic() - oldest_sent_at < self.ack_timeout:
+                return
+            if connected:
+                logger.warning(f"⏰ Sin ack del WebSocket en {self.ack_timeout}s, reconectando para reenviar pendientes...")
+                self._close_connection()
+            # Al abrir la conexión se reenvían los pendientes
+            self._get_connection()
+
+    def _redeliver_unacked(self, ws):
+        """Reenvía por la conexión nueva los eventos que quedaron sin confirmar, en orden"""
+        exhausted = []
+        with self.ack_condition:
+            pending = []
+            for seq, entry in list(self.unacked.items()):
+                entry[0].attempts += 1
+                if self.max_attempts and self.on_exhausted and entry[0].attempts >= self.max_attempts:
+                    exhausted.append(self.unacked.pop(seq)[0])
+                else:
+                    pending.append((seq, entry))
+            if exhausted:
+                self.ack_condition.notify_all()
+        if exhausted:
+            logger.error(f"🪦 {len(exhausted)} evento(s) sin ack tras {self.max_attempts} intentos, no se reenvían")
+            self.on_exhausted(exhausted)
+        if not pending:
+            return
+
+        logger.info("🔁 Reenviando %d evento(s) sin confirmar (seq %s..%s)", len(pending), pending[0][0], pending[-1][0])
+        for _, entry in pending:
+            ws.send(self._frame_bytes(entry[0]))
+            entry[1] = time.monotonic()
+        self.redelivered += len(pending)
+
+        if not self.acks_active():
+            # El consumidor ya no confirma: el envío es la única señal de entrega
+            self._acknowledge(pending[-1][0])
+
+    def _acknowledge(self, seq: int):
+        """Confirma (de forma acumulativa) todos los eventos con secuencia <= seq"""
+        acked = []
+        with self.ack_condition:
+            while self.unacked:
+                first_seq = next(iter(self.unacked))
+                if first_seq > seq:
+                    break
+                acked.append(self.unacked.popitem(last=False)[1][0])
+            self.ack_condition.notify_all()
+
+        if acked and self.on_acked:
+            self.on_acked(acked)
+
+    def _reader_loop(self, ws):
+        """Lee acks y pongs del consumidor mientras esta conexión siga siendo la activa"""
+        while self.ws is ws:
+            try:
+                opcode, frame = ws.recv_data_frame(control_frame=True)
+            except websocket.WebSocketTimeoutException:
+                continue
+            except Exception as e:
+                with self.connection_lock:
+                    if self.ws is ws:
+                        logger.warning(f"💔 Lectura de acks falló, se reconectará en el próximo envío: {str(e)}")
+                        self._close_connection()
+                return
+
+            if opcode == websocket.ABNF.OPCODE_PONG:
+                self.pong_received.set()
+            elif opcode == websocket.ABNF.OPCODE_CLOSE:
+                with self.connection_lock:
+                    if self.ws is ws:
+                        logger.warning("💔 El consumidor cerró la conexión WebSocket")
+                        self._close_connection()
+                return
+            elif opcode in (websocket.ABNF.OPCODE_TEXT, websocket.ABNF.OPCODE_BINARY):
+                self._handle_incoming(frame.data)
+
+    def _close_connection(self):
+        """Cierra la conexión actual sin propagar errores"""
+        ws, self.ws = self.ws, None
+        if ws is not None:
+            try:
+                ws.close(timeout=1)
+            except Exception:
+                pass
+
+    def close(self):
+        """Cierra la conexión persistente"""
+        with self.connection_lock:
+            self._close_connection()
+
+    def _start_keepalive_thread(self):
+        if self.ping_interval <= 0 or (self.keepalive_thread and self.keepalive_thread.is_alive()):
+            return
+        self.keepalive_thread = Thread(target=self._keepalive_loop, daemon=True, name="WebSocketKeepalive")
+        self.keepalive_thread.start()
+
+    def _keepalive_loop(self):
+        """Envía pings cuando la conexión está ociosa y la descarta si no hay pong"""
+        while True:
+            time.sleep(min(self.ping_interval, 5))
+            pinged = None
+            with self.connection_lock:
+                ws = self.ws
+                if ws is None or time.monotonic() - self.last_activity < self.ping_interval:
+                    continue
+                try:
+                    if self.acks_active():
+                        # El lector de acks recibe el pong; se espera fuera del lock
+                        self.pong_received.clear()
+                        ws.ping()
+                        pinged = ws
+                    else:
+                        ws.ping()
+                        if not self._await_pong(ws):
+                            raise websocket.WebSocketTimeoutException("Sin pong del WebSocket")
+                        self.last_activity = time.monotonic()
+                except Exception as e:
+                    logger.warning(f"💔 Keepalive falló, se reconectará en el próximo envío: {str(e)}")
+                    self._close_connection()
+                finally:
+                    if self.ws is not None and pinged is None:
+                        self.ws.settimeout(self.send_timeout)
+
+            if pinged is not None:
+                if self.pong_received.wait(self.pong_timeout):
+                    self.last_activity = time.monotonic()
+                    continue
+                with self.connection_lock:
+                    if self.ws is pinged:
+                        logger.warning("💔 Keepalive falló, se reconectará en el próximo envío: sin pong del WebSocket")
+                        self._close_connection()
+
+    def _await_pong(self, ws) -> bool:
+        """Lee frames hasta recibir el pong (responde pings del servidor por el camino)"""
+        deadline = time.monotonic() + self.pong_timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            ws.settimeout(remaining)
+            try:
+                opcode, frame = ws.recv_data_frame(control_frame=True)
+            except websocket.WebSocketTimeoutException:
+                return False
+            if opcode == websocket.ABNF.OPCODE_PONG:
+                return True
+            if opcode == websocket.ABNF.OPCODE_CLOSE:
+                return False
+            if opcode in (websocket.ABNF.OPCODE_TEXT, websocket.ABNF.OPCODE_BINARY):
+                self._handle_incoming(frame.data)
+
+    def _handle_incoming(self, data: bytes):
+        """Mensajes enviados por el consumidor: acks {"ack": <seq>}; el resto se ignora"""
+        try:
+            message = json.loads(data)
+        except ValueError:
+            message = None
+        if isinstance(message, dict) and isinstance(message.get('ack'), int):
+            self.acks_received += 1
+            self._acknowledge(message['ack'])
+            return
+        logger.debug(f"📨 Mensaje del WebSocket ignorado ({len(data)} bytes)")
+
+    def _send_frame(self, frame: Union[str, bytes]):
+        """Envía un frame por la conexión persistente.
+
+        Si la conexión era reutilizada y falla (p. ej. el servidor la cerró por
+        inactividad), se reintenta una sola vez con una conexión nueva.
+        """
+        with self.connection_lock:
+            reused = self.ws is not None and self.ws.connected
+            try:
+                self._get_connection().send(frame)
+            except (websocket.WebSocketException, OSError) as e:
+                self._close_connection()
+                if not reused:
+                    raise
+                logger.warning("🔄 Conexión reutilizada falló (%s), reconectando una vez...", type(e).__name__)
+                self._get_connection().send(frame)
+            self.last_activity = time.monotonic()
+
+    @staticmethod
+    def _frame_bytes(message_data: Union[WebhookEvent, Dict]) -> bytes:
+        if isinstance(message_data, WebhookEvent):
+            frame = message_data.to_frame()
+        else:
+            frame = json.dumps(message_data, ensure_ascii=False)
+        return frame.encode('utf-8') if isinstance(frame, str) else frame
+
+    def _send_events(self, events: List[WebhookEvent], encode: Callable[[List[WebhookEvent]], bytes]) -> bool:
+        """Envía eventos por la conexión persistente.
+
+        Si el consumidor negoció acks, cada evento recibe su delivery_seq y queda en la
+        ventana de pendientes hasta que llegue su ack. Devuelve True en ese caso.
+        """
+        with self.connection_lock:
+            reused = self.ws is not None and self.ws.connected
+            while True:
+                try:
+                    ws = self._get_connection()
+                    tracked = self.acks_active()
+                    for offset, event in enumerate(events):
+                        event.seq = self.next_seq + offset if tracked else None
+                    frame = encode(events)
+                    if tracked:
+                        # Se registran antes del envío para no perder un ack muy rápido
+                        with self.ack_condition:
+                            sent_at = time.monotonic()
+                            for event in events:
+                                self.unacked[event.seq] = [event, sent_at]
+                    try:
+                        ws.send(frame)
+                    except Exception:
+                        if tracked:
+                            with self.ack_condition:
+                                for event in events:
+                                    self.unacked.pop(event.seq, None)
+                        raise
+                    break
+                except (websocket.WebSocketException, OSError) as e:
+                    self._close_connection()
+                    if not reused:
+                        raise
+                    reused = False
+                    logger.warning("🔄 Conexión reutilizada falló (%s), reconectando una vez...", type(e).__name__)
+
+            if tracked:
+                self.next_seq += len(events)
+            self.last_activity = time.monotonic()
+            return tracked
+
+    def send_batch(self, events: List[WebhookEvent]) -> bool:
+        """Envía varios eventos en un único frame JSON array, en orden FIFO.
+        Devuelve True si quedan pendientes de ack"""
+        try:
+            awaiting_ack = self._send_events(
+                events, lambda batch: b'[' + b','.join(self._frame_bytes(event) for event in batch) + b']'
+            )
+            self.batches_sent += 1
+            self.events_in_batches += len(events)
+            ws_log.info("✅ Lote enviado al WebSocket", events=len(events), awaiting_ack=awaiting_ack)
+            return awaiting_ack
+        except Exception as e:
+            logger.error(f"❌ Error enviando lote al WebSocket ({type(e).__name__}): {str(e)}")
+            raise
+
+    def send_message(self, message_data: Union[WebhookEvent, Dict]) -> bool:
+        """Envía un mensaje al WebSocket. Devuelve True si queda pendiente de ack"""
+        try:
+            awaiting_ack = False
+            if isinstance(message_data, WebhookEvent):
+                # Los eventos reenvían el cuerpo original sin re-serializarlo
+                awaiting_ack = self._send_events([message_data], lambda batch: self._frame_bytes(batch[0]))
+            else:
+                message_json = json.dumps(message_data, ensure_ascii=False)
+                self._send_frame(message_json)
             
-            # Mejorar log con información del webhook
-            log_info = self._extract_log_info(message_data)
-            logger.info(f"✅ MENSAJE ENVIADO AL WEBSOCKET: {log_info}")
+            # El resumen del webhook solo se extrae si el registro pasa el muestreo
+            ws_log.info("✅ Mensaje enviado al WebSocket", info=Lazy(lambda: self._extract_log_info(message_data)),
+                        awaiting_ack=awaiting_ack)
+            return awaiting_ack
             
         except websocket.WebSocketConnectionClosedException as e:
             logger.error(f"❌ Conexión WebSocket cerrada inesperadamente: {str(e)}")
@@ -55,35 +473,24 @@ class WebSocketService:
             logger.error(f"❌ Tipo de error: {type(e).__name__}")
             raise  # Propagar la excepción para que la cola la maneje
     
-    def _extract_log_info(self, webhook_data: Dict) -> str:
+    def _extract_log_info(self, message_data: Union[WebhookEvent, Dict]) -> str:
         """Extrae información útil del webhook para el log"""
         try:
-            # Buscar mensajes en el webhook
-            if 'entry' in webhook_data:
-                for entry in webhook_data['entry']:
-                    if 'changes' in entry:
-                        for change in entry['changes']:
-                            if change.get('field') == 'messages':
-                                value = change.get('value', {})
-                                if 'messages' in value:
-                                    messages = value['messages']
-                                    if messages:
-                                        msg = messages[0]  # Primer mensaje
-                                        msg_type = msg.get('type', 'unknown')
-                                        msg_from = msg.get('from', 'unknown')
-                                        
-                                        # Información adicional según el tipo
-                                        if msg_type == 'text':
-                                            text = msg.get('text', {}).get('body', '')[:50]
-                                            return f"text de {msg_from}: '{text}'"
-                                        else:
-                                            return f"{msg_type} de {msg_from}"
-            
+            if isinstance(message_data, WebhookEvent):
+                envelope = message_data.envelope
+                enrichment = message_data.enrichment
+            else:
+                envelope = WebhookEnvelope.from_payload(message_data)
+                enrichment = message_data
+
+            if envelope.sender is not None:
+                return envelope.describe()
+
             # Verificar si tiene información del cache
             cache_info = ""
-            if webhook_data.get('save_number'):
-                if 'cached_info' in webhook_data:
-                    cache_name = webhook_data['cached_info'].get('name', 'N/A')
+            if enrichment.get('save_number'):
+                if 'cached_info' in enrichment:
+                    cache_name = enrichment['cached_info'].get('name', 'N/A')
                     cache_info = f" [cached: {cache_name}]"
                 else:
                     cache_info = " [save_number: true]"
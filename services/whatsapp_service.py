@@ -4,13 +4,17 @@ import logging
 import base64
 import io
 import threading
+import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from typing import Dict, List, Optional
+from .log_config import Truncated, get_category_logger
+from .metrics import graph_request_duration_seconds, graph_requests_total
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
+graph_log = get_category_logger(__name__, 'graph')
 
 
 class WhatsAppService:
@@ -56,6 +60,26 @@ class WhatsAppService:
     
     def _get_url(self) -> str:
         return f"{self.base_url}/{self.version}/{self._get_phone_number_id()}/messages"
+
+    def _graph_request(self, method: str, url: str, message_type: str, **kwargs) -> requests.Response:
+        """Llamada a la Graph API registrando latencia por tipo de mensaje y código de estado"""
+        started = time.perf_counter()
+        status_code = 'error'
+        try:
+            response = requests.request(method, url, **kwargs)
+            status_code = str(response.status_code)
+            return response
+        finally:
+            graph_requests_total.inc(message_type=message_type, status_code=status_code)
+            graph_request_duration_seconds.observe(time.perf_counter() - started,
+                                                   message_type=message_type, status_code=status_code)
+
+    def _post_message(self, payload: Dict) -> requests.Response:
+        """Envía un payload al endpoint /messages"""
+        message_type = payload.get('type', 'unknown')
+        if message_type == 'interactive':
+            message_type = f"interactive.{payload.get('interactive', {}).get('type', 'unknown')}"
+        return self._graph_request('POST', self._get_url(), message_type, headers=self._get_headers(), json=payload)
     
     def send_text_message(self, to: str, message: str) -> Dict:
         """Envía un mensaje de texto"""
@@ -67,11 +91,7 @@ class WhatsAppService:
         }
         
         try:
-            response = requests.post(
-                self._get_url(),
-                headers=self._get_headers(),
-                json=payload
-            )
+            response = self._post_message(payload)
             
             if response.status_code == 200:
                 logger.info(f"Mensaje enviado exitosamente a {to}")
@@ -113,14 +133,10 @@ class WhatsAppService:
             }]
         
         # Log del payload para debugging
-        logger.info(f"Enviando plantilla '{template_name}' a {to} con payload: {payload}")
+        graph_log.info("Enviando plantilla '%s' a %s", template_name, to, payload=Truncated(payload))
         
         try:
-            response = requests.post(
-                self._get_url(),
-                headers=self._get_headers(),
-                json=payload
-            )
+            response = self._post_message(payload)
             
             if response.status_code == 200:
                 logger.info(f"Plantilla enviada exitosamente a {to}")
@@ -251,11 +267,7 @@ class WhatsAppService:
         }
         
         try:
-            response = requests.post(
-                self._get_url(),
-                headers=self._get_headers(),
-                json=payload
-            )
+            response = self._post_message(payload)
             
             if response.status_code == 200:
                 logger.info(f"Mensaje interactivo enviado exitosamente a {to}")
@@ -402,11 +414,7 @@ class WhatsAppService:
             }
         }
         try:
-            response = requests.post(
-                self._get_url(),
-                headers=self._get_headers(),
-                json=payload
-            )
+            response = self._post_message(payload)
             if response.status_code == 200:
                 logger.info(f"Mensaje de lista enviado exitosamente a {to}")
                 return {"success": True, "data": response.json()}
@@ -525,11 +533,7 @@ class WhatsAppService:
         }
         
         try:
-            response = requests.post(
-                self._get_url(),
-                headers=self._get_headers(),
-                json=payload
-            )
+            response = self._post_message(payload)
             
             if response.status_code == 200:
                 logger.info(f"Mensaje con botones enviado exitosamente a {to}")
@@ -711,7 +715,7 @@ class WhatsAppService:
                 'messaging_product': (None, 'whatsapp')
             }
             
-            response = requests.post(upload_url, headers=headers, files=files)
+            response = self._graph_request('POST', upload_url, 'media_upload', headers=headers, files=files)
             
             if response.status_code == 200:
                 media_id = response.json().get('id')
@@ -744,11 +748,7 @@ class WhatsAppService:
         }
         
         try:
-            response = requests.post(
-                self._get_url(),
-                headers=self._get_headers(),
-                json=payload
-            )
+            response = self._post_message(payload)
             
             if response.status_code == 200:
                 logger.info(f"Solicitud de ubicación enviada exitosamente a {to}")
@@ -766,7 +766,7 @@ class WhatsAppService:
         url = f"{self.base_url}/{self.version}/{media_id}"
         
         try:
-            response = requests.get(url, headers=self._get_headers())
+            response = self._graph_request('GET', url, 'media_url', headers=self._get_headers())
             
             if response.status_code == 200:
                 return response.json().get('url')
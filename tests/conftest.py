@@ -0,0 +1,40 @@
+"""
+Configuración común de las pruebas: el entorno se fija antes de importar los servicios,
+que leen su configuración de variables de entorno al crearse.
+"""
+
+import logging
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_data_dir = tempfile.mkdtemp(prefix='webhook-tests-')
+os.environ.setdefault('WEBHOOK_DLQ_PATH', os.path.join(_data_dir, 'dead_letters.db'))
+os.environ.setdefault('WEBHOOK_JOURNAL_PATH', os.path.join(_data_dir, 'journal.db'))
+os.environ.setdefault('CACHE_DB_PATH', os.path.join(_data_dir, 'cache.db'))
+os.environ.setdefault('METRICS_MULTIPROC_DIR', os.path.join(_data_dir, 'metrics'))
+os.environ.setdefault('TRACING_ENABLED', 'false')
+# Backoff corto: los reintentos de las pruebas no deben esperar segundos
+os.environ.setdefault('WEBHOOK_RETRY_BASE_DELAY', '0.0005')
+os.environ.setdefault('WEBHOOK_RETRY_MAX_DELAY', '0.002')
+
+import pytest
+
+from services import dead_letter_store
+
+
+@pytest.fixture(autouse=True)
+def quiet_logs():
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+@pytest.fixture
+def dlq(tmp_path, monkeypatch):
+    """Dead-letter queue propia de la prueba (la instancia global apunta a su archivo)"""
+    store = dead_letter_store.DeadLetterStore(str(tmp_path / 'dead_letters.db'))
+    monkeypatch.setattr(dead_letter_store, '_dead_letter_store', store)
+    return store
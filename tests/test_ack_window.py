@@ -0,0 +1,84 @@
+import json
+import time
+
+import pytest
+
+from services.message_queue_service import QueueLane
+from services.webhook_event import WebhookEvent
+
+
+class FakeConnection:
+    """Conexión WebSocket simulada: registra los frames enviados"""
+
+    def __init__(self):
+        self.connected = True
+        self.frames = []
+
+    def send(self, frame):
+        self.frames.append(json.loads(frame))
+
+    def close(self, timeout=None):
+        self.connected = False
+
+
+@pytest.fixture
+def lane(dlq):
+    lane = QueueLane('default', 0, 1)
+    lane.max_attempts = 3
+    service = lane.websocket_service
+    service.max_attempts = 3
+    service.ws = FakeConnection()
+    service.negotiated_capabilities = frozenset({service.ACK_CAPABILITY})
+    return lane
+
+
+def send_in_flight(lane, count: int):
+    """Encola y envía `count` eventos como lo haría el procesador: quedan en la ventana sin ack"""
+    for seq in range(count):
+        lane.message_queue.put(WebhookEvent({"sender": "573001112233", "seq": seq}, received_at=time.time()))
+    events = [lane.message_queue.get_nowait() for _ in range(count)]
+    assert lane.websocket_service.send_batch(events) is True
+    return events
+
+
+def test_unacked_events_are_redelivered_in_order_on_reconnect(lane):
+    service = lane.websocket_service
+    events = send_in_flight(lane, 3)
+    assert list(service.unacked) == [1, 2, 3]
+
+    # El consumidor confirma el primero y la conexión se cae: solo se reenvían los pendientes
+    service._handle_incoming(b'{"ack": 1}')
+    reconnected = FakeConnection()
+    service._redeliver_unacked(reconnected)
+
+    assert [frame["seq"] for frame in reconnected.frames] == [1, 2]
+    assert [event.attempts for event in events[1:]] == [1, 1]
+    assert service.redelivered == 2
+    assert list(service.unacked) == [2, 3]
+
+    service._handle_incoming(b'{"ack": 3}')
+    assert not service.unacked
+    assert lane.message_queue.unfinished_tasks == 0
+
+
+def test_events_without_ack_go_to_dead_letter_queue_after_max_attempts(lane, dlq):
+    service = lane.websocket_service
+    send_in_flight(lane, 2)
+
+    for _ in range(lane.max_attempts - 1):
+        reconnected = FakeConnection()
+        service._redeliver_unacked(reconnected)
+        assert len(reconnected.frames) == 2
+    assert dlq.count() == 0
+
+    # El último reenvío agota los intentos: los eventos salen de la ventana hacia la DLQ
+    reconnected = FakeConnection()
+    service._redeliver_unacked(reconnected)
+
+    assert reconnected.frames == []
+    assert not service.unacked
+    assert lane.dead_lettered == 2
+    assert lane.message_queue.unfinished_tasks == 0
+    dead_letters = dlq.list()["items"]
+    assert [item["attempts"] for item in dead_letters] == [3, 3]
+    assert all(item["sink"] == 'default' for item in dead_letters)
@@ -0,0 +1,60 @@
+import threading
+import time
+
+import pytest
+
+from app import app
+from services.message_queue_service import MessageQueueService
+from services.webhook_event import WebhookEvent
+
+
+def dead_letter(dlq, count: int, sink: str = 'default'):
+    events = [WebhookEvent({"sender": "573001112233", "seq": seq}, received_at=time.time()) for seq in range(count)]
+    dlq.add(sink, events, "ConnectionError: simulado")
+
+
+def test_concurrent_takes_never_return_the_same_event(dlq):
+    dead_letter(dlq, 200)
+    taken = []
+    lock = threading.Lock()
+
+    def take():
+        while True:
+            records = dlq.take(limit=7)
+            if not records:
+                return
+            with lock:
+                taken.extend(record["id"] for record in records)
+
+    threads = [threading.Thread(target=take) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(taken) == list(range(1, 201))
+    assert dlq.count() == 0
+
+
+def test_failed_replay_returns_events_to_dead_letter_queue(dlq, monkeypatch):
+    dead_letter(dlq, 2)
+    dead_letter(dlq, 1, sink='desconocido')
+    monkeypatch.setattr(MessageQueueService, 'add_message_to_queue',
+                        lambda self, event: {"success": False, "error": "cola llena"})
+
+    result = MessageQueueService().replay_dead_letters(limit=10)
+
+    assert result["success"] and result["replayed"] == 0
+    assert sorted(item["id"] for item in result["failed"]) == [1, 2, 3]
+    items = dlq.list()["items"]
+    assert [item["id"] for item in items] == [1, 2, 3]
+    assert items[0]["attempts"] == 0 and items[0]["error"] == "ConnectionError: simulado"
+
+
+@pytest.mark.parametrize('body', [{"limit": "5"}, {"limit": -1}, {"limit": 2.5}, {"limit": True}])
+def test_replay_rejects_invalid_limit(dlq, body):
+    client = app.test_client()
+    for path in ('/api/queue/dead_letters/replay', '/api/queue/retry_failed'):
+        response = client.post(path, json=body)
+        assert response.status_code == 400
+        assert "'limit'" in response.get_json()["error"]
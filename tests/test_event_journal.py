@@ -0,0 +1,96 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+from services.event_journal import EventJournal
+from services.webhook_event import WebhookEvent
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def journal_env(tmp_path, monkeypatch):
+    path = str(tmp_path / 'journal.db')
+    monkeypatch.setenv('WEBHOOK_JOURNAL_ENABLED', 'true')
+    monkeypatch.setenv('WEBHOOK_JOURNAL_PATH', path)
+    monkeypatch.setenv('WEBHOOK_JOURNAL_SYNCHRONOUS', 'NORMAL')
+    return path
+
+
+def crash_after_appending(count: int, acked: int):
+    """Otro proceso encola `count` eventos, confirma los `acked` primeros y muere sin limpiar"""
+    script = textwrap.dedent(f'''
+        import os, sys, time
+        sys.path.insert(0, {REPO_ROOT!r})
+        from services.event_journal import EventJournal
+        from services.webhook_event import WebhookEvent
+
+        journal = EventJournal()
+        events = []
+        for seq in range({count}):
+            event = WebhookEvent({{"sender": "573001112233", "seq": seq}}, enrichment={{"seq": seq}}, received_at=seq)
+            event.journal_id = journal.append('default', event)
+            events.append(event)
+        journal.ack(events[:{acked}])
+        while journal.pending_count() != {count - acked}:
+            time.sleep(0.01)
+        os._exit(0)
+    ''')
+    subprocess.run([sys.executable, '-c', script], check=True, env=os.environ.copy(), timeout=60)
+
+
+def test_replay_after_crash_returns_unacked_events_in_order(journal_env):
+    crash_after_appending(count=5, acked=2)
+
+    journal = EventJournal()
+    events = journal.replay('default')
+
+    assert [event.payload["seq"] for event in events] == [2, 3, 4]
+    assert [event.enrichment for event in events] == [{"seq": 2}, {"seq": 3}, {"seq": 4}]
+    assert [event.received_at for event in events] == [2, 3, 4]
+    assert all(event.journal_id is not None for event in events)
+    assert journal.replay('other-sink') == []
+
+
+def test_replay_claims_rows_once_per_process(journal_env):
+    crash_after_appending(count=3, acked=0)
+
+    journal = EventJournal()
+    assert len(journal.replay('default')) == 3
+    # Las filas ya son de este proceso: un segundo replay no las duplica
+    assert journal.replay('default') == []
+
+    # El siguiente proceso (otro token) las recupera si este también muere sin confirmarlas
+    successor = EventJournal()
+    assert [event.payload["seq"] for event in successor.replay('default')] == [0, 1, 2]
+
+
+def test_acked_events_are_not_replayed(journal_env):
+    journal = EventJournal()
+    event = WebhookEvent({"sender": "573001112233", "seq": 0})
+    event.journal_id = journal.append('default', event)
+    journal.ack([event])
+
+    for _ in range(500):
+        if journal.pending_count() == 0:
+            break
+        time.sleep(0.01)
+    assert EventJournal().replay('default') == []
+
+
+def test_replay_discards_corrupt_rows(journal_env):
+    crash_after_appending(count=2, acked=0)
+    conn = sqlite3.connect(journal_env)
+    with conn:
+        conn.execute("INSERT INTO journal_events (sink, body, owner_token) VALUES ('default', ?, 'muerto')",
+                     (b'{no es json',))
+    conn.close()
+
+    journal = EventJournal()
+    assert [event.payload["seq"] for event in journal.replay('default')] == [0, 1]
+    assert journal.pending_count() == 2
@@ -0,0 +1,53 @@
+import json
+import os
+import socket
+import time
+
+import pytest
+
+from services.metrics import MetricsRegistry
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setenv('METRICS_MULTIPROC_DIR', str(tmp_path))
+    monkeypatch.setenv('METRICS_FLUSH_INTERVAL', '3600')
+    registry = MetricsRegistry()
+    registry.counter('webhooks_total', 'Webhooks recibidos').inc(2)
+    return registry
+
+
+def write_snapshot(registry, filename: str, value: float, written_at: float = None):
+    snapshot = {"webhooks_total": {"type": "counter", "help": "Webhooks recibidos", "labelnames": [],
+                                   "buckets": [], "samples": [[[], value]]}}
+    with open(os.path.join(registry.multiproc_dir, filename), 'w') as f:
+        json.dump({"pid": 1, "written_at": written_at or time.time(), "metrics": snapshot}, f)
+
+
+def total(registry) -> str:
+    return [line for line in registry.render().splitlines() if line.startswith('webhooks_total')][0]
+
+
+def test_snapshot_of_previous_process_with_reused_pid_is_retired(registry):
+    prefix = f"{socket.gethostname()}-{os.getpid()}"
+    # Procesos anteriores del contenedor con el mismo pid (formato con uuid y formato anterior)
+    write_snapshot(registry, f"{prefix}-{'0' * 32}.json", 5)
+    write_snapshot(registry, f"{prefix}.json", 7)
+    # Otro worker vivo: se suma pero no se retira
+    write_snapshot(registry, f"{prefix}0-{'1' * 32}.json", 11)
+    registry.flush()
+
+    assert total(registry) == 'webhooks_total 25'
+    files = sorted(os.listdir(registry.multiproc_dir))
+    assert files == sorted([f"{prefix}-{registry.process_token}.json", f"{prefix}0-{'1' * 32}.json",
+                            'retired.json', 'retired.lock'])
+    # Lo acumulado no se vuelve a sumar en el siguiente scrape
+    assert total(registry) == 'webhooks_total 25'
+
+
+def test_stale_snapshots_are_accumulated_once(registry):
+    write_snapshot(registry, f"otro-host-99-{'2' * 32}.json", 3, written_at=time.time() - 3600)
+
+    assert total(registry) == 'webhooks_total 5'
+    assert total(registry) == 'webhooks_total 5'
+    assert f"otro-host-99-{'2' * 32}.json" not in os.listdir(registry.multiproc_dir)
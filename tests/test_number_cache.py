@@ -0,0 +1,135 @@
+import sqlite3
+
+import pytest
+
+from services.simple_cache import NumberCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return NumberCache(str(tmp_path / 'cache.db'))
+
+
+def test_cursor_pagination_is_stable_across_inserts(cache):
+    existing = [f"5730000{index:05d}" for index in range(250)]
+    assert cache.bulk_upsert([{"phone": phone, "name": phone} for phone in existing])["success"]
+
+    seen = []
+    cursor = None
+    page_number = 0
+    while True:
+        page = cache.list_numbers(limit=40, cursor=cursor)
+        seen += [number["phone"] for number in page["numbers"]]
+        # Números nuevos entre páginas: quedan antes del cursor y no desplazan a los ya listados
+        page_number += 1
+        cache.add_number(f"5731111{page_number:05d}")
+        cache.bulk_upsert([{"phone": f"5732222{page_number:05d}"}])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(seen) == len(set(seen))
+    assert sorted(seen) == existing
+
+
+def test_iter_numbers_visits_every_row_once(cache):
+    phones = [f"5730000{index:05d}" for index in range(95)]
+    cache.bulk_upsert([{"phone": phone} for phone in phones])
+
+    visited = [number["phone"] for number in cache.iter_numbers(batch_size=10)]
+
+    assert sorted(visited) == phones
+
+
+def test_invalid_cursor_is_rejected(cache):
+    with pytest.raises(ValueError):
+        cache.list_numbers(cursor='no-es-un-cursor')
+
+
+STORED = {"a": {"b": 1}, "arr": [10, 20], "keep": True, "drop.me": 1}
+
+
+@pytest.mark.parametrize('patch', [
+    # Llaves con caracteres de ruta JSON: se actualiza la llave literal, nunca una ruta anidada
+    {"a.b": 2, "$": "raíz", "$.keep": False, "arr[0]": "x", "[1]": "y", "drop.me": "__DELETE__"},
+    # Con comillas dobles el parche se aplica en Python: mismo resultado
+    {'x"y': 1, 'a."b': 2, "arr[0]": "x", "$": "raíz", "drop.me": "__DELETE__"},
+], ids=['sql', 'python'])
+def test_bulk_update_treats_keys_literally(cache, patch):
+    phones = ["573001110001", "573001110002"]
+    cache.bulk_upsert([{"phone": phone, "data": STORED} for phone in phones])
+
+    results = cache.bulk_update_number_data(phones + ["573009999999"], patch)
+
+    assert [result["success"] for result in results] == [True, True, False]
+    assert results[2]["error"] == "Number not found"
+    expected = dict(STORED)
+    expected.update({key: value for key, value in patch.items() if value != '__DELETE__'})
+    for key in [key for key, value in patch.items() if value == '__DELETE__']:
+        expected.pop(key, None)
+    for phone in phones:
+        assert cache.get_number(phone)["data"] == expected
+
+
+@pytest.mark.parametrize('patch', [{"k.1": 1}, {'k"1': 1}], ids=['sql', 'python'])
+def test_bulk_update_reports_rows_with_malformed_data(cache, patch):
+    cache.bulk_upsert([{"phone": "573001110001", "data": {"ok": 1}}, {"phone": "573001110002"}])
+    conn = sqlite3.connect(cache.db_path)
+    with conn:
+        conn.execute("INSERT INTO numbers (phone, data, created_at, updated_at) VALUES "
+                     "('573001110003', '{roto', '2024-01-01', '2024-01-01'), "
+                     "('573001110004', '[1, 2]', '2024-01-01', '2024-01-01')")
+    conn.close()
+
+    results = cache.bulk_update_number_data(["573001110001", "573001110002", "573001110003", "573001110004"], patch)
+
+    assert [result["success"] for result in results] == [True, True, False, False]
+    assert results[2]["error"] == results[3]["error"] == NumberCache.INVALID_STORED_DATA
+    assert cache.get_number("573001110001")["data"] == {"ok": 1, **patch}
+    assert cache.get_number("573001110002")["data"] == patch
+
+
+def insert_log_rows(cache) -> int:
+    with cache.db.read() as conn:
+        return conn.execute('SELECT COUNT(*) FROM number_inserts').fetchone()[0]
+
+
+def test_insert_log_is_trimmed_to_the_slowest_reader(tmp_path, monkeypatch):
+    monkeypatch.setenv('CACHE_INSERT_LOG_TRIM_SECONDS', '0')
+    monkeypatch.setenv('CACHE_LRU_SIZE', '0')
+    path = str(tmp_path / 'cache.db')
+    # Dos procesos sobre el mismo archivo (cada instancia tiene sus propias conexiones)
+    writer, reader = NumberCache(path), NumberCache(path)
+    reader._trim_insert_log()
+
+    for index in range(50):
+        writer.add_number(f"5730000{index:05d}")
+    # El lector aún no aplicó ninguna alta: no se borra nada
+    assert insert_log_rows(writer) == 50
+
+    assert reader.exists("573000000049")
+    # Ambos aplicaron todo: solo queda la última fila
+    assert insert_log_rows(writer) == 1
+
+    for index in range(50, 60):
+        writer.add_number(f"5730000{index:05d}")
+    assert insert_log_rows(writer) == 10
+
+
+def test_stale_reader_rebuilds_after_the_log_is_trimmed(tmp_path, monkeypatch):
+    monkeypatch.setenv('CACHE_INSERT_LOG_TRIM_SECONDS', '0')
+    monkeypatch.setenv('CACHE_LRU_SIZE', '0')
+    path = str(tmp_path / 'cache.db')
+    writer, reader = NumberCache(path), NumberCache(path)
+    reader._trim_insert_log()
+    with writer.db.write() as conn:
+        # El lector dejó de reportar hace más que el TTL: ya no frena el recorte
+        conn.execute('UPDATE bloom_readers SET reported_at = 0')
+
+    for index in range(20):
+        writer.add_number(f"5730000{index:05d}")
+    assert insert_log_rows(writer) == 1
+
+    rebuilds = reader.bloom_stats["rebuilds"]
+    assert all(reader.exists(f"5730000{index:05d}") for index in range(20))
+    assert reader.bloom_stats["rebuilds"] == rebuilds + 1
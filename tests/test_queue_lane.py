@@ -0,0 +1,148 @@
+import random
+import threading
+import time
+import zlib
+
+import pytest
+
+from services.message_queue_service import MessageQueueService, QueueLane
+from services.webhook_event import WebhookEvent
+from services.websocket_service import WebSocketService
+
+
+class FlakyWebSocket(WebSocketService):
+    """Consumidor simulado: acepta lotes, falla al azar (envío o conexión) y registra lo entregado"""
+
+    def __init__(self, failure_rate: float, outage_rate: float, seed: int):
+        super().__init__('ws://tests.invalid')
+        self.batch_enabled = True
+        self.batch_max_events = 20
+        self.batch_linger = 0
+        self.failure_rate = failure_rate
+        self.outage_rate = outage_rate
+        self.rng = random.Random(seed)
+        self.delivered = []
+        self.failures = 0
+
+    def batching_active(self) -> bool:
+        return True
+
+    def wait_for_ack_window(self):
+        pass
+
+    def redeliver_stale(self):
+        pass
+
+    def _deliver(self, events) -> bool:
+        roll = self.rng.random()
+        if roll < self.outage_rate:
+            self.reconnect_failures = 1
+            raise ConnectionRefusedError("consumidor caído (simulado)")
+        self.reconnect_failures = 0
+        if roll < self.outage_rate + self.failure_rate:
+            self.failures += 1
+            raise ConnectionResetError("envío fallido (simulado)")
+        self.delivered.extend(events)
+        return False
+
+    def send_batch(self, events) -> bool:
+        return self._deliver(events)
+
+    def send_message(self, message_data) -> bool:
+        return self._deliver([message_data])
+
+
+@pytest.mark.parametrize('producers', [1, 4, 16])
+def test_retry_slot_keeps_per_sender_order_under_concurrent_producers(producers):
+    lane_count = 4
+    per_producer = 500
+    lanes = []
+    for index in range(lane_count):
+        lane = QueueLane('default', index, lane_count)
+        lane.websocket_service = FlakyWebSocket(failure_rate=0.1, outage_rate=0.05, seed=index)
+        # Sin dead-letter queue: todo evento debe terminar entregado
+        lane.max_attempts = 0
+        lanes.append(lane)
+        lane.start()
+
+    def produce(producer: int):
+        rng = random.Random(producer)
+        senders = [f"57300{producer:02d}{k:05d}" for k in range(20)]
+        next_seq = dict.fromkeys(senders, 0)
+        for _ in range(per_producer):
+            sender = rng.choice(senders)
+            event = WebhookEvent({"sender": sender, "seq": next_seq[sender]}, received_at=time.time())
+            next_seq[sender] += 1
+            event.queued_at = time.time()
+            # Mismo reparto que MessageQueueService.lane_for: hash estable del remitente
+            lanes[zlib.crc32(sender.encode('utf-8')) % lane_count].message_queue.put(event)
+
+    threads = [threading.Thread(target=produce, args=(producer,)) for producer in range(producers)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for lane in lanes:
+            lane.message_queue.join()
+    finally:
+        for lane in lanes:
+            lane.stop()
+
+    delivered = [event.payload for lane in lanes for event in lane.websocket_service.delivered]
+    by_sender = {}
+    for payload in delivered:
+        by_sender.setdefault(payload["sender"], []).append(payload["seq"])
+
+    assert len(delivered) == producers * per_producer
+    assert sum(lane.websocket_service.failures for lane in lanes) > 0
+    for sender, seqs in by_sender.items():
+        assert seqs == list(range(len(seqs))), f"orden roto, duplicado o pérdida para {sender}"
+
+
+def multi_sender_webhook():
+    return {"object": "whatsapp_business_account", "entry": [{"id": "WABA", "changes": [{"field": "messages", "value": {
+        "messaging_product": "whatsapp",
+        "metadata": {"phone_number_id": "111"},
+        "contacts": [{"wa_id": "573001"}, {"wa_id": "573002"}],
+        "messages": [{"id": "m1", "from": "573001", "type": "text", "text": {"body": "a"}},
+                     {"id": "m2", "from": "573002", "type": "text", "text": {"body": "b"}},
+                     {"id": "m3", "from": "573001", "type": "text", "text": {"body": "c"}}],
+        "statuses": [{"id": "s1", "status": "read"}]
+    }}]}]}
+
+
+def test_multi_sender_webhook_is_split_per_sender():
+    enrichment = {"save_number": True, "cached_info": {"name": "Ana"}, "messages_cache_info": [
+        {"message_id": "m1", "from": "573001", "save_number": True, "cached_info": {"name": "Ana"}},
+        {"message_id": "m2", "from": "573002", "save_number": False, "cached_info": None},
+        {"message_id": "m3", "from": "573001", "save_number": True, "cached_info": {"name": "Ana"}},
+    ]}
+    event = WebhookEvent(multi_sender_webhook(), raw_body=b'{}', enrichment=enrichment, received_at=1.0)
+
+    first, second = event.split_by_sender()
+
+    assert first.envelope.message_ids == ("m1", "m3") and second.envelope.message_ids == ("m2",)
+    assert first.envelope.statuses == (("s1", "read"),) and second.envelope.statuses == ()
+    assert first.payload["entry"][0]["changes"][0]["value"]["contacts"] == [{"wa_id": "573001"}]
+    assert second.payload["entry"][0]["changes"][0]["value"]["contacts"] == [{"wa_id": "573002"}]
+    assert [info["message_id"] for info in second.enrichment["messages_cache_info"]] == ["m2"]
+    assert second.enrichment["save_number"] is False and "cached_info" not in second.enrichment
+    assert first.enrichment["cached_info"] == {"name": "Ana"}
+    assert first.raw_body is None and second.received_at == 1.0
+    # El webhook original no se modifica
+    assert len(event.payload["entry"][0]["changes"][0]["value"]["messages"]) == 3
+
+
+def test_multi_sender_webhook_goes_to_each_sender_lane(monkeypatch):
+    monkeypatch.setenv('WEBHOOK_QUEUE_LANES', '4')
+    service = MessageQueueService('split-test')
+    monkeypatch.setattr(service, '_ensure_processor_running', lambda: None)
+
+    assert service.add_message_to_queue(multi_sender_webhook(), received_at=1.0)["success"]
+
+    queued = {lane.index: [item.envelope.sender for item in lane.message_queue.queue] for lane in service.lanes}
+    for sender in ("573001", "573002"):
+        lane = service.lanes[zlib.crc32(sender.encode('utf-8')) % 4]
+        assert queued[lane.index].count(sender) == 1
+    assert sum(len(senders) for senders in queued.values()) == 2
@@ -0,0 +1,50 @@
+import pytest
+
+from services.message_queue_service import MessageQueueService
+from services.status_coalescer import StatusCoalescer
+
+
+def status_webhook(*statuses):
+    return {"object": "whatsapp_business_account", "entry": [{"id": "WABA", "changes": [{"field": "messages", "value": {
+        "metadata": {"phone_number_id": "111"},
+        "statuses": [{"id": message_id, "status": status, "timestamp": timestamp}
+                     for message_id, status, timestamp in statuses]
+    }}]}]}
+
+
+@pytest.fixture
+def coalescer(monkeypatch):
+    monkeypatch.setenv('STATUS_COALESCE_ENABLED', 'true')
+    coalescer = StatusCoalescer()
+    # Sin hilo de flush: la prueba decide cuándo se vacía el buffer
+    monkeypatch.setattr(coalescer, '_ensure_flush_thread', lambda: None)
+    return coalescer
+
+
+def test_failed_enqueue_keeps_statuses_buffered(coalescer, monkeypatch):
+    enqueued = []
+    results = iter([{"success": False, "error": "cola llena"}, {"success": True}])
+
+    def add_message_to_queue(self, event):
+        result = next(results)
+        if result["success"]:
+            enqueued.append(event.payload)
+        return result
+
+    monkeypatch.setattr(MessageQueueService, 'add_message_to_queue', add_message_to_queue)
+
+    coalescer.add(status_webhook(("m1", "sent", 1), ("m2", "delivered", 2)), received_at=100.0)
+    coalescer.flush()
+    assert coalescer.get_stats()["buffered"] == 2
+    assert coalescer.get_stats()["digests_sent"] == 0
+
+    # Llega un status más nuevo de m1 mientras el digest fallido espera
+    coalescer.add(status_webhook(("m1", "read", 3), ("m3", "sent", 4)), received_at=200.0)
+    coalescer.flush()
+
+    statuses = enqueued[0]["entry"][0]["changes"][0]["value"]["statuses"]
+    assert [(status["id"], status["status"]) for status in statuses] == [("m1", "read"), ("m2", "delivered"), ("m3", "sent")]
+    stats = coalescer.get_stats()
+    assert stats["buffered"] == 0
+    assert stats["digests_sent"] == 1
+    assert stats["statuses_forwarded"] == 3